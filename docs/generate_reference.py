@@ -70,7 +70,10 @@ STRUCTURE = [
         ],
     ),
     ("Data import/export", ["csv export", "csv import", "mount", "singer target"]),
-    ("Miscellaneous", ["rm", "init", "cleanup", "prune", "config", "dump", "eval", "upgrade"]),
+    (
+        "Miscellaneous",
+        ["rm", "init", "cleanup", "evict", "prune", "config", "dump", "eval", "upgrade"],
+    ),
     ("Sharing images", ["clone", "push", "pull", "upstream"]),
     ("Splitfile execution", ["build", "rebuild", "provenance", "dependents"]),
     (
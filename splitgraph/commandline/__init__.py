@@ -34,10 +34,12 @@ from splitgraph.commandline.image_info import (
 )
 from splitgraph.commandline.ingestion import csv_group
 from splitgraph.commandline.misc import (
+    backfill_index_c,
     cleanup_c,
     config_c,
     dump_c,
     eval_c,
+    evict_c,
     init_c,
     prune_c,
     rm_c,
@@ -201,6 +203,8 @@ cli.add_command(mount_c)
 cli.add_command(rm_c)
 cli.add_command(init_c)
 cli.add_command(cleanup_c)
+cli.add_command(backfill_index_c)
+cli.add_command(evict_c)
 cli.add_command(prune_c)
 cli.add_command(config_c)
 cli.add_command(dump_c)
@@ -134,7 +134,8 @@ def commit_c(
     `--index-options` expects a JSON-serialized dictionary of `{table: index_type: column: index_specific_kwargs}`.
     Indexes are used to narrow down the amount of chunks to scan through when running a query. By default, each column
     has a range index (minimum and maximum values) and it's possible to add bloom filtering to speed up queries that
-    involve equalities.
+    involve equalities. Splitgraph can also collect statistics on some columns (number of NULLs, approximate number
+    of distinct values and a histogram of values), used to estimate the number of rows a query will return.
 
     Bloom filtering allows to trade off between the space overhead of the index and the probability of a false
     positive (claiming that an object contains a record when it actually doesn't, leading to extra scans).
@@ -154,7 +155,9 @@ def commit_c(
             # Only compute the range index on these columns. By default,
             # it's computed on all columns and is always computed on the
             # primary key no matter what.
-            "range": ["column_2", "column_3"]
+            "range": ["column_2", "column_3"],
+            # Collect statistics on these columns.
+            "stats": ["column_2"]
         }
     }
     ```
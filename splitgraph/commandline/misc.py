@@ -212,6 +212,104 @@ def cleanup_c():
     click.echo("Deleted %s." % pluralise("object", len(deleted)))
 
 
+@click.command(name="backfill-index")
+def backfill_index_c():
+    """
+    Precompute extra index data for objects indexed by older versions of Splitgraph.
+
+    Currently, this stores the surrogate primary key boundaries of objects belonging
+    to tables without a primary key, so that querying these tables doesn't need
+    to calculate them on the engine.
+    """
+    from splitgraph.core.object_manager import ObjectManager
+
+    from ..core.output import pluralise
+    from ..engine.config import get_engine
+
+    updated = ObjectManager(get_engine()).backfill_surrogate_pks()
+    click.echo("Updated the index of %s." % pluralise("object", len(updated)))
+
+
+@click.command(name="evict")
+@click.option(
+    "-d",
+    "--daemon",
+    is_flag=True,
+    default=False,
+    help="Keep running and checking the cache occupancy in the background",
+)
+@click.option("--high-watermark", type=float, help="Default SG_EVICTION_HIGH_WATERMARK")
+@click.option("--low-watermark", type=float, help="Default SG_EVICTION_LOW_WATERMARK")
+@click.option("--interval", type=float, help="Default SG_EVICTION_INTERVAL")
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write eviction metrics as JSON to this file after every check",
+)
+def evict_c(daemon, high_watermark, low_watermark, interval, metrics_file):
+    """
+    Free up space in the object cache.
+
+    If the occupancy of the object cache is above the high watermark (as a fraction of its size),
+    this deletes objects that aren't currently in use to bring it down to the low watermark.
+
+    With `--daemon`, this keeps checking the occupancy every `--interval` seconds. Running this
+    alongside the engine means that queries that need to download objects don't need to run
+    eviction themselves:
+
+    ```
+    sgr evict --daemon --high-watermark 0.9 --low-watermark 0.75
+    ```
+
+    Eviction metrics (number of evictions, bytes freed, time spent) are output on exit and,
+    with `--metrics-file`, written out after every check.
+    """
+    import json
+
+    from splitgraph.config import CONFIG
+    from splitgraph.config.config import get_singleton
+    from splitgraph.core.eviction import EvictionWorker
+    from splitgraph.core.object_manager import ObjectManager
+
+    from ..core.output import pretty_size
+    from ..engine.config import get_engine
+
+    worker = EvictionWorker(
+        ObjectManager(get_engine()),
+        high_watermark=high_watermark
+        if high_watermark is not None
+        else float(get_singleton(CONFIG, "SG_EVICTION_HIGH_WATERMARK")),
+        low_watermark=low_watermark
+        if low_watermark is not None
+        else float(get_singleton(CONFIG, "SG_EVICTION_LOW_WATERMARK")),
+        interval=interval
+        if interval is not None
+        else float(get_singleton(CONFIG, "SG_EVICTION_INTERVAL")),
+    )
+
+    def _write_metrics(metrics):
+        if metrics_file:
+            with open(metrics_file, "w") as f:
+                json.dump(metrics.as_dict(), f)
+
+    try:
+        worker.run(max_checks=None if daemon else 1, callback=_write_metrics)
+    except KeyboardInterrupt:
+        pass
+
+    metrics = worker.metrics
+    click.echo(
+        "Ran %d check(s), %d eviction(s): freed %s in %.3fs. Cache occupancy: %s."
+        % (
+            metrics.checks,
+            metrics.evictions,
+            pretty_size(metrics.bytes_freed),
+            metrics.total_eviction_time,
+            pretty_size(metrics.last_occupancy),
+        )
+    )
+
+
 @click.command(name="config")
 @click.option(
     "-s",
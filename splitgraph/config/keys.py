@@ -30,6 +30,8 @@ DEFAULTS: ConfigDict = {
     # by about 50% (101s -> 53s) for the version that runs a single big join against multiple images.
     "SG_LQ_TUNING": "SET enable_sort=off; SET enable_hashagg=on;",
     "SG_COMMIT_CHUNK_SIZE": "10000",
+    "SG_COMMIT_CHUNK_THREADS": "1",
+    "SG_COMMIT_ENGINE_PATCH_THRESHOLD": "100000",
     "SG_ENGINE_POOL": "16",
     "SG_CONFIG_FILE": "",
     "SG_META_SCHEMA": "splitgraph_meta",
@@ -43,10 +45,22 @@ DEFAULTS: ConfigDict = {
     "SG_S3_BUCKET": "splitgraph",
     "SG_S3_KEY": "",
     "SG_S3_PWD": "",
+    "SG_OBJECT_TRANSFER_RETRIES": "5",
     "SG_OBJECT_CACHE_SIZE": "10240",
     "SG_EVICTION_DECAY": "0.002",
     "SG_EVICTION_FLOOR": "1",
     "SG_EVICTION_MIN_FRACTION": "0.05",
+    "SG_EVICTION_POLICY": "decay",
+    "SG_EVICTION_TRACE": "",
+    "SG_EVICTION_HIGH_WATERMARK": "0.9",
+    "SG_EVICTION_LOW_WATERMARK": "0.75",
+    "SG_EVICTION_INTERVAL": "10",
+    "SG_QUERY_PLAN_CACHE_SIZE": "0",
+    "SG_FRAGMENT_GROUP_CACHE_SIZE": "0",
+    "SG_FRAGMENT_PREFETCH": "0",
+    "SG_FRAGMENT_APPLY_THREADS": "1",
+    "SG_FRAGMENT_APPLY_STRATEGY": "sequential",
+    "SG_INGESTION_THREADS": "1",
     "SG_FDW_CLASS": "splitgraph.core.fdw_checkout.QueryingForeignDataWrapper",
     "SG_CMD_ASCII": "false",
     # Update checks and metrics
@@ -110,6 +124,17 @@ ARGUMENT_KEY_MAP = {
     "--eviction-decay": "SG_EVICTION_DECAY",
     "--eviction-floor": "SG_EVICTION_FLOOR",
     "--eviction-fraction": "SG_EVICTION_MIN_FRACTION",
+    "--eviction-policy": "SG_EVICTION_POLICY",
+    "--eviction-high-watermark": "SG_EVICTION_HIGH_WATERMARK",
+    "--eviction-low-watermark": "SG_EVICTION_LOW_WATERMARK",
+    "--query-plan-cache-size": "SG_QUERY_PLAN_CACHE_SIZE",
+    "--fragment-group-cache-size": "SG_FRAGMENT_GROUP_CACHE_SIZE",
+    "--fragment-prefetch": "SG_FRAGMENT_PREFETCH",
+    "--fragment-apply-threads": "SG_FRAGMENT_APPLY_THREADS",
+    "--commit-chunk-threads": "SG_COMMIT_CHUNK_THREADS",
+    "--commit-engine-patch-threshold": "SG_COMMIT_ENGINE_PATCH_THRESHOLD",
+    "--fragment-apply-strategy": "SG_FRAGMENT_APPLY_STRATEGY",
+    "--ingestion-threads": "SG_INGESTION_THREADS",
     "--fdw-class": "SG_FDW_CLASS",
 }
 
@@ -147,6 +172,8 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_ENGINE_OBJECT_PATH": "Path on the engine's filesystem where Splitgraph physical object files are stored.",
     "SG_LQ_TUNING": "Postgres query planner configuration for Splitfile execution and table imports. This is run before a layered query is executed and allows to tune query planning in case of LQ performance issues. For possible values, see the [PostgreSQL documentation](https://www.postgresql.org/docs/12/runtime-config-query.html).",
     "SG_COMMIT_CHUNK_SIZE": "Default chunk size when `sgr commit` is run. Can be overriden in the command line client by passing `--chunk-size`",
+    "SG_COMMIT_CHUNK_THREADS": "Number of connections to use when splitting a table into chunks on commit. Chunk boundaries are found from the table's primary key in one pass and the chunks are then created, hashed and indexed in parallel (object IDs are the same as when chunking on one connection). Chunks are created and registered in separate transactions, so this needs the table's contents to be committed: tables without a primary key and tables with uncommitted changes in the current transaction are always chunked on one connection. The table mustn't be changed by other transactions while it's being committed (the commit fails if the chunks don't add up to the whole table). Set to 1 (default) to disable. This should be less than SG_ENGINE_POOL.",
+    "SG_COMMIT_ENGINE_PATCH_THRESHOLD": "Number of pending changes to a table above which `sgr commit` conflates the changes and builds the new fragment on the engine instead of loading the changes into Python. This uses much less memory for large updates. Changes are always conflated in Python when `--split-changesets` is passed. Set to 0 to always conflate changes on the engine.",
     "SG_ENGINE_POOL": "Size of the connection pool used to download/upload objects. Note that in the case of layered querying with joins on multiple tables, each table will use this many parallel threads to download objects, which can overwhelm the engine. Decrease this value in that case.",
     "SG_CONFIG_FILE": "Location of the Splitgraph configuration file. By default, Splitgraph looks for the configuration in `~/.splitgraph/.sgconfig` and then the current directory.",
     "SG_META_SCHEMA": "Name of the metadata schema. Note that whilst this can be changed, it hasn't been tested and won't be taken into account by engines connecting to this one.",
@@ -160,10 +187,22 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_S3_BUCKET": "S3 bucket used by the engine for object storage.",
     "SG_S3_KEY": "S3 access key.",
     "SG_S3_PWD": "S3 secure key.",
+    "SG_OBJECT_TRANSFER_RETRIES": "Number of times the engine retries uploading or downloading an object file to/from S3 after a network error. Interrupted downloads are resumed from where they stopped.",
     "SG_OBJECT_CACHE_SIZE": "Object cache size, in megabytes. This only concerns objects downloaded from an external location or a remote engine. When there is no space in the object cache, an eviction is run and objects that haven't been used recently or that are small enough to be easily redownloaded are deleted to free up space.",
     "SG_EVICTION_DECAY": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_FLOOR": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_MIN_FRACTION": "Minimum fraction of the total cache size that has to get freed when an eviction is run. This is to avoid frequent evictions.",
+    "SG_EVICTION_POLICY": "Policy used to decide which objects to delete from the object cache first when running an eviction: one of `decay` (default, see SG_EVICTION_DECAY), `lru`, `lfu`, `gdsf` or `arc`. See documentation for splitgraph.core.eviction for an explanation.",
+    "SG_EVICTION_TRACE": "Path to a file to record object cache accesses to (as CSV lines with the access timestamp, the object ID and the object size). The trace can be replayed against different eviction policies with splitgraph.core.eviction.simulate. Empty (default) disables recording.",
+    "SG_EVICTION_HIGH_WATERMARK": "Fraction of the object cache size above which the background eviction worker (`sgr evict --daemon`) starts deleting objects from the cache.",
+    "SG_EVICTION_LOW_WATERMARK": "Fraction of the object cache size that the background eviction worker frees the cache down to once it exceeds SG_EVICTION_HIGH_WATERMARK.",
+    "SG_EVICTION_INTERVAL": "Interval, in seconds, between cache occupancy checks performed by the background eviction worker.",
+    "SG_QUERY_PLAN_CACHE_SIZE": "Maximum number of layered query plans (lists of objects required to satisfy a given query on a table) cached on the engine and shared between queries. Least recently used plans are evicted first. Disabled (0) by default.",
+    "SG_FRAGMENT_GROUP_CACHE_SIZE": "Maximum number of groupings of a table's fragments into groups of overlapping fragments cached on the engine and shared between queries (one per version of a table that was queried). Least recently used groupings are evicted first. Disabled (0) by default.",
+    "SG_FRAGMENT_PREFETCH": "Number of fragments to download ahead of the ones being queried when running a layered query against a table whose fragments aren't in the object cache. Fragments are downloaded in the background in batches of this size so that the query can start running on the fragments that are already available. Set to 0 (default) to download all fragments required by the query before running it.",
+    "SG_FRAGMENT_APPLY_THREADS": "Number of connections to use when applying fragments to a table (when checking it out or running a layered query that needs to apply fragments to a staging table). Groups of fragments that don't overlap are applied in parallel to separate staging tables that are then combined. Set to 1 (default) to apply all fragments on a single connection. This should be less than SG_ENGINE_POOL.",
+    "SG_FRAGMENT_APPLY_STRATEGY": "How to apply a chain of fragments to a table: `sequential` (default) deletes and inserts the rows of every fragment in turn, `bulk` finds the final version of every row across all fragments in one query and only inserts that, which rewrites the table once instead of once per fragment. `bulk` can be faster for long chains of overlapping fragments.",
+    "SG_INGESTION_THREADS": "Number of connections to use when loading a data source that's backed by a foreign data wrapper (e.g. `sgr mount` of a PostgreSQL/MySQL database followed by a load/sync). Tables are copied and stored as Splitgraph objects concurrently, starting with the largest ones (as estimated by the query planner). Every table is copied and stored in a separate transaction. Set to 1 (default) to ingest tables one by one on a single connection. This should be less than SG_ENGINE_POOL.",
     "SG_FDW_CLASS": "Name of the class used by the layered querying foreign data wrapper on the engine. Internal.",
     "SG_CMD_ASCII": "Set to `true` to disable Unicode output in sgr. Note that `sgr sql` will still output Unicode data.",
     "SG_UPDATE_REMOTE": "Name of the Splitgraph registry to check for sgr updates.",
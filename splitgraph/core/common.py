@@ -1,7 +1,9 @@
 """
 Common internal functions used by Splitgraph commands.
 """
-from datetime import date, datetime, time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 from functools import wraps
 from random import getrandbits
@@ -14,10 +16,12 @@ from typing import (
     Optional,
     Set,
     Tuple,
+    TypeVar,
     Union,
     cast,
 )
 
+import psycopg2
 from psycopg2.sql import SQL, Identifier
 
 from splitgraph.config import SPLITGRAPH_API_SCHEMA
@@ -29,7 +33,19 @@ if TYPE_CHECKING:
     from splitgraph.core.repository import Repository
     from splitgraph.engine.postgres.engine import PostgresEngine
 
-OBJECT_MANAGER_TABLES = ["object_cache_status", "object_cache_occupancy"]
+T = TypeVar("T")
+
+# The last used timestamps of entries in caches on the engine (used to evict least recently
+# used entries) are only updated if they're older than this, so that most cache hits are reads.
+CACHE_LAST_USED_RESOLUTION = timedelta(minutes=1)
+
+OBJECT_MANAGER_TABLES = [
+    "object_cache_status",
+    "object_cache_occupancy",
+    "object_cache_ghosts",
+    "fragment_groups",
+    "query_plans",
+]
 
 
 def set_tag(repository: "Repository", image_hash: Optional[str], tag: str) -> None:
@@ -398,3 +414,46 @@ class CallbackList(list):
 def get_temporary_table_id() -> str:
     """Generate a random ID for temporary/staging objects that haven't had their ID calculated yet."""
     return str.format("sg_tmp_{:032x}", getrandbits(128))
+
+
+def run_in_separate_transaction(engine: "PostgresEngine", func: Callable[[], T]) -> T:
+    """
+    Run a function in a separate transaction on the engine and commit it straight away,
+    without committing the caller's transaction. Used to update caches on the engine that
+    are shared between processes from code that only reads data (like query planning).
+
+    The engine's connection pool gives every thread its own connection, so the function
+    is run in a short-lived thread.
+
+    :param engine: Engine
+    :param func: Function to run
+    :return: Return value of the function
+    """
+
+    def _run() -> T:
+        try:
+            result = func()
+            engine.commit()
+            return result
+        except Exception:
+            engine.rollback()
+            raise
+
+    with ThreadPoolExecutor(max_workers=1) as tpe:
+        return tpe.submit(_run).result()
+
+
+def update_engine_cache(engine: "PostgresEngine", func: Callable[[], None], cache: str) -> None:
+    """
+    Write to a cache on the engine in a separate transaction (see `run_in_separate_transaction`).
+    The caches are only an optimization, so errors (e.g. if the engine is read-only) get logged
+    instead of failing the query.
+
+    :param engine: Engine
+    :param func: Function that updates the cache
+    :param cache: Name of the cache (for logging)
+    """
+    try:
+        run_in_separate_transaction(engine, func)
+    except psycopg2.Error as e:
+        logging.warning("Error updating the %s cache: %s", cache, e)
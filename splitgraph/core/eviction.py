@@ -0,0 +1,511 @@
+"""
+Object cache eviction policies.
+
+When there's not enough space in the object cache to download objects required by a query,
+`ObjectManager.run_eviction` deletes objects that aren't currently used by anyone (have a zero
+refcount) until enough space is freed. The order in which objects get deleted is determined
+by the eviction policy (SG_EVICTION_POLICY):
+
+  * `decay` (default): Minimize the expected cost of redownloading an object, calculated as its
+    size (floored to SG_EVICTION_FLOOR to simulate latency) multiplied by an exponential decay
+    of the time since it was last used (see SG_EVICTION_DECAY).
+  * `lru`: Least Recently Used.
+  * `lfu`: Least Frequently Used, with ties broken by recency.
+  * `gdsf`: GreedyDual-Size-Frequency: evict objects with the lowest access count multiplied by the
+    cost of redownloading them per byte of cache space that they take up. The cost is the latency
+    of fetching an object (SG_EVICTION_FLOOR), so that small objects are kept over large objects
+    that are used as often. Objects also get aged by adding the priority of the last evicted
+    object to the priority of objects as they are used.
+  * `arc`: Adaptive Replacement Cache: splits the cache into objects that have been used once
+    and objects that have been used several times, evicting least recently used objects from
+    one or the other depending on the target size of the first part. The target size is adapted
+    whenever an object that has recently been evicted from one of the parts is requested again.
+
+Besides each object's last usage time, the policies use the number of times it was used since it
+was downloaded. The access counts of recently evicted objects (totalling up to the cache size) are
+kept as well ("ghost" entries), so that an object that gets redownloaded doesn't lose its access
+history.
+
+The same policies can be evaluated offline against a recorded trace of cache accesses with
+`simulate` (see SG_EVICTION_TRACE to record one).
+
+To avoid queries having to run eviction themselves, an `EvictionWorker` (`sgr evict --daemon`)
+can periodically check the cache occupancy and, once it goes above SG_EVICTION_HIGH_WATERMARK,
+free the cache down to SG_EVICTION_LOW_WATERMARK in the background.
+"""
+import csv
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from splitgraph.exceptions import ObjectCacheError
+
+if TYPE_CHECKING:
+    from splitgraph.core.object_manager import ObjectManager
+
+
+class CacheEntry(NamedTuple):
+    """An object in the cache that's a candidate for eviction"""
+
+    object_id: str
+    size: int
+    last_used: datetime
+    access_count: int
+    # Value of the cache's clock when the object was last used (see GDSFPolicy)
+    clock: float
+
+
+class GhostEntry(NamedTuple):
+    """An object that has recently been evicted from the cache"""
+
+    object_id: str
+    size: int
+    access_count: int
+
+
+class EvictionState(NamedTuple):
+    """Eviction policy state that's shared by the whole cache"""
+
+    # Aging factor for GDSF: priority of the last evicted object
+    clock: float = 0.0
+    # Target size of the "used once" part of the cache in ARC, in bytes
+    arc_target: int = 0
+
+
+class EvictionPolicy(ABC):
+    """Base class for eviction policies."""
+
+    def __init__(self, decay_constant: float, floor: float) -> None:
+        """
+        :param decay_constant: See SG_EVICTION_DECAY
+        :param floor: Objects smaller than this size (in bytes) are assumed to have this size
+            when calculating the cost of redownloading them.
+        """
+        self.decay_constant = decay_constant
+        self.floor = floor
+
+    @abstractmethod
+    def order(
+        self, entries: Sequence[CacheEntry], now: datetime, state: EvictionState
+    ) -> List[CacheEntry]:
+        """Sort eviction candidates in the order they should be evicted in."""
+
+    def on_evict(
+        self, evicted: Sequence[CacheEntry], now: datetime, state: EvictionState
+    ) -> EvictionState:
+        """Update the cache state after some objects have been evicted."""
+        return state
+
+    def on_ghost_hit(
+        self,
+        ghost: GhostEntry,
+        ghost_sizes: Tuple[int, int],
+        cache_size: int,
+        state: EvictionState,
+    ) -> EvictionState:
+        """
+        Update the cache state when an object that was recently evicted is requested again.
+
+        :param ghost: Ghost entry of the requested object
+        :param ghost_sizes: Total size of ghost entries for objects that were used once
+            and objects that were used several times.
+        :param cache_size: Cache size in bytes
+        :param state: Current state
+        """
+        return state
+
+
+class PriorityEvictionPolicy(EvictionPolicy):
+    """
+    Eviction policy that calculates a priority for every object (objects with the lowest
+    priority are evicted first).
+    """
+
+    @abstractmethod
+    def priority(self, entry: CacheEntry, now: datetime) -> float:
+        """Priority of an object in the cache."""
+
+    def order(
+        self, entries: Sequence[CacheEntry], now: datetime, state: EvictionState
+    ) -> List[CacheEntry]:
+        return sorted(entries, key=lambda e: self.priority(e, now))
+
+
+class DecayPolicy(PriorityEvictionPolicy):
+    def priority(self, entry: CacheEntry, now: datetime) -> float:
+        # We want to evict objects in order to minimize
+        # P(object is requested again) * (cost of redownloading the object).
+        # To approximate the probability, we use an exponential decay function (1 if last_used = now, dropping down
+        # to 0 as time since the object's last usage time passes).
+        # To approximate the cost, we use the object's size, floored to a constant (so if the object has
+        # size <= floor, we'd use the floor value -- this is to simulate the latency of re-fetching the object,
+        # as opposed to the bandwidth)
+        time_since_used = (now - entry.last_used).total_seconds()
+        return math.exp(-self.decay_constant * time_since_used) * max(entry.size, self.floor)
+
+
+class LRUPolicy(PriorityEvictionPolicy):
+    def priority(self, entry: CacheEntry, now: datetime) -> float:
+        return -(now - entry.last_used).total_seconds()
+
+
+class LFUPolicy(PriorityEvictionPolicy):
+    def priority(self, entry: CacheEntry, now: datetime) -> float:
+        # Break ties between objects with the same access count by recency (the fractional
+        # part is between 0 and 1 and is larger for objects that were used more recently).
+        time_since_used = max((now - entry.last_used).total_seconds(), 0)
+        return entry.access_count + 1 / (1 + time_since_used)
+
+
+class GDSFPolicy(PriorityEvictionPolicy):
+    def priority(self, entry: CacheEntry, now: datetime) -> float:
+        # The cost of redownloading an object is dominated by the latency of fetching it
+        # (which doesn't depend on its size), so we use the floor as the fetch cost.
+        return entry.clock + entry.access_count * max(self.floor, 1) / max(entry.size, 1)
+
+    def on_evict(
+        self, evicted: Sequence[CacheEntry], now: datetime, state: EvictionState
+    ) -> EvictionState:
+        if not evicted:
+            return state
+        return state._replace(clock=max(state.clock, max(self.priority(e, now) for e in evicted)))
+
+
+class ARCPolicy(EvictionPolicy):
+    def order(
+        self, entries: Sequence[CacheEntry], now: datetime, state: EvictionState
+    ) -> List[CacheEntry]:
+        # Split the cache into objects that have been used once since they were downloaded (T1)
+        # and objects that have been used several times (T2), each ordered from least to most
+        # recently used.
+        recent = sorted((e for e in entries if e.access_count <= 1), key=lambda e: e.last_used)
+        frequent = sorted((e for e in entries if e.access_count > 1), key=lambda e: e.last_used)
+
+        # Evict from T1 whilst it's larger than its target size (and from T2 otherwise).
+        recent_size = sum(e.size for e in recent)
+        result: List[CacheEntry] = []
+        i = j = 0
+        while i < len(recent) or j < len(frequent):
+            if i < len(recent) and (recent_size > state.arc_target or j == len(frequent)):
+                result.append(recent[i])
+                recent_size -= recent[i].size
+                i += 1
+            else:
+                result.append(frequent[j])
+                j += 1
+        return result
+
+    def on_ghost_hit(
+        self,
+        ghost: GhostEntry,
+        ghost_sizes: Tuple[int, int],
+        cache_size: int,
+        state: EvictionState,
+    ) -> EvictionState:
+        recent_ghosts, frequent_ghosts = ghost_sizes
+        if ghost.access_count <= 1:
+            # We evicted an object from T1 that we shouldn't have: T1 should be larger.
+            delta = max(frequent_ghosts / max(recent_ghosts, 1), 1) * ghost.size
+            return state._replace(arc_target=int(min(state.arc_target + delta, cache_size)))
+        else:
+            # Same for T2
+            delta = max(recent_ghosts / max(frequent_ghosts, 1), 1) * ghost.size
+            return state._replace(arc_target=int(max(state.arc_target - delta, 0)))
+
+
+EVICTION_POLICIES: Dict[str, Type[EvictionPolicy]] = {
+    "decay": DecayPolicy,
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "gdsf": GDSFPolicy,
+    "arc": ARCPolicy,
+}
+
+
+def get_eviction_policy(name: str, decay_constant: float, floor: float) -> EvictionPolicy:
+    """
+    Get an eviction policy by its name.
+
+    :param name: Name of the policy (one of EVICTION_POLICIES)
+    :param decay_constant: See SG_EVICTION_DECAY
+    :param floor: See SG_EVICTION_FLOOR (in bytes)
+    """
+    try:
+        return EVICTION_POLICIES[name.lower()](decay_constant=decay_constant, floor=floor)
+    except KeyError:
+        raise ObjectCacheError(
+            "Unknown eviction policy %s! Supported policies: %s"
+            % (name, ", ".join(EVICTION_POLICIES))
+        )
+
+
+def select_evicted_objects(
+    policy: EvictionPolicy,
+    entries: Sequence[CacheEntry],
+    now: datetime,
+    state: EvictionState,
+    required_space: int,
+) -> Tuple[List[CacheEntry], int]:
+    """
+    Pick objects to evict to free at least `required_space` bytes (or as much as possible).
+
+    :return: List of objects to evict and the amount of space they take up.
+    """
+    to_delete: List[CacheEntry] = []
+    freed_space = 0
+    for entry in policy.order(entries, now, state):
+        if freed_space >= required_space:
+            break
+        to_delete.append(entry)
+        freed_space += entry.size
+    return to_delete, freed_space
+
+
+def trim_ghosts(ghosts: List[GhostEntry], max_size: int) -> List[GhostEntry]:
+    """
+    Only keep the most recent ghost entries totalling up to `max_size` bytes.
+
+    :param ghosts: Ghost entries, from least to most recently evicted.
+    """
+    total = 0
+    for i in range(len(ghosts) - 1, -1, -1):
+        total += ghosts[i].size
+        if total > max_size:
+            return ghosts[i + 1 :]
+    return ghosts
+
+
+class TraceEntry(NamedTuple):
+    """A single access to an object in the cache"""
+
+    timestamp: datetime
+    object_id: str
+    size: int
+
+
+def load_trace(path: str) -> List[TraceEntry]:
+    """
+    Load a trace of object cache accesses recorded with SG_EVICTION_TRACE.
+
+    :param path: Path to a CSV file with the access time (in ISO format), the object ID and the
+        object's size in bytes on every line.
+    """
+    with open(path, "r", newline="") as f:
+        return [
+            TraceEntry(datetime.fromisoformat(timestamp), object_id, int(size))
+            for timestamp, object_id, size in csv.reader(f)
+        ]
+
+
+class SimulationResult(NamedTuple):
+    policy: str
+    requests: int
+    hits: int
+    bytes_downloaded: int
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests else 0.0
+
+
+def simulate(
+    trace: Iterable[TraceEntry],
+    policy: str,
+    cache_size: int,
+    decay_constant: float = 0.002,
+    floor: float = 1024 * 1024,
+    min_fraction: float = 0.05,
+) -> SimulationResult:
+    """
+    Replay a trace of cache accesses against an eviction policy, mirroring what
+    `ObjectManager` does on the engine (objects are used one by one and are released straight away).
+
+    :param trace: Trace of accesses, in chronological order
+    :param policy: Name of the eviction policy
+    :param cache_size: Size of the cache, in bytes (see SG_OBJECT_CACHE_SIZE)
+    :param decay_constant: See SG_EVICTION_DECAY
+    :param floor: See SG_EVICTION_FLOOR (in bytes)
+    :param min_fraction: See SG_EVICTION_MIN_FRACTION
+    :return: Number of requests, cache hits and bytes downloaded to satisfy cache misses.
+    """
+    eviction_policy = get_eviction_policy(policy, decay_constant, floor)
+    state = EvictionState()
+
+    cache: Dict[str, CacheEntry] = {}
+    occupancy = 0
+    ghosts: Dict[str, GhostEntry] = {}
+    requests = hits = bytes_downloaded = 0
+
+    for timestamp, object_id, size in trace:
+        requests += 1
+        entry: Optional[CacheEntry] = cache.get(object_id)
+        if entry:
+            hits += 1
+            cache[object_id] = entry._replace(
+                last_used=timestamp, access_count=entry.access_count + 1, clock=state.clock
+            )
+            continue
+
+        bytes_downloaded += size
+        if size > cache_size:
+            # The object doesn't fit into the cache at all.
+            continue
+
+        access_count = 1
+        ghost = ghosts.pop(object_id, None)
+        if ghost:
+            access_count = ghost.access_count + 1
+            ghost_sizes = (
+                sum(g.size for g in ghosts.values() if g.access_count <= 1),
+                sum(g.size for g in ghosts.values() if g.access_count > 1),
+            )
+            state = eviction_policy.on_ghost_hit(ghost, ghost_sizes, cache_size, state)
+
+        if occupancy + size > cache_size:
+            required_space = max(occupancy + size - cache_size, int(min_fraction * cache_size))
+            evicted, freed_space = select_evicted_objects(
+                eviction_policy, list(cache.values()), timestamp, state, required_space
+            )
+            state = eviction_policy.on_evict(evicted, timestamp, state)
+            for e in evicted:
+                del cache[e.object_id]
+                ghosts[e.object_id] = GhostEntry(e.object_id, e.size, e.access_count)
+            occupancy -= freed_space
+            ghosts = {g.object_id: g for g in trim_ghosts(list(ghosts.values()), cache_size)}
+
+        cache[object_id] = CacheEntry(object_id, size, timestamp, access_count, state.clock)
+        occupancy += size
+
+    return SimulationResult(policy, requests, hits, bytes_downloaded)
+
+
+class EvictionMetrics:
+    """Statistics collected by the background eviction worker"""
+
+    def __init__(self) -> None:
+        # Number of occupancy checks
+        self.checks = 0
+        # Number of checks that resulted in objects getting evicted
+        self.evictions = 0
+        # Number of checks that failed with an error
+        self.errors = 0
+        self.bytes_freed = 0
+        # Time spent in checks that resulted in an eviction, in seconds
+        self.total_eviction_time = 0.0
+        self.max_eviction_time = 0.0
+        self.last_eviction_time = 0.0
+        self.last_occupancy = 0
+
+    def record(self, bytes_freed: int, duration: float, occupancy: int) -> None:
+        self.checks += 1
+        self.last_occupancy = occupancy
+        if bytes_freed:
+            self.evictions += 1
+            self.bytes_freed += bytes_freed
+            self.total_eviction_time += duration
+            self.max_eviction_time = max(self.max_eviction_time, duration)
+            self.last_eviction_time = duration
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "checks": self.checks,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "bytes_freed": self.bytes_freed,
+            "total_eviction_time": self.total_eviction_time,
+            "max_eviction_time": self.max_eviction_time,
+            "last_eviction_time": self.last_eviction_time,
+            "last_occupancy": self.last_occupancy,
+        }
+
+
+class EvictionWorker:
+    """
+    Keeps the object cache occupancy between the low and the high watermarks by periodically
+    running eviction in the background.
+    """
+
+    def __init__(
+        self,
+        object_manager: "ObjectManager",
+        high_watermark: float,
+        low_watermark: float,
+        interval: float,
+    ) -> None:
+        """
+        :param object_manager: Object manager whose cache to manage. Since it will be
+            committing and locking the cache tables, it shouldn't be used for anything else.
+        :param high_watermark: Fraction of the cache size above which eviction is run.
+        :param low_watermark: Fraction of the cache size to free the cache down to.
+        :param interval: Interval, in seconds, between occupancy checks.
+        """
+        if not 0 <= low_watermark <= high_watermark:
+            raise ValueError(
+                "Low watermark (%s) must be between 0 and the high watermark (%s)!"
+                % (low_watermark, high_watermark)
+            )
+        self.object_manager = object_manager
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.metrics = EvictionMetrics()
+        self._stop = threading.Event()
+
+    def run_once(self) -> int:
+        """
+        Check the cache occupancy and run eviction if it's above the high watermark.
+
+        :return: Space, in bytes, that was freed.
+        """
+        start = time.monotonic()
+        bytes_freed = self.object_manager.evict_to_watermark(
+            self.high_watermark, self.low_watermark
+        )
+        duration = time.monotonic() - start
+        occupancy = self.object_manager.get_cache_occupancy()
+        self.object_manager.object_engine.commit()
+        self.metrics.record(bytes_freed, duration, occupancy)
+        return bytes_freed
+
+    def run(self, max_checks: Optional[int] = None, callback=None) -> None:
+        """
+        Check the cache occupancy every `interval` seconds until stopped.
+
+        Errors during checks are logged and don't stop the worker.
+
+        :param max_checks: Maximum number of checks to run (default unlimited)
+        :param callback: Function to call with the worker's metrics after every check.
+        """
+        checks = 0
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Error running background eviction")
+                self.metrics.errors += 1
+                self.object_manager.object_engine.rollback()
+            if callback:
+                callback(self.metrics)
+            checks += 1
+            if max_checks is not None and checks >= max_checks:
+                break
+            self._stop.wait(self.interval)
+
+    def stop(self) -> None:
+        """Stop the worker after the current check finishes."""
+        self._stop.set()
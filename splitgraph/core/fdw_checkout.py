@@ -115,7 +115,7 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
 
         # Estimate the number of rows -- several precision levels here:
         #   * Number of rows in the actual fragments (using metadata -- no need to download
-        #   anything) <- you are here
+        #   anything), scaled down using column statistics if fragments have them <- you are here
         #   * calling EXPLAIN on all fragments in filtered_objects (might be pretty expensive
         #     and requires the actual fragments to be present)
         #   * reading binary cstore files?
@@ -6,29 +6,62 @@ import bisect
 import itertools
 import json
 import logging
-import operator
 import struct
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import reduce
 from hashlib import sha256
 from math import ceil
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple, Union, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from psycopg2._json import Json
 from psycopg2.errors import UniqueViolation
-from psycopg2.sql import SQL, Composable, Identifier
+from psycopg2.sql import SQL, Composable, Composed, Identifier, Literal
 from tqdm import tqdm
 
 from splitgraph.config import (
+    CONFIG,
     SG_CMD_ASCII,
     SPLITGRAPH_API_SCHEMA,
     SPLITGRAPH_META_SCHEMA,
 )
-from splitgraph.core.indexing.bloom import filter_bloom_index, generate_bloom_index
-from splitgraph.core.indexing.range import filter_range_index, generate_range_index
+from splitgraph.config.config import get_singleton
+from splitgraph.core.indexing.bloom import (
+    bloom_index_aggregate,
+    build_bloom_index,
+    split_bloom_digests,
+)
+from splitgraph.core.indexing.range import (
+    SURROGATE_PK_KEY,
+    _max,
+    _min,
+    build_range_index,
+    filter_range_index,
+    get_range_index_columns,
+    get_surrogate_pks,
+    range_index_aggregates,
+)
+from splitgraph.core.indexing.snapshot import IndexSnapshot, UnsupportedQualError
+from splitgraph.core.indexing.stats import (
+    build_column_stats,
+    column_stats_aggregates,
+    get_column_stats_columns,
+)
 from splitgraph.core.metadata_manager import MetadataManager, Object
 from splitgraph.core.overlay import SG_ROW_SEQ, WRITE_UPPER_PREFIX
-from splitgraph.core.types import Changeset, TableSchema
+from splitgraph.core.types import Changeset, TableColumn, TableSchema
 from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import (
     SG_UD_FLAG,
@@ -40,14 +73,36 @@ from splitgraph.exceptions import SplitGraphError
 
 from ..engine.base import validate_type
 from ..engine.postgres.psycopg import chunk
-from .common import adapt, get_temporary_table_id
+from .common import (
+    CACHE_LAST_USED_RESOLUTION,
+    adapt,
+    get_temporary_table_id,
+    update_engine_cache,
+)
 from .sql.queries import select
 
+try:
+    import numpy as np
+except ImportError:
+    # NumPy isn't a hard dependency: fall back to summing digests in pure Python.
+    np = None  # type: ignore
+
 if TYPE_CHECKING:
     from splitgraph.core.repository import Repository
     from splitgraph.core.table import Table
     from splitgraph.engine.postgres.engine import PostgresEngine
 
+# Number of row hashes to sum at a time when adding up a batch of digests
+# (bounds the size of the intermediate buffer to 2MB).
+DIGEST_BATCH_SIZE = 65536
+
+# Number of tables whose fragment indexes are kept in memory to filter fragments
+# without querying the metadata engine.
+INDEX_SNAPSHOT_CACHE_SIZE = 16
+
+# Number of fragments whose (min, max) PKs are kept in memory to check if fragments overlap.
+FRAGMENT_BOUNDARY_CACHE_SIZE = 100000
+
 
 def _split_changeset(
     changeset: Changeset, min_max: List[Tuple[Any, Any]], table_pks: List[Tuple[str, str]]
@@ -151,6 +206,107 @@ def get_chunk_groups(
     return [[c[1:] for c in sorted(chunks)] for chunks in groups]
 
 
+def get_overlapping_chunks(boundaries: List[Tuple[Any, Any]], selected: Iterable[int]) -> Set[int]:
+    """
+    Find chunks that overlap any of the selected chunks and come after them (and hence
+    might overwrite their rows). Intervals are assumed to be closed.
+
+    This does a single sweep through the chunks in their original order, keeping a
+    Fenwick tree of the largest end of selected chunks indexed by their start, so that
+    it runs in O(N log M) instead of checking every chunk against every selected chunk.
+
+    :param boundaries: List of (start, end) for every chunk, in the order chunks are applied in.
+    :param selected: Indexes of selected chunks in `boundaries`
+    :return: Set of indexes of chunks that aren't selected but overlap a preceding selected chunk.
+    """
+    selected = set(selected)
+    if not selected:
+        return set()
+
+    starts = sorted(_key(boundaries[i][0]) for i in selected)
+    # 1-based Fenwick tree with the maximum end key in each range of starts
+    tree: List[Optional[Any]] = [None] * (len(starts) + 1)
+
+    result: Set[int] = set()
+    for i, (start, end) in enumerate(boundaries):
+        if i in selected:
+            end_key = _key(end)
+            pos = bisect.bisect_left(starts, _key(start)) + 1
+            while pos < len(tree):
+                if tree[pos] is None or tree[pos] < end_key:
+                    tree[pos] = end_key
+                pos += pos & -pos
+            continue
+
+        # Find the largest end of the preceding selected chunks that start before this chunk's end:
+        # if it's after this chunk's start, the two chunks overlap.
+        max_end = None
+        pos = bisect.bisect_right(starts, _key(end))
+        while pos > 0:
+            if tree[pos] is not None and (max_end is None or tree[pos] > max_end):
+                max_end = tree[pos]
+            pos -= pos & -pos
+        if max_end is not None and max_end >= _key(start):
+            result.add(i)
+    return result
+
+
+def _sum_shorts_python(buffer: bytes) -> Tuple[int, ...]:
+    values = struct.unpack(">%dH" % (len(buffer) // 2), buffer)
+    return tuple(sum(values[i::16]) & 0xFFFF for i in range(16))
+
+
+def _sum_shorts_numpy(buffer: bytes) -> Tuple[int, ...]:
+    # Use uint16 as the accumulator type to get the C short wraparound for free.
+    shorts = np.frombuffer(buffer, dtype=">u2").reshape(-1, 16)
+    return tuple(int(s) for s in shorts.sum(axis=0, dtype=np.uint16))
+
+
+def _sum_shorts(buffer: bytes) -> Tuple[int, ...]:
+    """Sum a buffer of concatenated 256-bit hashes component-wise as 16 big-endian shorts,
+    wrapping around on overflow."""
+    if len(buffer) % 32 != 0:
+        raise ValueError("Buffer length %d isn't a multiple of 32 bytes!" % len(buffer))
+    sum_shorts = _sum_shorts_numpy if np is not None else _sum_shorts_python
+    return sum_shorts(buffer)
+
+
+def _digest_sums_sql(column: str) -> Composed:
+    """
+    Generate a select list that sums up row hashes inside the engine instead of returning
+    every hash to the client: the number of rows and the component-wise sums of the
+    16 big-endian shorts in every hash (see `Digest.from_sums`). NULL hashes are ignored.
+
+    :param column: Column of a subquery with the row hashes
+    """
+    return SQL(
+        "count({0}),"
+        + ",".join(
+            "sum(get_byte({0}, %d) * 256 + get_byte({0}, %d))" % (i * 2, i * 2 + 1)
+            for i in range(16)
+        )
+    ).format(Identifier(column))
+
+
+def _sum_digests_query(digest: Composable, source: Composable) -> Composed:
+    """
+    Generate a query that calculates the homomorphic hash of multiple rows inside the engine.
+
+    :param digest: SQL expression returning the sha256 hash of a row
+    :param source: FROM clause (and optional WHERE clause) that the rows come from
+    :return: Query returning the number of rows and the sums of their hashes' components.
+    """
+    return (
+        SQL("SELECT ")
+        + _digest_sums_sql("d")
+        + SQL(" FROM (SELECT ")
+        + digest
+        + SQL(" AS d FROM ")
+        + source
+        + SQL(") r")
+    )
+
+
 class Digest:
     """
     Homomorphic hashing similar to LtHash (but limited to being backed by 256-bit hashes). The main property is that
@@ -192,6 +348,33 @@ class Digest:
         assert len(hex_string) == 64
         return cls(tuple(int(hex_string[i : i + 4], base=16) for i in range(0, 64, 4)))
 
+    @classmethod
+    def from_memoryviews(cls, memories: Iterable[Union[bytes, memoryview]]) -> "Digest":
+        """
+        Create a Digest that is the sum of multiple 256-bit memoryviews/bytearrays.
+
+        This gives the same result as adding up `Digest.from_memoryview` of every item, but
+        doesn't create an intermediate Digest for every row hash. The hashes are summed in batches
+        as a (rows x 16) array of unsigned shorts (using NumPy if it's installed).
+
+        :param memories: Iterable of 32-byte row hashes.
+        """
+        result = cls.empty()
+        for batch in chunk(memories, DIGEST_BATCH_SIZE):
+            result += cls(_sum_shorts(b"".join(batch)))
+        return result
+
+    @classmethod
+    def from_sums(cls, sums: Sequence[Optional[int]]) -> "Digest":
+        """
+        Create a Digest from component-wise sums of multiple 256-bit hashes, treated as 16
+        big-endian shorts each (for example, computed by the engine), wrapping around on overflow.
+
+        :param sums: 16 (arbitrarily large) sums. None is treated as 0.
+        """
+        assert len(sums) == 16
+        return cls(tuple(int(s or 0) & 0xFFFF for s in sums))
+
     # In these routines, we treat each hash as a vector of 16 2-byte integers and do component-wise addition.
     # To simulate the wraparound behaviour of C shorts, throw away all remaining bits after the action.
     def __add__(self, other: "Digest") -> "Digest":
@@ -207,7 +390,7 @@ class Digest:
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Digest):
             return NotImplemented
-        return self.hex() == other.hex()
+        return self.shorts == other.shorts
 
     def __neg__(self) -> "Digest":
         return Digest(tuple(-v & 0xFFFF for v in self.shorts))
@@ -241,6 +424,70 @@ class FragmentManager(MetadataManager):
         super().__init__(metadata_engine)
         self.object_engine = object_engine
 
+        # In-memory snapshots of fragment indexes, keyed by table, in LRU order.
+        self._index_snapshots: "OrderedDict[Tuple[str, str, str, str], IndexSnapshot]" = (
+            OrderedDict()
+        )
+
+        # Cached (min, max) PK (or surrogate PK) of fragments, in LRU order.
+        self._fragment_boundaries: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+
+        # Maximum number of fragment groupings to keep in the engine's cache (see
+        # `get_fragment_groups`).
+        self.fragment_group_cache_size = int(get_singleton(CONFIG, "SG_FRAGMENT_GROUP_CACHE_SIZE"))
+
+    def register_objects(self, objects: List[Object], namespace: Optional[str] = None) -> None:
+        super().register_objects(objects, namespace)
+        self._invalidate_object_caches([o.object_id for o in objects])
+
+    def delete_object_meta(self, object_ids: Sequence[str]):
+        super().delete_object_meta(object_ids)
+        self._invalidate_object_caches(object_ids)
+
+    def _invalidate_object_caches(self, object_ids: Sequence[str]) -> None:
+        object_ids = set(object_ids)
+        for object_id in object_ids:
+            self._fragment_boundaries.pop(object_id, None)
+        for key in [
+            k for k, s in self._index_snapshots.items() if not object_ids.isdisjoint(s.positions)
+        ]:
+            del self._index_snapshots[key]
+
+    def _get_index_snapshot(self, table: "Table", object_ids: List[str]) -> IndexSnapshot:
+        """
+        Get an in-memory snapshot of the indexes of a table's fragments, loading it from
+        the metadata engine if it's not cached or doesn't have some of the required objects.
+
+        :param table: Table the objects belong to
+        :param object_ids: IDs of objects that have to be in the snapshot
+        """
+        key = (
+            table.repository.namespace,
+            table.repository.repository,
+            table.image.image_hash,
+            table.table_name,
+        )
+        snapshot = self._index_snapshots.get(key)
+        if snapshot and all(o in snapshot.positions for o in object_ids):
+            self._index_snapshots.move_to_end(key)
+            return snapshot
+
+        snapshot_objects = list(table.objects)
+        seen_objects = set(snapshot_objects)
+        for object_id in object_ids:
+            if object_id not in seen_objects:
+                seen_objects.add(object_id)
+                snapshot_objects.append(object_id)
+        snapshot = IndexSnapshot.from_object_meta(
+            snapshot_objects,
+            {c.name: c.pg_type for c in table.table_schema},
+            self.get_object_meta(snapshot_objects),
+        )
+        self._index_snapshots[key] = snapshot
+        while len(self._index_snapshots) > INDEX_SNAPSHOT_CACHE_SIZE:
+            self._index_snapshots.popitem(last=False)
+        return snapshot
+
     def generate_object_index(
         self,
         object_id: str,
@@ -257,7 +504,42 @@ class FragmentManager(MetadataManager):
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
         :return: Dict containing the object index.
         """
-        extra_indexes: ExtraIndexInfo = extra_indexes or {}
+        return self._scan_object(
+            SPLITGRAPH_META_SCHEMA,
+            object_id,
+            table_schema,
+            changeset=changeset,
+            extra_indexes=extra_indexes,
+            hash_rows=False,
+        )[4]
+
+    def _scan_object(
+        self,
+        schema: str,
+        object_id: str,
+        table_schema: TableSchema,
+        changeset: Optional[Changeset] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        hash_rows: bool = True,
+        old_rows_table: Optional[str] = None,
+    ) -> Tuple[Digest, int, Digest, int, Dict[str, Any]]:
+        """
+        Calculate the hashes and the index of a fragment in a single scan through it.
+
+        :param schema: Schema the fragment is stored in.
+        :param object_id: Name of the table the fragment is stored in.
+        :param table_schema: Schema of the table the object belongs to.
+        :param changeset: Optional, if specified, the old row values are included in the index.
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param hash_rows: If False, only calculate the index.
+        :param old_rows_table: Table in `schema` with the old values of the rows that the fragment
+            updates or deletes, with the upsert flag set (see `store_pending_changes`). If specified,
+            the deletion hash is calculated from these rows and they are included in the index
+            instead of the changeset.
+        :return: Homomorphic hash and the number of inserted rows, homomorphic hash and the
+            number of deleted rows (from rows with the upsert flag set to False) and the object index.
+        """
+        extra_indexes = extra_indexes or {}
 
         # Default None, meaning run range index on all columns.
         range_index_columns: Optional[List[str]]
@@ -265,15 +547,22 @@ class FragmentManager(MetadataManager):
             range_index_columns = list(extra_indexes["range"])
         except KeyError:
             range_index_columns = None
-        range_index: Dict[str, Any] = generate_range_index(
-            self.object_engine, object_id, table_schema, changeset, columns=range_index_columns
-        )
-        indexes = {"range": range_index}
+        columns_to_index = get_range_index_columns(table_schema, range_index_columns)
 
         # Process extra indexes
+        bloom_index_columns: List[Tuple[str, Dict[str, Any]]] = []
+        stats_columns: List[str] = []
         for index_name, index_cols in extra_indexes.items():
             if index_name == "range":
                 continue
+            if index_name == "stats":
+                if not isinstance(index_cols, list):
+                    raise ValueError(
+                        "Unexpected options for index 'stats': "
+                        "got %s, expected list of columns!" % type(index_cols).__name__
+                    )
+                stats_columns = get_column_stats_columns(table_schema, index_cols)
+                continue
             if index_name != "bloom":
                 raise ValueError("Unsupported index type %s!" % index_name)
             if isinstance(index_cols, list):
@@ -281,21 +570,108 @@ class FragmentManager(MetadataManager):
                     "Unexpected options for index 'bloom': "
                     "got list, expected dictionary {column: {probability/size: ...}}!"
                 )
+            bloom_index_columns = list(index_cols.items())
+
+        # Instead of doing a separate pass through the object for every hash and index,
+        # run all aggregates in one query.
+        logging.debug(
+            "Running range index on columns %s, bloom index on columns %s, "
+            "collecting statistics on columns %s",
+            columns_to_index,
+            [c for c, _ in bloom_index_columns],
+            stats_columns,
+        )
 
-            index_dict = {}
-            for index_col, index_kwargs in index_cols.items():
-                logging.debug(
-                    "Running index %s on column %s with parameters %r",
-                    index_name,
-                    index_col,
-                    index_kwargs,
+        def _scan(table_name: str, collect_stats: bool = True) -> List[Any]:
+            aggregates: List[Composable] = []
+            source = SQL("{}.{} o").format(Identifier(schema), Identifier(table_name))
+            if hash_rows:
+                digest = (
+                    SQL("digest((")
+                    + SQL(",").join(SQL("o.") + Identifier(c.name) for c in table_schema)
+                    + SQL(")::text, 'sha256'::text)")
+                )
+                source = (
+                    SQL("(SELECT o.*, CASE WHEN o.{0} THEN ").format(Identifier(SG_UD_FLAG))
+                    + digest
+                    + SQL(" END AS sg_insertion_digest, CASE WHEN o.{0} THEN NULL ELSE ").format(
+                        Identifier(SG_UD_FLAG)
+                    )
+                    + digest
+                    + SQL(" END AS sg_deletion_digest FROM ")
+                    + source
+                    + SQL(") o")
+                )
+                aggregates.append(_digest_sums_sql("sg_insertion_digest"))
+                aggregates.append(_digest_sums_sql("sg_deletion_digest"))
+            if columns_to_index:
+                aggregates.append(range_index_aggregates(columns_to_index, table_schema))
+            aggregates.extend(bloom_index_aggregate(c) for c, _ in bloom_index_columns)
+            if stats_columns and collect_stats:
+                aggregates.append(column_stats_aggregates(stats_columns, table_schema))
+
+            return (
+                list(
+                    self.object_engine.run_sql(
+                        SQL("SELECT ") + SQL(",").join(aggregates) + SQL(" FROM ") + source,
+                        return_shape=ResultShape.ONE_MANY,
+                    )
                 )
-                index_dict[index_col] = generate_bloom_index(
-                    self.object_engine, object_id, changeset, index_col, **index_kwargs
+                if aggregates
+                else []
+            )
+
+        result = _scan(object_id)
+
+        insertion_hash, rows_inserted = Digest.empty(), 0
+        deletion_hash, rows_deleted = Digest.empty(), 0
+        if hash_rows:
+            insertion_hash, rows_inserted = Digest.from_sums(result[1:17]), result[0]
+            deletion_hash, rows_deleted = Digest.from_sums(result[18:34]), result[17]
+            result = result[34:]
+
+        if old_rows_table:
+            # The old rows are stored with the upsert flag set, so the fragment deletes
+            # what we get as their insertion hash.
+            old_result = _scan(old_rows_table, collect_stats=False)
+            if hash_rows:
+                deletion_hash, rows_deleted = Digest.from_sums(old_result[1:17]), old_result[0]
+                old_result = old_result[34:]
+
+            # Expand the ranges to include the old values (see `build_range_index`) and
+            # add their hashes to the bloom filters.
+            for i in range(0, len(columns_to_index) * 2, 2):
+                result[i] = _min(result[i], old_result[i])
+                result[i + 1] = _max(result[i + 1], old_result[i + 1])
+            for i in range(len(columns_to_index) * 2, len(old_result)):
+                result[i] = (result[i] or []) + (old_result[i] or [])
+
+        indexes: Dict[str, Any] = {
+            "range": build_range_index(
+                self.object_engine,
+                object_id,
+                table_schema,
+                changeset,
+                columns_to_index,
+                result[: len(columns_to_index) * 2],
+                schema=schema,
+            )
+        }
+        result = result[len(columns_to_index) * 2 :]
+
+        if "bloom" in extra_indexes:
+            indexes["bloom"] = {
+                index_col: build_bloom_index(
+                    split_bloom_digests(digests), changeset, index_col, **index_kwargs
                 )
-            indexes[index_name] = index_dict
+                for (index_col, index_kwargs), digests in zip(bloom_index_columns, result)
+            }
+        result = result[len(bloom_index_columns) :]
+
+        if stats_columns:
+            indexes["stats"] = build_column_stats(stats_columns, result)
 
-        return indexes
+        return insertion_hash, rows_inserted, deletion_hash, rows_deleted, indexes
 
     def _register_object(
         self,
@@ -308,6 +684,7 @@ class FragmentManager(MetadataManager):
         rows_deleted: int,
         changeset: Optional[Changeset] = None,
         extra_indexes: Optional[ExtraIndexInfo] = None,
+        object_index: Optional[Dict[str, Any]] = None,
     ) -> None:
         """
         Registers a Splitgraph object in the object tree and indexes it
@@ -324,9 +701,14 @@ class FragmentManager(MetadataManager):
             are used to generate the min/max index for an object to know if it removes/updates some rows
             that might be pertinent to a query.
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param object_index: Index of the object, if it has already been calculated (otherwise,
+            it will be generated from the object).
         """
         object_size = self.object_engine.get_object_size(object_id)
-        object_index = self.generate_object_index(object_id, table_schema, changeset, extra_indexes)
+        if object_index is None:
+            object_index = self.generate_object_index(
+                object_id, table_schema, changeset, extra_indexes
+            )
         self.register_objects(
             [
                 Object(
@@ -385,23 +767,19 @@ class FragmentManager(MetadataManager):
         # we don't really know how it turns some types to strings. So instead we give Postgres all of its deleted
         # rows back and ask it to hash them for us in the same way.
         inner_tuple = "(" + ",".join("%s::" + validate_type(c.pg_type) for c in table_schema) + ")"
-        query = (  # nosec
-            "SELECT digest(o::text, 'sha256') FROM (VALUES "
-            + ",".join(itertools.repeat(inner_tuple, len(rows)))
-            + ") o"
+        query = _sum_digests_query(
+            SQL("digest(o::text, 'sha256')"),
+            SQL("(VALUES " + ",".join(itertools.repeat(inner_tuple, len(rows))) + ") o"),  # nosec
         )
 
         # By default (e.g. for changesets where nothing was deleted) we use a 0 hash (since adding it to any other
         # hash has no effect).
-        digests = self.object_engine.run_sql(
+        result = self.object_engine.run_sql(
             query,
             [o if not isinstance(o, dict) else Json(o) for row in rows for o in row],
-            return_shape=ResultShape.MANY_ONE,
-        )
-        return (
-            reduce(operator.add, map(Digest.from_memoryview, digests), Digest.empty()),
-            len(digests),
+            return_shape=ResultShape.ONE_MANY,
         )
+        return Digest.from_sums(result[1:]), result[0]
 
     def _store_changesets(
         self,
@@ -438,69 +816,130 @@ class FragmentManager(MetadataManager):
                 sub_changeset, table_name, schema, table.table_schema
             )
 
-            (
-                deletion_hash,
-                insertion_hash,
-                object_id,
-                rows_inserted,
-                rows_deleted,
-            ) = self._get_patch_fragment_hashes_stats(sub_changeset, table, tmp_table_id)
-
-            object_ids.append(object_id)
-
-            self._store_object_from_temp_table(
-                object_id,
-                tmp_table_id,
-                table,
-                in_fragment_order=in_fragment_order,
-                overwrite=overwrite,
+            object_ids.append(
+                self._store_patch_fragment(
+                    table,
+                    tmp_table_id,
+                    sub_changeset,
+                    extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                )
             )
             self.object_engine.delete_table("pg_temp", tmp_table_id)
-            # There are some cases where an object can already exist in the object engine (in the cache)
-            # but has been deleted from the metadata engine, so when it's recreated, we'll skip
-            # actually registering it. Hence, we still want to proceed trying to register
-            # it no matter what.
-
-            # Same here: if we are being called as part of a commit and an object
-            # already exists, we'll roll back everything that the caller has done
-            # (e.g. registering the new image) if we don't have a savepoint.
-            with self.metadata_engine.savepoint("object_register"):
-                try:
-                    self._register_object(
-                        object_id,
-                        namespace=table.repository.namespace,
-                        insertion_hash=insertion_hash.hex(),
-                        deletion_hash=deletion_hash.hex(),
-                        table_schema=table.table_schema,
-                        changeset=sub_changeset,
-                        extra_indexes=extra_indexes,
-                        rows_inserted=rows_inserted,
-                        rows_deleted=rows_deleted,
-                    )
-                except UniqueViolation:
-                    logging.info(
-                        "Object %s for table %s/%s already exists, continuing...",
-                        object_id,
-                        table.repository,
-                        table.table_name,
-                    )
 
         return object_ids
 
-    def _get_patch_fragment_hashes_stats(
-        self, sub_changeset: Any, table: "Table", tmp_object_id: str
-    ) -> Tuple[Digest, Digest, str, int, int]:
-        # Digest the rows.
-        deletion_hash, rows_deleted = self._hash_old_changeset_values(
-            sub_changeset, table.table_schema
+    def _store_patch_fragment(
+        self,
+        table: "Table",
+        tmp_table_id: str,
+        changeset: Optional[Changeset],
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+        old_rows_table: Optional[str] = None,
+    ) -> str:
+        """
+        Hash, store and register a patch fragment from a temporary table.
+
+        :param table: Table object the fragment belongs to
+        :param tmp_table_id: Temporary table the fragment is stored in
+        :param changeset: Changeset that produced the fragment
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param in_fragment_order: Key to sort data inside the fragment by.
+        :param overwrite: Overwrite object if already exists.
+        :param old_rows_table: Temporary table with the old values of the rows the fragment
+            changes, to be used instead of the changeset (see `store_pending_changes`).
+        :return: Object ID of the fragment.
+        """
+        (
+            deletion_hash,
+            insertion_hash,
+            object_id,
+            rows_inserted,
+            rows_deleted,
+            object_index,
+        ) = self._get_patch_fragment_hashes_stats(
+            changeset, table, tmp_table_id, extra_indexes, old_rows_table
         )
-        insertion_hash, rows_inserted = self.calculate_fragment_insertion_hash_stats(
-            "pg_temp", tmp_object_id, table.table_schema
+
+        self._store_object_from_temp_table(
+            object_id,
+            tmp_table_id,
+            table,
+            in_fragment_order=in_fragment_order,
+            overwrite=overwrite,
         )
+        # There are some cases where an object can already exist in the object engine (in the cache)
+        # but has been deleted from the metadata engine, so when it's recreated, we'll skip
+        # actually registering it. Hence, we still want to proceed trying to register
+        # it no matter what.
+
+        # Same here: if we are being called as part of a commit and an object
+        # already exists, we'll roll back everything that the caller has done
+        # (e.g. registering the new image) if we don't have a savepoint.
+        with self.metadata_engine.savepoint("object_register"):
+            try:
+                self._register_object(
+                    object_id,
+                    namespace=table.repository.namespace,
+                    insertion_hash=insertion_hash.hex(),
+                    deletion_hash=deletion_hash.hex(),
+                    table_schema=table.table_schema,
+                    changeset=changeset,
+                    extra_indexes=extra_indexes,
+                    rows_inserted=rows_inserted,
+                    rows_deleted=rows_deleted,
+                    object_index=object_index,
+                )
+            except UniqueViolation:
+                logging.info(
+                    "Object %s for table %s/%s already exists, continuing...",
+                    object_id,
+                    table.repository,
+                    table.table_name,
+                )
+        return object_id
+
+    def _get_patch_fragment_hashes_stats(
+        self,
+        sub_changeset: Any,
+        table: "Table",
+        tmp_object_id: str,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        old_rows_table: Optional[str] = None,
+    ) -> Tuple[Digest, Digest, str, int, int, Dict[str, Any]]:
+        if old_rows_table:
+            # Hash and index the fragment and the old values of the rows it changes
+            # without going through Python.
+            (
+                insertion_hash,
+                rows_inserted,
+                deletion_hash,
+                rows_deleted,
+                object_index,
+            ) = self._scan_object(
+                "pg_temp",
+                tmp_object_id,
+                table.table_schema,
+                extra_indexes=extra_indexes,
+                old_rows_table=old_rows_table,
+            )
+        else:
+            # Digest the rows.
+            deletion_hash, rows_deleted = self._hash_old_changeset_values(
+                sub_changeset, table.table_schema
+            )
+            # Index the fragment in the same pass as we hash its inserted rows (the stored
+            # object will have the same rows as the temporary table).
+            insertion_hash, rows_inserted, _, _, object_index = self._scan_object(
+                "pg_temp", tmp_object_id, table.table_schema, sub_changeset, extra_indexes
+            )
         content_hash = (insertion_hash - deletion_hash).hex()
         schema_hash = self._calculate_schema_hash(table.table_schema)
         object_id = "o" + sha256((content_hash + schema_hash).encode("ascii")).hexdigest()[:-2]
-        return deletion_hash, insertion_hash, object_id, rows_inserted, rows_deleted
+        return deletion_hash, insertion_hash, object_id, rows_inserted, rows_deleted, object_index
 
     def _store_object_from_temp_table(
         self,
@@ -578,19 +1017,67 @@ class FragmentManager(MetadataManager):
         columns_sql = SQL(",").join(
             SQL("o.") + Identifier(c.name) for c in table_schema if c.name != SG_UD_FLAG
         )
-        digest_query = (
-            SQL("SELECT digest((")
-            + columns_sql
-            + SQL(")::text, 'sha256'::text) FROM {}.{} o").format(
-                Identifier(schema), Identifier(table)
+        digest_query = _sum_digests_query(
+            SQL("digest((") + columns_sql + SQL(")::text, 'sha256'::text)"),
+            SQL("{}.{} o WHERE o.{} = true").format(
+                Identifier(schema), Identifier(table), Identifier(SG_UD_FLAG)
+            ),
+        )
+        result = self.object_engine.run_sql(digest_query, return_shape=ResultShape.ONE_MANY)
+        return Digest.from_sums(result[1:]), result[0]
+
+    def _should_conflate_on_engine(self, schema: str, table: str) -> bool:
+        threshold = int(get_singleton(CONFIG, "SG_COMMIT_ENGINE_PATCH_THRESHOLD"))
+        pending_changes = sum(
+            c
+            for _, c in cast(
+                List[Tuple[int, int]],
+                self.object_engine.get_pending_changes(schema, table, aggregate=True),
             )
-            + SQL(" WHERE o.{} = true").format(Identifier(SG_UD_FLAG))
         )
-        row_digests = self.object_engine.run_sql(digest_query, return_shape=ResultShape.MANY_ONE)
-        insertion_hash = reduce(
-            operator.add, (Digest.from_memoryview(r) for r in row_digests), Digest.empty()
+        return pending_changes >= threshold
+
+    def _store_pending_changes(
+        self,
+        table: "Table",
+        schema: str,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+    ) -> List[str]:
+        """
+        Conflate the pending changes to a table on the engine and store them as a single fragment.
+
+        :param table: Table object pointing to the current HEAD table
+        :param schema: Schema the table is checked out into.
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param in_fragment_order: Key to sort data inside the fragment by.
+        :param overwrite: Overwrite object if already exists.
+        :return: List with the ID of the new fragment (empty if the changes cancelled each other out).
+        """
+        logging.info("Storing and indexing table %s", table.table_name)
+        tmp_table_id = get_temporary_table_id()
+        old_rows_table = get_temporary_table_id()
+        changes = self.object_engine.store_pending_changes(
+            schema, table.table_name, tmp_table_id, old_rows_table, table.table_schema
         )
-        return insertion_hash, len(row_digests)
+        try:
+            if not changes:
+                return []
+            return [
+                self._store_patch_fragment(
+                    table,
+                    tmp_table_id,
+                    None,
+                    extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                    old_rows_table=old_rows_table,
+                )
+            ]
+        finally:
+            self.object_engine.delete_table("pg_temp", tmp_table_id)
+            self.object_engine.delete_table("pg_temp", old_rows_table)
 
     def record_table_as_patch(
         self,
@@ -623,7 +1110,32 @@ class FragmentManager(MetadataManager):
         # this will help (for a query pk=5000 we don't need to fetch a 2000-row fragment) but maybe at that point
         # it's time to rewrite the table altogether?
 
-        # Accumulate the diff in-memory. This might become a bottleneck in the future.
+        new_schema_spec = new_schema_spec or old_table.table_schema
+        if not split_changeset and self._should_conflate_on_engine(schema, old_table.table_name):
+            # Build the fragment from the audit log on the engine instead of loading the
+            # changes into Python (we need them in Python to split them up by existing fragments).
+            object_ids = self._store_pending_changes(
+                old_table,
+                schema,
+                extra_indexes,
+                in_fragment_order=in_fragment_order,
+                overwrite=overwrite,
+            )
+            self.object_engine.discard_pending_changes(schema, old_table.table_name)
+            self.register_tables(
+                old_table.repository,
+                [
+                    (
+                        image_hash,
+                        old_table.table_name,
+                        new_schema_spec,
+                        old_table.objects + object_ids,
+                    )
+                ],
+            )
+            return
+
+        # Accumulate the diff in-memory.
         changeset: Changeset = {}
         _conflate_changes(
             changeset,
@@ -635,7 +1147,6 @@ class FragmentManager(MetadataManager):
         self.object_engine.discard_pending_changes(schema, old_table.table_name)
         current_objects = old_table.objects
 
-        new_schema_spec = new_schema_spec or old_table.table_schema
         if changeset:
             if split_changeset:
                 logging.debug("Splitting changesets")
@@ -753,17 +1264,15 @@ class FragmentManager(MetadataManager):
         # Calculate the object ID, continue if there are deleted or inserted rows
         schema_hash = self._calculate_schema_hash(new_schema_spec)
 
-        deletion_hash, rows_deleted = self.calculate_content_hash(
-            SPLITGRAPH_META_SCHEMA,
-            tmp_object_id,
-            new_schema_spec,
-            chunk_condition_sql=SQL("WHERE {} IS FALSE").format(Identifier(SG_UD_FLAG)),
-        )
-        insertion_hash, rows_inserted = self.calculate_content_hash(
-            SPLITGRAPH_META_SCHEMA,
-            tmp_object_id,
-            new_schema_spec,
-            chunk_condition_sql=SQL("WHERE {} IS TRUE").format(Identifier(SG_UD_FLAG)),
+        # Hash the inserted and the deleted rows and index the object in one pass.
+        (
+            insertion_hash,
+            rows_inserted,
+            deletion_hash,
+            rows_deleted,
+            object_index,
+        ) = self._scan_object(
+            SPLITGRAPH_META_SCHEMA, tmp_object_id, new_schema_spec, extra_indexes=extra_indexes
         )
 
         if rows_inserted != 0 or rows_deleted != 0:
@@ -801,6 +1310,7 @@ class FragmentManager(MetadataManager):
                         extra_indexes=extra_indexes,
                         rows_inserted=rows_inserted,
                         rows_deleted=rows_deleted,
+                        object_index=object_index,
                     )
                 except UniqueViolation:
                     logging.info(
@@ -928,26 +1438,21 @@ class FragmentManager(MetadataManager):
             and the number of rows in the hash.
         """
         table_schema = table_schema or self.object_engine.get_full_table_schema(schema, table)
-        digest_query = (
-            SQL("SELECT digest((")
-            + SQL(",").join(Identifier(c.name) for c in table_schema)
-            + SQL(")::text, 'sha256'::text) FROM {}.{} o").format(
-                Identifier(schema), Identifier(table)
-            )
-        )
+        source = SQL("{}.{} o").format(Identifier(schema), Identifier(table))
         args = None
         if chunk_condition_sql:
-            digest_query += SQL(" ") + chunk_condition_sql
+            source += SQL(" ") + chunk_condition_sql
             args = chunk_condition_args
 
-        row_digests = self.object_engine.run_sql(
-            digest_query, args, return_shape=ResultShape.MANY_ONE
-        )
-
-        return (
-            reduce(operator.add, (Digest.from_memoryview(r) for r in row_digests), Digest.empty()),
-            len(row_digests),
+        # Sum up the row hashes in the engine so that we only get one hash back.
+        digest_query = _sum_digests_query(
+            SQL("digest((")
+            + SQL(",").join(Identifier(c.name) for c in table_schema)
+            + SQL(")::text, 'sha256'::text)"),
+            source,
         )
+        result = self.object_engine.run_sql(digest_query, args, return_shape=ResultShape.ONE_MANY)
+        return Digest.from_sums(result[1:]), result[0]
 
     def create_base_fragment(
         self,
@@ -959,6 +1464,7 @@ class FragmentManager(MetadataManager):
         extra_indexes: Optional[ExtraIndexInfo] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        chunk_condition_sql: Optional[Composable] = None,
     ) -> str:
         if not source_schema and not source_table and not source_function:
             raise ValueError("Pass either source_schema/table or source_function!")
@@ -983,6 +1489,8 @@ class FragmentManager(MetadataManager):
             source_query += SQL("FROM {}.{}").format(
                 Identifier(source_schema), Identifier(source_table)
             )
+        if chunk_condition_sql:
+            source_query += SQL(" ") + chunk_condition_sql
         source_query_args = None
 
         if in_fragment_order:
@@ -1001,11 +1509,9 @@ class FragmentManager(MetadataManager):
             write_chunk_size=SINGLE_CHUNK_WRITE_SIZE if not source_function else None,
         )
 
-        # Get content hash for this chunk.
-        content_hash, rows_inserted = self.calculate_content_hash(
-            SPLITGRAPH_META_SCHEMA,
-            tmp_object_id,
-            table_schema,
+        # Get content hash for this chunk and index it in the same pass.
+        content_hash, rows_inserted, _, _, object_index = self._scan_object(
+            SPLITGRAPH_META_SCHEMA, tmp_object_id, table_schema, extra_indexes=extra_indexes
         )
         object_id = (
             "o" + sha256((content_hash.hex() + schema_hash).encode("ascii")).hexdigest()[:-2]
@@ -1045,6 +1551,7 @@ class FragmentManager(MetadataManager):
                 extra_indexes=extra_indexes,
                 rows_inserted=rows_inserted,
                 rows_deleted=0,
+                object_index=object_index,
             )
         finally:
             self.object_engine.delete_objects([tmp_object_id])
@@ -1079,6 +1586,8 @@ class FragmentManager(MetadataManager):
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
         table_schema: Optional[TableSchema] = None,
+        threads: Optional[int] = None,
+        register_table: bool = True,
     ) -> List[str]:
         """
         Copies the full table verbatim into one or more new base fragments and registers them.
@@ -1095,9 +1604,17 @@ class FragmentManager(MetadataManager):
         :param table_schema: Override the columns that will be picked from the original table
             (e.g. to change their order or primary keys). Note that the schema must be a subset
             of the original schema and this method doesn't verify PK constraints.
+        :param threads: Number of connections to use to create chunks in parallel. Default
+            is the SG_COMMIT_CHUNK_THREADS config parameter. Chunks are created and registered
+            in separate transactions, so the source table is chunked on one connection if the
+            current transaction has uncommitted changes to it.
+        :param register_table: Link the table in the image to the new fragments. If False,
+            only the fragments are created and registered: the caller has to register the
+            table itself (see `register_tables`).
         """
         source_schema = source_schema or repository.to_schema()
         source_table = source_table or table_name
+        threads = threads or int(get_singleton(CONFIG, "SG_COMMIT_CHUNK_THREADS"))
 
         table_not_empty = self.object_engine.run_sql(
             SQL("SELECT EXISTS(SELECT 1 FROM {}.{})").format(
@@ -1119,6 +1636,7 @@ class FragmentManager(MetadataManager):
                 in_fragment_order=in_fragment_order,
                 overwrite=overwrite,
                 table_schema=table_schema,
+                threads=threads,
             )
 
         elif table_not_empty:
@@ -1136,7 +1654,8 @@ class FragmentManager(MetadataManager):
         else:
             # If the table is empty, then we don't link it to any objects and simply store its schema
             object_ids = []
-        self.register_tables(repository, [(image_hash, table_name, table_schema, object_ids)])
+        if register_table:
+            self.register_tables(repository, [(image_hash, table_name, table_schema, object_ids)])
         return object_ids
 
     def _chunk_table(
@@ -1149,6 +1668,7 @@ class FragmentManager(MetadataManager):
         table_schema: Optional[TableSchema] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        threads: int = 1,
     ) -> List[str]:
         table_schema = table_schema or self.object_engine.get_full_table_schema(
             source_schema, source_table
@@ -1190,6 +1710,10 @@ class FragmentManager(MetadataManager):
         #
         # Current attempt: using a named cursor and FETCHing a certain number of rows into separate
         # cstore_fdw tables to get this done in a single table scan.
+        #
+        # For tables with a PK, we can also create multiple chunks in parallel: find the exact PK
+        # that every chunk starts at and then create chunks from PK ranges on separate connections
+        # (see _chunk_table_parallel).
 
         logging.info("Processing table %s", source_table)
         pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
@@ -1211,6 +1735,28 @@ class FragmentManager(MetadataManager):
 
         log_func("Storing and indexing the table")
 
+        if threads > 1 and total_chunks > 1 and not surrogate_pk:
+            if self._has_pending_writes(source_schema, source_table):
+                # Other connections can't see changes to the table that our transaction
+                # hasn't committed yet, so they can't create the chunks.
+                logging.info(
+                    "Table %s has uncommitted changes, chunking it on one connection", source_table
+                )
+            else:
+                return self._chunk_table_parallel(
+                    repository,
+                    source_schema,
+                    source_table,
+                    chunk_size,
+                    table_schema,
+                    threads,
+                    table_length,
+                    extra_indexes=extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                    show_progress=log_progress,
+                )
+
         # Read the data from the source table with an order
         source_query = (
             SQL("SELECT ")
@@ -1244,6 +1790,148 @@ class FragmentManager(MetadataManager):
                 pbar.set_postfix(object=object_id[:10] + "...")
         return object_ids
 
+    def _has_pending_writes(self, schema: str, table: str) -> bool:
+        # Check if our transaction has written to (or created/altered) the table: these
+        # statements take a lock on the table that's held until the transaction ends.
+        return cast(
+            bool,
+            self.object_engine.run_sql(
+                "SELECT EXISTS(SELECT 1 FROM pg_locks l "
+                "JOIN pg_class c ON l.relation = c.oid "
+                "JOIN pg_namespace n ON c.relnamespace = n.oid "
+                "WHERE l.locktype = 'relation' AND l.pid = pg_backend_pid() "
+                "AND n.nspname = %s AND c.relname = %s AND l.mode IN ('RowExclusiveLock', "
+                "'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'))",
+                (schema, table),
+                return_shape=ResultShape.ONE_ONE,
+            ),
+        )
+
+    def _get_chunk_boundaries(
+        self, source_schema: str, source_table: str, table_pk: List[str], chunk_size: int
+    ) -> List[Tuple]:
+        # Get the PK of every chunk_size-th row of the table in PK order (the first
+        # row of every chunk that the table would get split into by _chunk_table).
+        # This is a single scan over the PK (an index-only scan if the PK is indexed).
+        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
+        return cast(
+            List[Tuple],
+            self.object_engine.run_sql(
+                SQL("SELECT ")
+                + pk_sql
+                + SQL(" FROM (SELECT ")
+                + pk_sql
+                + SQL(", row_number() OVER (ORDER BY (")
+                + pk_sql
+                + SQL(")) AS sg_chunk_row FROM {}.{}) r").format(
+                    Identifier(source_schema), Identifier(source_table)
+                )
+                + SQL(" WHERE mod(sg_chunk_row - 1, %s) = 0 ORDER BY sg_chunk_row"),
+                (chunk_size,),
+            ),
+        )
+
+    def _chunk_table_parallel(
+        self,
+        repository: "Repository",
+        source_schema: str,
+        source_table: str,
+        chunk_size: int,
+        table_schema: TableSchema,
+        threads: int,
+        table_length: int,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+        show_progress: bool = False,
+    ) -> List[str]:
+        table_pk = [c.name for c in table_schema if c.is_pk]
+        pk_types = {c.name: c.pg_type for c in table_schema}
+
+        # Chunks have the same rows as the ones created by reading the table through a
+        # cursor, so they get the same object IDs.
+        boundaries = self._get_chunk_boundaries(source_schema, source_table, table_pk, chunk_size)
+
+        pk_row = SQL("ROW(") + SQL(",").join(Identifier(p) for p in table_pk) + SQL(")")
+
+        def _pk_literal(pk: Tuple) -> Composed:
+            return (
+                SQL("ROW(")
+                + SQL(",").join(
+                    Literal(Json(v) if isinstance(v, dict) else v)
+                    + SQL("::" + validate_type(pk_types[p]))
+                    for p, v in zip(table_pk, pk)
+                )
+                + SQL(")")
+            )
+
+        def _create_chunk(chunk_no: int) -> str:
+            chunk_condition_sql = (
+                SQL("WHERE ") + pk_row + SQL(" >= ") + _pk_literal(boundaries[chunk_no])
+            )
+            if chunk_no < len(boundaries) - 1:
+                chunk_condition_sql += (
+                    SQL(" AND ") + pk_row + SQL(" < ") + _pk_literal(boundaries[chunk_no + 1])
+                )
+            try:
+                object_id = self.create_base_fragment(
+                    source_schema,
+                    source_table,
+                    repository.namespace,
+                    extra_indexes=extra_indexes,
+                    # Write rows in the same order as the cursor would.
+                    in_fragment_order=in_fragment_order or table_pk,
+                    overwrite=overwrite,
+                    table_schema=table_schema,
+                    chunk_condition_sql=chunk_condition_sql,
+                )
+                # Commit so that the main connection can see the object and its metadata.
+                self.object_engine.commit()
+                if self.metadata_engine != self.object_engine:
+                    self.metadata_engine.commit()
+            except Exception:
+                logging.exception(
+                    "Error creating chunk %d/%d of %s", chunk_no + 1, len(boundaries), source_table
+                )
+                self.object_engine.rollback()
+                if self.metadata_engine != self.object_engine:
+                    self.metadata_engine.rollback()
+                raise
+            return object_id
+
+        logging.debug(
+            "Creating %d chunks using %d threads", len(boundaries), min(threads, len(boundaries))
+        )
+        object_ids = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(threads, len(boundaries))) as tpe:
+                # Results come back in the same order as the chunks.
+                pbar = tqdm(
+                    tpe.map(_create_chunk, range(len(boundaries))),
+                    total=len(boundaries),
+                    unit="objs",
+                    ascii=SG_CMD_ASCII,
+                    disable=not show_progress,
+                )
+                for object_id in pbar:
+                    object_ids.append(object_id)
+                    pbar.set_postfix(object=object_id[:10] + "...")
+        finally:
+            self.object_engine.close_others()
+            if self.metadata_engine != self.object_engine:
+                self.metadata_engine.close_others()
+
+        # Make sure the chunks cover the whole table (they won't if it was changed by another
+        # transaction while they were being created).
+        object_meta = self.get_object_meta(object_ids)
+        chunked_rows = sum(object_meta[o].rows_inserted for o in object_ids)
+        if chunked_rows != table_length:
+            raise SplitGraphError(
+                "Chunks of table %s have %d rows instead of %d. Was the table changed while "
+                "it was being committed?" % (source_table, chunked_rows, table_length)
+            )
+        return object_ids
+
     def filter_fragments(self, object_ids: List[str], table: "Table", quals: Any) -> List[str]:
         """
         Performs fuzzy filtering on the given object IDs using the index and a set of qualifiers, discarding
@@ -1266,12 +1954,17 @@ class FragmentManager(MetadataManager):
         if not quals:
             return object_ids
 
-        column_types = {c[1]: c[2] for c in table.table_schema}
+        snapshot = self._get_index_snapshot(table, object_ids)
 
         # Run the range filter
-        range_filter_result = filter_range_index(
-            self.metadata_engine, object_ids, quals, column_types
-        )
+        try:
+            range_filter_result = snapshot.filter_range_index(object_ids, quals)
+        except UnsupportedQualError as e:
+            logging.debug("Running the range filter on the engine: %s", e)
+            column_types = {c[1]: c[2] for c in table.table_schema}
+            range_filter_result = filter_range_index(
+                self.metadata_engine, object_ids, quals, column_types
+            )
         if len(range_filter_result) < len(object_ids):
             logging.info(
                 "Range filter discarded %d/%d fragment(s)",
@@ -1281,7 +1974,7 @@ class FragmentManager(MetadataManager):
 
         # Run other filters: currently we can attempt to run the bloom filter
         # if the fragment metadata has bloom fingerprints.
-        bloom_filter_result = filter_bloom_index(self.metadata_engine, range_filter_result, quals)
+        bloom_filter_result = snapshot.filter_bloom_index(range_filter_result, quals)
         if len(bloom_filter_result) < len(range_filter_result):
             logging.info(
                 "Bloom filter discarded %d/%d fragment(s)",
@@ -1304,39 +1997,224 @@ class FragmentManager(MetadataManager):
         self, table: "Table", object_pks: List[Tuple[Any, Any]]
     ) -> List[Tuple[Any, Any]]:
         """
-        When partitioning data, if the table doesn't have a primary key, we use a "surrogate"
-        primary key by concatenating the whole row as a string on the PG side (this is because
-        the whole row can sometimes contain NULLs which we can't compare in PG).
-
-        We need to mimic this when calculating if the objects we're about to scan through
-        overlap: e.g. using string comparison, "(some_country, 100)" < "(some_country, 20)",
-        whereas using typed comparison, (some_country, 100) > (some_country, 20).
+        Cast the (min, max) PKs of fragments of a table without a primary key to text
+        on the engine to get the boundaries of their surrogate PK (see
+        `splitgraph.core.indexing.range.get_surrogate_pks`).
 
-        To do this, we use a similar hack from when calculating changeset hashes: to avoid having
-        to reproduce how PG's ::text works, we give it back the rows and get it to cast them
-        to text for us.
+        Objects indexed by recent versions of Splitgraph store these boundaries in their
+        index, so this is only needed for older objects (see `backfill_surrogate_pks`).
         """
-        inner_tuple = (
-            "(" + ",".join("%s::" + ct for _, ct in get_change_key(table.table_schema)) + ")"
+        return get_surrogate_pks(
+            self.object_engine, object_pks, [ct for _, ct in get_change_key(table.table_schema)]
         )
-        rows = [r for o in object_pks for r in o]
+
+    def get_stored_surrogate_pks(self, fragments: List[str]) -> Dict[str, Tuple[str, str]]:
+        """
+        Get the surrogate PK boundaries of fragments that were precomputed when
+        the fragments were indexed.
+
+        :param fragments: List of object IDs
+        :return: Dictionary of object ID -> (min, max) surrogate PK for fragments that
+            have them in their index.
+        """
+        fields = SQL("object_id, index #> '{{range,{}}}'").format(Identifier(SURROGATE_PK_KEY))
+        return {
+            object_id: (surrogate_pk[0], surrogate_pk[1])
+            for object_id, surrogate_pk in self.metadata_engine.run_chunked_sql(
+                select(
+                    "get_object_meta",
+                    fields.as_string(self.metadata_engine.connection),
+                    table_args="(%s)",
+                    schema=SPLITGRAPH_API_SCHEMA,
+                ),
+                (fragments,),
+                chunk_position=0,
+            )
+            if surrogate_pk
+        }
+
+    def backfill_surrogate_pks(self) -> List[str]:
+        """
+        Precompute the surrogate PK boundaries of objects in tables without a primary key
+        that were indexed before these boundaries were stored in the object index.
+
+        :return: List of object IDs whose indexes were updated.
+        """
+        # Surrogate PK boundaries depend on the column types, so we need the schema
+        # of a table that each object belongs to.
+        object_schemas: Dict[str, TableSchema] = {}
+        for table_schema, object_ids in self.metadata_engine.run_sql(
+            select("tables", "table_schema, object_ids")
+        ):
+            table_schema = [TableColumn(*c) for c in table_schema]
+            if any(c.is_pk for c in table_schema):
+                continue
+            for object_id in object_ids:
+                object_schemas.setdefault(object_id, table_schema)
+
+        object_meta = self.get_object_meta(list(object_schemas))
+        to_backfill: Dict[Tuple[Tuple[str, str], ...], List[str]] = defaultdict(list)
+        for object_id, meta in object_meta.items():
+            range_index = (meta.object_index or {}).get("range") or {}
+            table_pks = tuple(get_change_key(object_schemas[object_id]))
+            if not table_pks or SURROGATE_PK_KEY in range_index:
+                continue
+            # Skip objects that don't have the PK range in the index (e.g. empty ones).
+            pk = table_pks[0][0] if len(table_pks) == 1 else "$pk"
+            if None in range_index.get(pk, [None]):
+                continue
+            to_backfill[table_pks].append(object_id)
+
+        updated = []
+        for table_pks, object_ids in to_backfill.items():
+            object_pks = self.get_min_max_pks(object_ids, list(table_pks))
+            surrogate_pks = get_surrogate_pks(
+                self.object_engine, object_pks, [ct for _, ct in table_pks]
+            )
+            for object_id, surrogate_pk in zip(object_ids, surrogate_pks):
+                object_meta[object_id].object_index["range"][SURROGATE_PK_KEY] = surrogate_pk
+                updated.append(object_id)
+
+        if updated:
+            self.register_objects([object_meta[o] for o in updated])
+        return updated
+
+    def get_fragment_boundaries(self, table: "Table", objects: List[str]) -> List[Tuple[Any, Any]]:
+        """
+        Get the (min, max) PK of every fragment in a table that can be compared
+        against each other to check if the fragments overlap (using a surrogate PK if the
+        table doesn't have a primary key).
+
+        :param table: Table the fragments belong to
+        :param objects: List of object IDs
+        :return: List of (min, max) PK for every object
+        """
+        # Boundaries of an object never change, so we cache them in memory (this also
+        # saves a roundtrip to the engine to cast surrogate PKs to text).
+        missing = [o for o in dict.fromkeys(objects) if o not in self._fragment_boundaries]
+        surrogate_pk = not any(t.is_pk for t in table.table_schema)
+        if missing and surrogate_pk:
+            # Use the surrogate PK boundaries stored in the index if we have them.
+            stored_pks = self.get_stored_surrogate_pks(missing)
+            self._fragment_boundaries.update(stored_pks)
+            missing = [o for o in missing if o not in stored_pks]
+        if missing:
+            object_pks = self.get_min_max_pks(missing, get_change_key(table.table_schema))
+            if surrogate_pk:
+                object_pks = self.generate_surrogate_pk(table, object_pks)
+            self._fragment_boundaries.update(zip(missing, object_pks))
 
         result = []
-        for batch in chunk(rows, 1000):
-            query = (  # nosec
-                "SELECT o::text FROM (VALUES "
-                + ",".join(itertools.repeat(inner_tuple, len(batch)))
-                + ") o"
+        for object_id in objects:
+            result.append(self._fragment_boundaries[object_id])
+            self._fragment_boundaries.move_to_end(object_id)
+        while len(self._fragment_boundaries) > FRAGMENT_BOUNDARY_CACHE_SIZE:
+            self._fragment_boundaries.popitem(last=False)
+        return result
+
+    def get_fragment_groups(self, table: "Table") -> Dict[str, int]:
+        """
+        Get the grouping of all fragments in a table into groups of fragments that overlap
+        each other (see `get_chunk_groups`). Fragments that are in different groups never
+        overlap, so any subset of a table's fragments can be grouped by only looking at
+        fragments that are in the same group.
+
+        If SG_FRAGMENT_GROUP_CACHE_SIZE is set, the grouping is cached on the object engine,
+        keyed by the list of the table's objects, and least recently used groupings are evicted
+        first. Cache hits only read from the engine. New groupings are stored in a separate
+        transaction, so the caller's transaction isn't committed, and errors storing them
+        don't fail the query.
+
+        :param table: Table
+        :return: Dictionary of object ID -> group number. Groups are numbered in order of
+            their lowest PK.
+        """
+        objects = table.objects
+        if not objects:
+            return {}
+        objects_hash = sha256(",".join(objects).encode("ascii")).hexdigest()
+
+        group_ids = None
+        if self.fragment_group_cache_size:
+            group_ids = self._get_cached_fragment_groups(objects_hash)
+
+        if group_ids is None:
+            object_pks = self.get_fragment_boundaries(table, objects)
+            groups = get_chunk_groups(
+                [
+                    (object_id, min_max[0], min_max[1])
+                    for object_id, min_max in zip(objects, object_pks)
+                ]
             )
-            result.extend(
-                self.object_engine.run_sql(
-                    query,
-                    [o if not isinstance(o, dict) else Json(o) for row in batch for o in row],
-                    return_shape=ResultShape.MANY_ONE,
+            object_groups = {
+                object_id: group_id
+                for group_id, group in enumerate(groups)
+                for object_id, _, _ in group
+            }
+            group_ids = [object_groups[o] for o in objects]
+
+            if self.fragment_group_cache_size:
+                new_group_ids = group_ids
+                update_engine_cache(
+                    self.object_engine,
+                    lambda: self._cache_fragment_groups(objects_hash, new_group_ids),
+                    "fragment group",
                 )
+
+        return dict(zip(objects, group_ids))
+
+    def _get_cached_fragment_groups(self, objects_hash: str) -> Optional[List[int]]:
+        result = self.object_engine.run_sql(
+            SQL(
+                "SELECT group_ids, last_used FROM {}.fragment_groups WHERE table_objects_hash = %s"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            (objects_hash,),
+            return_shape=ResultShape.ONE_MANY,
+        )
+        if result is None:
+            return None
+        group_ids, last_used = result
+
+        now = datetime.utcnow()
+        if last_used is None or last_used < now - CACHE_LAST_USED_RESOLUTION:
+            update_engine_cache(
+                self.object_engine,
+                lambda: self.object_engine.run_sql(
+                    SQL(
+                        "UPDATE {}.fragment_groups SET last_used = %s "
+                        "WHERE table_objects_hash = %s"
+                    ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                    (now, objects_hash),
+                ),
+                "fragment group",
+            )
+        return cast(List[int], group_ids)
+
+    def _cache_fragment_groups(self, objects_hash: str, group_ids: List[int]) -> None:
+        self.object_engine.run_sql(
+            SQL(
+                "INSERT INTO {}.fragment_groups (table_objects_hash, group_ids, last_used) "
+                "VALUES (%s, %s, %s) ON CONFLICT (table_objects_hash) DO NOTHING"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            (objects_hash, group_ids, datetime.utcnow()),
+        )
+        # Evict least recently used groupings (of object lists that have been superseded
+        # by new versions of tables) if the cache is full.
+        cached = self.object_engine.run_sql(
+            SQL("SELECT COUNT(1) FROM {}.fragment_groups").format(
+                Identifier(SPLITGRAPH_META_SCHEMA)
+            ),
+            return_shape=ResultShape.ONE_ONE,
+        )
+        if cached > self.fragment_group_cache_size:
+            self.object_engine.run_sql(
+                SQL(
+                    "DELETE FROM {0}.fragment_groups WHERE table_objects_hash IN "
+                    "(SELECT table_objects_hash FROM {0}.fragment_groups "
+                    "ORDER BY last_used DESC OFFSET %s)"
+                ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                (self.fragment_group_cache_size,),
             )
-        object_pks = [tuple(sorted(t)) for t in zip(result[::2], result[1::2])]
-        return cast(List[Tuple[Any, Any]], object_pks)
 
     def _add_overlapping_objects(
         self, table: "Table", all_objects: List[str], filtered_objects: List[str]
@@ -1345,29 +2223,19 @@ class FragmentManager(MetadataManager):
         # cases, we don't keep track of the rows that an object deletes in the index, since that
         # adds an implicit dependency on those previous objects.
 
-        table_pk = get_change_key(table.table_schema)
-        object_pks = self.get_min_max_pks(all_objects, table_pk)
+        objects_to_scan = set(filtered_objects)
+        if not objects_to_scan or objects_to_scan.issuperset(all_objects):
+            return objects_to_scan
 
-        surrogate_pk = not any(t.is_pk for t in table.table_schema)
-        if surrogate_pk:
-            object_pks = self.generate_surrogate_pk(table, object_pks)
+        object_pks = self.get_fragment_boundaries(table, all_objects)
 
-        # Go through all objects and see if they 1) come after any of our chosen objects and 2)
-        # overlap those objects' PKs (if they come after them)
+        # Find all objects that 1) come after any of our chosen objects and 2)
+        # overlap those objects' PKs.
         original_order = {object_id: i for i, object_id in enumerate(all_objects)}
-        object_pk_dict = {
-            object_id: object_pk for object_id, object_pk in zip(all_objects, object_pks)
-        }
-        objects_to_scan = set(filtered_objects)
-        for overlap_candidate in all_objects:
-            if overlap_candidate in objects_to_scan:
-                continue
-            for our_object in filtered_objects:
-                if original_order[our_object] < original_order[overlap_candidate] and _pk_overlap(
-                    object_pk_dict[our_object], object_pk_dict[overlap_candidate]
-                ):
-                    objects_to_scan.add(overlap_candidate)
-                    break
+        overlapping = get_overlapping_chunks(
+            object_pks, [original_order[o] for o in filtered_objects]
+        )
+        objects_to_scan.update(all_objects[i] for i in overlapping)
         return objects_to_scan
 
     def delete_objects(self, objects: Union[Set[str], List[str]]) -> None:
@@ -236,6 +236,7 @@ class ImageManager:
 
         :param images: List of image IDs
         """
+        images = list(images)
         if not images:
             return
         # Maybe better to have ON DELETE CASCADE on the FK constraints instead of going through
@@ -246,5 +247,10 @@ class ImageManager:
             arguments=[(self.repository.namespace, self.repository.repository, i) for i in images],
         )
 
+        if not self.repository.object_engine.registry:
+            self.repository.objects.invalidate_query_plans(
+                self.repository.namespace, self.repository.repository, image_hashes=images
+            )
+
     def __iter__(self):
         return iter(self())
@@ -5,15 +5,33 @@ import struct
 from datetime import datetime
 from hashlib import sha256
 from math import ceil, exp, log
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union, cast
-
-from psycopg2.sql import SQL, Identifier
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+from psycopg2.sql import SQL, Composed, Identifier
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.output import pretty_size
 from splitgraph.core.types import Changeset
+from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import SG_UD_FLAG
 
+try:
+    import numpy as np
+except ImportError:
+    # NumPy isn't a hard dependency: fall back to checking bloom filters in pure Python.
+    np = None  # type: ignore
+
 if TYPE_CHECKING:
     from splitgraph.engine.postgres.psycopg import PsycopgEngine
 
@@ -72,18 +90,60 @@ def generate_bloom_index(
     # it will only mean chunks with NULLs will be fetched for a query with "NULL"
     # and vice versa, which doesn't break anything (this is just a preflight optimisation).
 
-    digest_query = SQL(
-        "SELECT digest(coalesce({0}::text, 'NULL'), 'sha256'), "
-        "digest(coalesce({0}::text, 'NULL') || 'salt', 'sha256') "
-        "FROM {1}.{2} o WHERE o.{3} = true"
-    ).format(
-        Identifier(column),
-        Identifier(SPLITGRAPH_META_SCHEMA),
-        Identifier(object_id),
-        Identifier(SG_UD_FLAG),
+    # We also deduplicate the hashes on the engine, so that only distinct values get sent back.
+    digest_query = (
+        SQL("SELECT ")
+        + bloom_index_aggregate(column)
+        + SQL(" FROM {}.{} o").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
     )
 
-    digests = engine.run_sql(digest_query)
+    digests = split_bloom_digests(engine.run_sql(digest_query, return_shape=ResultShape.ONE_ONE))
+    return build_bloom_index(digests, changeset, column, probability, size)
+
+
+def bloom_index_aggregate(column: str) -> Composed:
+    """
+    Generate an aggregate that collects distinct hashes of the values of a column that a fragment
+    inserts (to be passed to `build_bloom_index` after `split_bloom_digests`). It can be selected
+    together with other aggregates to calculate the index in the same scan through the object.
+
+    :param column: Column name to generate the index on.
+    :return: SQL aggregate returning an array of concatenated pairs of hashes.
+    """
+    # See generate_bloom_index for the hash functions and the treatment of NULLs.
+    return SQL(
+        "array_agg(DISTINCT digest(coalesce({0}::text, 'NULL'), 'sha256') "
+        "|| digest(coalesce({0}::text, 'NULL') || 'salt', 'sha256')) FILTER (WHERE {1} = true)"
+    ).format(Identifier(column), Identifier(SG_UD_FLAG))
+
+
+def split_bloom_digests(result: Optional[List[bytes]]) -> List[Tuple[bytes, bytes]]:
+    """Convert the result of `bloom_index_aggregate` into a list of pairs of hashes."""
+    return [(bytes(d[:32]), bytes(d[32:])) for d in result or []]
+
+
+def build_bloom_index(
+    digests: Iterable[Tuple[bytes, bytes]],
+    changeset: Optional[Changeset],
+    column: str,
+    probability: Optional[float] = None,
+    size: Optional[int] = None,
+) -> Tuple[int, str]:
+    """
+    Build a bloom filter signature from the hashes of the values of a column in a fragment.
+
+    :param digests: Pairs of hashes of the column's values (see `generate_bloom_index`)
+    :param changeset: Optional, if specified, the old column values are included in the index.
+    :param column: Column name to generate the index on.
+    :param probability: Probability of a false positive. Either this or the size of the filter must
+        be specified, but not both.
+    :param size: Size of the filter, in bytes.
+    :return: Dictionary to be inserted into the index.
+    """
+    if not (probability is None) ^ (size is None):
+        raise ValueError("One of probability or size must be specified, but not both!")
+
+    digests = list(digests)
 
     # Add digests of the old values in the changeset for this column.
     if changeset:
@@ -210,30 +270,142 @@ def _prepare_bloom_quals(quals: Any) -> List[List[Tuple[str, int, int]]]:
     return result
 
 
-def _match(qual: Tuple[str, int, int], bloom_index: Dict[str, Tuple[int, bytes]]) -> bool:
+def _bloom_probe(
+    hash_1: int, hash_2: int, no_funcs: int, size_bits: int
+) -> Tuple[List[int], List[int]]:
     """
-    Checks whether a processed qual (column, hash_1, hash_2) can match a fragment with
-    a given index.
+    Get the bytes of a bloom filter and the bits in them that all have to be set for it
+    to possibly contain a value. These only depend on the value's hashes and the filter
+    parameters, so they can be reused to check many filters of the same size at once.
 
-    :param qual:
-    :param bloom_index:
+    :return: Tuple of (list of byte offsets, list of bit masks)
     """
+    positions = [(hash_1 + i * hash_2) % size_bits for i in range(no_funcs)]
+    return [p // 8 for p in positions], [1 << p % 8 for p in positions]
 
-    column, hash_1, hash_2 = qual
-    if column not in bloom_index:
-        # No index info for this column -- might match
-        return True
 
-    no_funcs, bloom_filter = bloom_index[column]
-    size_bits = len(bloom_filter) * 8
-    for i in range(no_funcs):
-        hash_i = (hash_1 + i * hash_2) % size_bits
-        if not bloom_filter[hash_i // 8] & (1 << hash_i % 8):
+class PackedBloomFilters:
+    """
+    Bloom filters of multiple fragments. For every column, the filters are stored as the
+    number of hash functions and the offset of each fragment's filter in a single packed
+    bytestring, so that a qualifier can be checked against the filters of all fragments at once.
+    """
+
+    def __init__(self, bloom_indexes: Sequence[Dict[str, Tuple[int, str]]]) -> None:
+        """
+        :param bloom_indexes: Bloom index of every fragment ({column: (k, base64-encoded filter)})
+        """
+        # {column: (k for every fragment (0 if no index), offset of every fragment's filter,
+        #  size of every fragment's filter, packed filters)}
+        self.filters: Dict[str, Tuple[List[int], List[int], List[int], bytes]] = {}
+
+        no_objects = len(bloom_indexes)
+        bitmaps: Dict[str, bytearray] = {}
+        for pos, bloom_index in enumerate(bloom_indexes):
+            for column, (k, bloom_filter) in bloom_index.items():
+                if column not in self.filters:
+                    self.filters[column] = (
+                        [0] * no_objects,
+                        [0] * no_objects,
+                        [0] * no_objects,
+                        b"",
+                    )
+                    bitmaps[column] = bytearray()
+                ks, offsets, sizes, _ = self.filters[column]
+                bitmap = base64.b64decode(bloom_filter)
+                ks[pos] = k
+                offsets[pos] = len(bitmaps[column])
+                sizes[pos] = len(bitmap)
+                bitmaps[column].extend(bitmap)
+
+        for column, column_bitmaps in bitmaps.items():
+            ks, offsets, sizes, _ = self.filters[column]
+            self.filters[column] = (ks, offsets, sizes, bytes(column_bitmaps))
+
+        # Same as self.filters, as NumPy arrays
+        self._arrays: Dict[str, Tuple[Any, Any, Any, Any]] = {}
+        if np is not None:
+            for column, (ks, offsets, sizes, packed) in self.filters.items():
+                self._arrays[column] = (
+                    np.array(ks, dtype=np.int64),
+                    np.array(offsets, dtype=np.int64),
+                    np.array(sizes, dtype=np.int64),
+                    np.frombuffer(packed, dtype=np.uint8),
+                )
+
+    def _eval_qual(self, qual: Tuple[str, int, int], positions: List[int]) -> List[bool]:
+        column, hash_1, hash_2 = qual
+        if column not in self.filters:
+            # No index info for this column -- might match
+            return [True] * len(positions)
+        if column in self._arrays:
+            return self._eval_qual_np(qual, positions)
+        ks, offsets, sizes, packed = self.filters[column]
+
+        # The bits to check only depend on the number of hash functions and the size
+        # of the filter, so only compute them once for all fragments with the same ones.
+        probes: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        result = []
+        for pos in positions:
+            no_funcs = ks[pos]
+            if not no_funcs:
+                result.append(True)
+                continue
+            params = (no_funcs, sizes[pos])
+            probe = probes.get(params)
+            if probe is None:
+                probe = probes[params] = list(
+                    zip(*_bloom_probe(hash_1, hash_2, no_funcs, sizes[pos] * 8))
+                )
+            offset = offsets[pos]
             # If at least one position in the filter isn't filled,
             # this qualifier can't be met by anything in the fragment.
-            return False
+            result.append(all(packed[offset + b] & m for b, m in probe))
+        return result
 
-    return True
+    def _eval_qual_np(self, qual: Tuple[str, int, int], positions: List[int]) -> List[bool]:
+        column, hash_1, hash_2 = qual
+        ks, offsets, sizes, packed = self._arrays[column]
+
+        positions_arr = np.array(positions, dtype=np.int64)
+        position_ks = ks[positions_arr]
+        position_sizes = sizes[positions_arr]
+        result = np.ones(len(positions), dtype=bool)
+
+        # Gather the probed bytes of all filters with the same parameters into
+        # a matrix (one row per fragment) and check that all bits are set.
+        for no_funcs, size in set(zip(position_ks.tolist(), position_sizes.tolist())):
+            if not no_funcs:
+                continue
+            group = (position_ks == no_funcs) & (position_sizes == size)
+            byte_offsets, masks = _bloom_probe(hash_1, hash_2, no_funcs, size * 8)
+            probed = packed[
+                offsets[positions_arr[group]][:, None] + np.array(byte_offsets, dtype=np.int64)
+            ]
+            result[group] = (probed & np.array(masks, dtype=np.uint8)).all(axis=1)
+        return cast(List[bool], result.tolist())
+
+    def match(
+        self, positions: List[int], bloom_quals: List[List[Tuple[str, int, int]]]
+    ) -> List[bool]:
+        """
+        Check which fragments might match the qualifiers.
+
+        :param positions: Positions of the fragments to check
+        :param bloom_quals: Qualifiers processed by `_prepare_bloom_quals`
+        :return: For every fragment, whether it might match the qualifiers (fragments
+            without a bloom index might match anything).
+        """
+        result = [True] * len(positions)
+        for or_quals in bloom_quals:
+            or_result = [False] * len(positions)
+            for qual in or_quals:
+                or_result = [
+                    left or right
+                    for left, right in zip(or_result, self._eval_qual(qual, positions))
+                ]
+            result = [left and right for left, right in zip(result, or_result)]
+        return result
 
 
 def filter_bloom_index(engine: "PsycopgEngine", object_ids: List[str], quals: Any) -> List[str]:
@@ -250,48 +422,26 @@ def filter_bloom_index(engine: "PsycopgEngine", object_ids: List[str], quals: An
     if not object_ids:
         return object_ids
 
-    quals = _prepare_bloom_quals(quals)
     # If we don't have any equalities in quals or quals collapse to something
     # that the bloom filter can't make a judgement about, do nothing.
-    if not quals:
+    bloom_quals = _prepare_bloom_quals(quals)
+    if not bloom_quals:
         return object_ids
 
     # Load the index: my SQLfu isn't strong enough to create a query that takes
     # care of varying values of K and varying signature sizes.
-    bloom_index = engine.run_sql(
-        SQL(  # nosec
-            "SELECT object_id, index -> 'bloom' FROM {}.{} WHERE object_id IN ("
-            + ",".join(itertools.repeat("%s", len(object_ids)))
-            + ")"
-        ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier("objects")),
-        object_ids,
+    bloom_index = dict(
+        engine.run_sql(
+            SQL(  # nosec
+                "SELECT object_id, index -> 'bloom' FROM {}.{} WHERE object_id IN ("
+                + ",".join(itertools.repeat("%s", len(object_ids)))
+                + ")"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier("objects")),
+            object_ids,
+        )
     )
 
-    bloom_index = {
-        o: {col: (i[0], base64.b64decode(i[1])) for col, i in index.items()}
-        for o, index in bloom_index
-        if index
-    }
-
-    dropped = []
-
-    for object_id in object_ids:
-        if object_id not in bloom_index:
-            continue
-
-        and_result = True
-        for or_quals in quals:
-            or_result = False
-            for or_qual in or_quals:
-                if _match(or_qual, bloom_index[object_id]):
-                    or_result = True
-                    break
-            if not or_result:
-                # One of the subclauses discarded this fragment.
-                and_result = False
-                break
-
-        if not and_result:
-            dropped.append(object_id)
-
-    return [o for o in object_ids if o not in dropped]
+    # Evaluate the filters of all objects at once.
+    filters = PackedBloomFilters([bloom_index.get(o) or {} for o in object_ids])
+    result = filters.match(list(range(len(object_ids))), bloom_quals)
+    return [o for o, r in zip(object_ids, result) if r]
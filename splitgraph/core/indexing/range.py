@@ -1,3 +1,4 @@
+import itertools
 import logging
 from typing import (
     TYPE_CHECKING,
@@ -6,12 +7,14 @@ from typing import (
     Dict,
     List,
     Optional,
+    Sequence,
     Tuple,
     TypeVar,
     cast,
 )
 
-from psycopg2.sql import SQL, Composable, Composed, Identifier
+from psycopg2._json import Json
+from psycopg2.sql import SQL, Composable, Composed, Identifier, Literal
 
 from splitgraph.config import SPLITGRAPH_API_SCHEMA, SPLITGRAPH_META_SCHEMA
 from splitgraph.core.common import adapt, coerce_val_to_json
@@ -19,13 +22,21 @@ from splitgraph.core.sql.queries import select
 from splitgraph.core.types import Changeset, Comparable, Quals, TableSchema
 from splitgraph.engine import ResultShape
 from splitgraph.engine.base import validate_type
-from splitgraph.engine.postgres.engine import PG_INDEXABLE_TYPES
+from splitgraph.engine.postgres.engine import PG_INDEXABLE_TYPES, get_change_key
+from splitgraph.engine.postgres.psycopg import chunk
 
 if TYPE_CHECKING:
     from splitgraph.engine.postgres.psycopg import PsycopgEngine
 
 T = TypeVar("T", bound=Comparable)
 
+# Maximum number of fragments to get the minimum/maximum PKs of in a single query.
+MIN_MAX_PK_BATCH_SIZE = 500
+
+# Key in the range index of fragments of tables without a primary key that stores
+# the boundaries of the fragment's surrogate PK (see `get_surrogate_pks`).
+SURROGATE_PK_KEY = "$surrogate_pk"
+
 
 # Custom min/max functions that ignore Nones
 def _min(left: Optional[T], right: Optional[T]) -> Optional[T]:
@@ -160,7 +171,12 @@ def quals_to_sql(quals: Optional[Quals], column_types: Dict[str, str]) -> Tuple[
 
 
 def extract_min_max_pks(
-    engine: "PsycopgEngine", fragments: List[str], table_pks: List[str], table_pk_types: List[str]
+    engine: "PsycopgEngine",
+    fragments: List[str],
+    table_pks: List[str],
+    table_pk_types: List[str],
+    batch_size: int = MIN_MAX_PK_BATCH_SIZE,
+    schema: str = SPLITGRAPH_META_SCHEMA,
 ) -> Any:
     """
     Extract minimum/maximum PK values for given fragments.
@@ -169,6 +185,8 @@ def extract_min_max_pks(
     :param fragments: IDs of objects
     :param table_pks: List of columns forming the table primary key
     :param table_pk_types: List of types for table PK columns
+    :param batch_size: Number of fragments to query in a single round trip
+    :param schema: Schema the objects are stored in
     :return: List of min/max primary key for every object.
     """
 
@@ -184,66 +202,139 @@ def extract_min_max_pks(
     # it fits both the first and the second chunk. This essentially means that chunks now overlap,
     # so we'll be fetching/scanning through them when it might not be necessary.
 
-    min_max = []
+    min_max: List[Tuple[Optional[Tuple], Optional[Tuple]]] = []
     pk_sql = SQL(",").join(
         Identifier(p) + SQL(_inject_collation("", t)) for p, t in zip(table_pks, table_pk_types)
     )
-    for fragment in fragments:
-        query = (
-            SQL("SELECT ")
+    pk_sql_desc = SQL(",").join(
+        Identifier(p) + SQL(_inject_collation("", t) + " DESC")
+        for p, t in zip(table_pks, table_pk_types)
+    )
+    for batch in chunk(fragments, batch_size):
+        # Get the first and the last PK of every fragment in the batch in one round trip,
+        # tagging each with the fragment's position in the batch and whether it's the maximum.
+        query = SQL(" UNION ALL ").join(
+            SQL("(SELECT {},{},").format(Literal(i), Literal(is_max))
             + pk_sql
-            + SQL(" FROM {}.{} ORDER BY ").format(
-                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(fragment)
-            )
+            + SQL(" FROM {}.{} ORDER BY ").format(Identifier(schema), Identifier(fragment))
+            + (pk_sql_desc if is_max else pk_sql)
+            + SQL(" LIMIT 1)")
+            for i, fragment in enumerate(batch)
+            for is_max in (False, True)
         )
-        frag_min = engine.run_sql(
-            query + pk_sql + SQL(" LIMIT 1"), return_shape=ResultShape.ONE_MANY
+
+        # Empty fragments don't return anything and have a None minimum/maximum.
+        batch_min_max: List[List[Optional[Tuple]]] = [[None, None] for _ in batch]
+        for row in engine.run_sql(query):
+            batch_min_max[row[0]][int(row[1])] = tuple(row[2:])
+        min_max.extend((frag_min, frag_max) for frag_min, frag_max in batch_min_max)
+    return min_max
+
+
+def get_surrogate_pks(
+    engine: "PsycopgEngine", object_pks: List[Tuple[Any, Any]], table_pk_types: List[str]
+) -> List[Tuple[str, str]]:
+    """
+    When partitioning data, if the table doesn't have a primary key, we use a "surrogate"
+    primary key by concatenating the whole row as a string on the PG side (this is because
+    the whole row can sometimes contain NULLs which we can't compare in PG).
+
+    We need to mimic this when calculating if the objects we're about to scan through
+    overlap: e.g. using string comparison, "(some_country, 100)" < "(some_country, 20)",
+    whereas using typed comparison, (some_country, 100) > (some_country, 20).
+
+    To do this, we use a similar hack from when calculating changeset hashes: to avoid having
+    to reproduce how PG's ::text works, we give it back the rows and get it to cast them
+    to text for us.
+
+    :param engine: Engine to use to cast the rows
+    :param object_pks: List of (min, max) PK for every fragment where PK is a tuple.
+    :param table_pk_types: List of types for table PK columns
+    :return: List of (min, max) surrogate PK for every fragment.
+    """
+    inner_tuple = "(" + ",".join("%s::" + ct for ct in table_pk_types) + ")"
+    rows = [r for o in object_pks for r in o]
+
+    result = []
+    for batch in chunk(rows, 1000):
+        query = (  # nosec
+            "SELECT o::text FROM (VALUES "
+            + ",".join(itertools.repeat(inner_tuple, len(batch)))
+            + ") o"
         )
-        frag_max = engine.run_sql(
-            query
-            + SQL(",").join(
-                Identifier(p) + SQL(_inject_collation("", t) + " DESC")
-                for p, t in zip(table_pks, table_pk_types)
+        result.extend(
+            engine.run_sql(
+                query,
+                [o if not isinstance(o, dict) else Json(o) for row in batch for o in row],
+                return_shape=ResultShape.MANY_ONE,
             )
-            + SQL(" LIMIT 1"),
-            return_shape=ResultShape.ONE_MANY,
         )
-
-        min_max.append((frag_min, frag_max))
-    return min_max
+    object_pks = [tuple(sorted(t)) for t in zip(result[::2], result[1::2])]
+    return cast(List[Tuple[str, str]], object_pks)
 
 
-def generate_range_index(
+def _add_surrogate_pk(
     object_engine: "PsycopgEngine",
-    object_id: str,
     table_schema: "TableSchema",
-    changeset: Optional[Changeset],
-    columns: Optional[List[str]] = None,
-) -> Dict[str, Tuple[T, T]]:
+    range_index: Dict[str, Any],
+) -> None:
+    # Precompute the surrogate PK boundaries for fragments of tables without a PK, so that
+    # they don't need to be calculated on the engine every time we check if fragments overlap.
+    # The PK that gets cast to text has to be the same one that
+    # FragmentManager.get_min_max_pks would load from the index.
+    if any(c.is_pk for c in table_schema):
+        return
+    table_pks = get_change_key(table_schema)
+    if not table_pks:
+        return
+    pk = table_pks[0][0] if len(table_pks) == 1 else "$pk"
+    if pk not in range_index or None in range_index[pk]:
+        return
+
+    min_max = [v if pk == "$pk" else (v,) for v in range_index[pk]]
+    object_pk = cast(
+        Tuple[Any, Any],
+        tuple(tuple(adapt(v, c[1]) for v, c in zip(bound, table_pks)) for bound in min_max),
+    )
+    range_index[SURROGATE_PK_KEY] = get_surrogate_pks(
+        object_engine, [object_pk], [c[1] for c in table_pks]
+    )[0]
+
+
+def _get_column_types(table_schema: "TableSchema") -> Dict[str, str]:
+    return {c.name: validate_type(_strip_type_mod(c.pg_type)) for c in table_schema}
+
+
+def get_range_index_columns(
+    table_schema: "TableSchema", columns: Optional[List[str]] = None
+) -> List[str]:
     """
-    Calculate the minimum/maximum values of every column in the object (including deleted values).
+    Get the columns that the range index will be generated on.
 
-    :param object_engine: Engine the object is located on
-    :param object_id: ID of the object.
     :param table_schema: Schema of the table
-    :param changeset: Changeset (old values will be included in the index)
-    :param columns: Columns to run the index on (default all)
-    :return: Dictionary of {column: [min, max]}
+    :param columns: Columns to run the index on (default all). PK columns are always indexed.
+    :return: List of columns with types that support comparisons.
     """
     columns = columns if columns is not None else [c.name for c in table_schema]
-
-    object_pk = [c.name for c in table_schema if c.is_pk]
-    if not object_pk:
-        object_pk = [c.name for c in table_schema if c.pg_type in PG_INDEXABLE_TYPES]
-    column_types = {c.name: validate_type(_strip_type_mod(c.pg_type)) for c in table_schema}
-    columns_to_index = [
+    return [
         c.name
         for c in table_schema
         if _strip_type_mod(c.pg_type) in PG_INDEXABLE_TYPES and (c.is_pk or c.name in columns)
     ]
 
-    logging.debug("Running range index on columns %s", columns_to_index)
-    query = SQL("SELECT ") + SQL(",").join(
+
+def range_index_aggregates(columns_to_index: List[str], table_schema: "TableSchema") -> Composed:
+    """
+    Generate a list of aggregates that calculate the minimum/maximum value of every column
+    (to be passed to `build_range_index`). They can be selected together with other aggregates
+    to calculate the index in the same scan through the object.
+
+    :param columns_to_index: Columns returned by `get_range_index_columns`
+    :param table_schema: Schema of the table
+    :return: SQL select list with 2 aggregates for every column.
+    """
+    column_types = _get_column_types(table_schema)
+    return SQL(",").join(
         SQL(
             _inject_collation("MIN({0}", column_types[c])
             + "), "
@@ -252,8 +343,33 @@ def generate_range_index(
         ).format(Identifier(c))
         for c in columns_to_index
     )
-    query += SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
-    result = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+
+
+def build_range_index(
+    object_engine: "PsycopgEngine",
+    object_id: str,
+    table_schema: "TableSchema",
+    changeset: Optional[Changeset],
+    columns_to_index: List[str],
+    result: Sequence[Any],
+    schema: str = SPLITGRAPH_META_SCHEMA,
+) -> Dict[str, Tuple[T, T]]:
+    """
+    Build the range index from the results of `range_index_aggregates`.
+
+    :param object_engine: Engine the object is located on
+    :param object_id: ID of the object.
+    :param table_schema: Schema of the table
+    :param changeset: Changeset (old values will be included in the index)
+    :param columns_to_index: Columns returned by `get_range_index_columns`
+    :param result: Values returned by the aggregates
+    :param schema: Schema the object is stored in
+    :return: Dictionary of {column: [min, max]}
+    """
+    object_pk = [c.name for c in table_schema if c.is_pk]
+    if not object_pk:
+        object_pk = [c.name for c in table_schema if c.pg_type in PG_INDEXABLE_TYPES]
+    column_types = _get_column_types(table_schema)
     index = {
         col: (cmin, cmax) for col, cmin, cmax in zip(columns_to_index, result[0::2], result[1::2])
     }
@@ -263,7 +379,11 @@ def generate_range_index(
         # Add the PK to the same index dict but prefix it with a dollar sign so that
         # it explicitly doesn't clash with any other columns.
         index["$pk"] = extract_min_max_pks(
-            object_engine, [object_id], object_pk, [column_types[c] for c in object_pk]
+            object_engine,
+            [object_id],
+            object_pk,
+            [column_types[c] for c in object_pk],
+            schema=schema,
         )[0]
     if changeset:
         # Expand the index ranges to include the old row values in this chunk.
@@ -300,9 +420,38 @@ def generate_range_index(
     range_index = {
         k: (coerce_val_to_json(v[0]), coerce_val_to_json(v[1])) for k, v in index.items()
     }
+    _add_surrogate_pk(object_engine, table_schema, range_index)
     return range_index
 
 
+def generate_range_index(
+    object_engine: "PsycopgEngine",
+    object_id: str,
+    table_schema: "TableSchema",
+    changeset: Optional[Changeset],
+    columns: Optional[List[str]] = None,
+) -> Dict[str, Tuple[T, T]]:
+    """
+    Calculate the minimum/maximum values of every column in the object (including deleted values).
+
+    :param object_engine: Engine the object is located on
+    :param object_id: ID of the object.
+    :param table_schema: Schema of the table
+    :param changeset: Changeset (old values will be included in the index)
+    :param columns: Columns to run the index on (default all)
+    :return: Dictionary of {column: [min, max]}
+    """
+    columns_to_index = get_range_index_columns(table_schema, columns)
+
+    logging.debug("Running range index on columns %s", columns_to_index)
+    query = SQL("SELECT ") + range_index_aggregates(columns_to_index, table_schema)
+    query += SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
+    result = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+    return build_range_index(
+        object_engine, object_id, table_schema, changeset, columns_to_index, result
+    )
+
+
 def filter_range_index(
     metadata_engine: "PsycopgEngine",
     object_ids: List[str],
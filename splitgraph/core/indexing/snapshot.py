@@ -0,0 +1,241 @@
+"""
+In-memory snapshot of the indexes of a table's fragments, used to filter fragments
+without querying the metadata engine for every query plan.
+"""
+from decimal import Decimal, InvalidOperation
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from splitgraph.core.indexing.bloom import PackedBloomFilters, _prepare_bloom_quals
+from splitgraph.core.indexing.range import _strip_type_mod
+from splitgraph.core.output import parse_date, parse_dt
+
+if TYPE_CHECKING:
+    from splitgraph.core.metadata_manager import Object
+
+
+def _to_decimal(value: Any) -> Decimal:
+    # Go through the string representation so that e.g. 0.1 compares the same way
+    # as the numeric literal that Postgres would get.
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _to_str(value: Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError("Expected a string, got %r" % value)
+    return value
+
+
+def _to_int(value: Any) -> Any:
+    # Postgres compares integer columns to numeric values exactly, which Python also does.
+    if isinstance(value, str):
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+        raise TypeError("Expected a number, got %r" % value)
+    return value
+
+
+def _to_float(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise TypeError("Expected a number, got %r" % value)
+    return float(value)
+
+
+def _to_date(value: Any) -> Any:
+    return parse_date(value) if isinstance(value, str) else value
+
+
+def _to_dt(value: Any) -> Any:
+    return parse_dt(value) if isinstance(value, str) else value
+
+
+# Types that the snapshot can compare in the same way as the range index query does
+# (see splitgraph.core.indexing.range._qual_to_index_clause) and functions to convert both
+# the index values and the qualifier values to Python values. Quals on columns with other
+# types are evaluated by the engine instead.
+_RANGE_TYPES: Dict[str, Callable[[Any], Any]] = {
+    "integer": _to_int,
+    "bigint": _to_int,
+    "smallint": _to_int,
+    "numeric": _to_decimal,
+    "double precision": _to_float,
+    # String comparisons in the range index use the C collation, which
+    # matches Python's codepoint order for UTF-8.
+    "text": _to_str,
+    "character varying": _to_str,
+    "date": _to_date,
+    "timestamp": _to_dt,
+    "timestamp without time zone": _to_dt,
+}
+
+
+class UnsupportedQualError(Exception):
+    """Raised when a qualifier can't be evaluated against the snapshot."""
+
+
+class IndexSnapshot:
+    """
+    Column-oriented copy of the range and bloom indexes of multiple fragments. For every
+    column, the range index is stored as arrays of minimum/maximum values converted to Python
+    types and the bloom index as `PackedBloomFilters`, so that a qualifier can be checked against
+    the indexes of all fragments at once.
+    """
+
+    def __init__(
+        self,
+        object_ids: Sequence[str],
+        column_types: Dict[str, str],
+        object_indexes: Sequence[Dict[str, Any]],
+    ) -> None:
+        """
+        :param object_ids: IDs of the fragments
+        :param column_types: Dictionary of column names and their types
+        :param object_indexes: Index of every fragment (see `FragmentManager.generate_object_index`)
+        """
+        self.object_ids = list(object_ids)
+        self.positions = {o: i for i, o in enumerate(self.object_ids)}
+        self.column_types = {c: _strip_type_mod(t) for c, t in column_types.items()}
+
+        # {column: (has index for every fragment, min for every fragment, max for every fragment)}
+        self.ranges: Dict[str, Tuple[List[bool], List[Any], List[Any]]] = {}
+
+        no_objects = len(self.object_ids)
+        for pos, index in enumerate(object_indexes):
+            for column, (cmin, cmax) in (index.get("range") or {}).items():
+                if column not in self.ranges:
+                    self.ranges[column] = (
+                        [False] * no_objects,
+                        [None] * no_objects,
+                        [None] * no_objects,
+                    )
+                has_index, mins, maxs = self.ranges[column]
+                has_index[pos] = True
+                mins[pos] = cmin
+                maxs[pos] = cmax
+
+        self.blooms = PackedBloomFilters([index.get("bloom") or {} for index in object_indexes])
+
+        # Convert the range index values (stored as JSON) to Python values for the types we support.
+        # {column: function to convert qualifier values}
+        self.range_converters: Dict[str, Callable[[Any], Any]] = {}
+        for column, (has_index, mins, maxs) in self.ranges.items():
+            converter = _RANGE_TYPES.get(self.column_types.get(column, ""))
+            if not converter:
+                continue
+            try:
+                mins = [converter(v) if v is not None else None for v in mins]
+                maxs = [converter(v) if v is not None else None for v in maxs]
+            except (TypeError, ValueError, InvalidOperation):
+                continue
+            # NaNs don't compare in Python the same way as in Postgres.
+            if any(v != v for v in mins + maxs if v is not None):
+                continue
+            self.ranges[column] = (has_index, mins, maxs)
+            self.range_converters[column] = converter
+
+    @classmethod
+    def from_object_meta(
+        cls,
+        object_ids: Sequence[str],
+        column_types: Dict[str, str],
+        object_meta: Dict[str, "Object"],
+    ) -> "IndexSnapshot":
+        """
+        Build the snapshot from object metadata. Objects without metadata are assumed
+        to not have an index.
+        """
+        return cls(
+            object_ids,
+            column_types,
+            [object_meta[o].object_index if o in object_meta else {} for o in object_ids],
+        )
+
+    def _eval_range_qual(self, qual: Tuple[str, str, Any], positions: List[int]) -> List[bool]:
+        column, operator, value = qual
+        if column not in self.column_types:
+            raise UnsupportedQualError("Unknown column %s" % column)
+        if operator not in (">", ">=", "<", "<=", "="):
+            # We can't make a judgement about other operators.
+            return [True] * len(positions)
+        if column not in self.ranges:
+            # No index information for this column: all fragments might match.
+            return [True] * len(positions)
+        converter = self.range_converters.get(column)
+        if not converter or value is None:
+            raise UnsupportedQualError(
+                "Can't evaluate %s %s %r in the snapshot" % (column, operator, value)
+            )
+        try:
+            value = converter(value)
+        except (TypeError, ValueError, InvalidOperation) as e:
+            raise UnsupportedQualError(str(e)) from e
+        if value != value:
+            raise UnsupportedQualError("Can't compare with NaN")
+
+        has_index, mins, maxs = self.ranges[column]
+
+        # A missing index entry means the fragment might match. A NULL bound means
+        # that the comparison isn't true (like in the query against the index).
+        try:
+            if operator == ">":
+                return [
+                    not has_index[p] or (maxs[p] is not None and maxs[p] > value) for p in positions
+                ]
+            if operator == ">=":
+                return [
+                    not has_index[p] or (maxs[p] is not None and maxs[p] >= value)
+                    for p in positions
+                ]
+            if operator == "<":
+                return [
+                    not has_index[p] or (mins[p] is not None and mins[p] < value) for p in positions
+                ]
+            if operator == "<=":
+                return [
+                    not has_index[p] or (mins[p] is not None and mins[p] <= value)
+                    for p in positions
+                ]
+            return [
+                not has_index[p]
+                or (mins[p] is not None and maxs[p] is not None and mins[p] <= value <= maxs[p])
+                for p in positions
+            ]
+        except (TypeError, InvalidOperation) as e:
+            raise UnsupportedQualError(str(e)) from e
+
+    def filter_range_index(self, object_ids: List[str], quals: Any) -> List[str]:
+        """
+        Discard fragments that definitely don't match the qualifiers using their range index.
+        Same as `splitgraph.core.indexing.range.filter_range_index`.
+
+        :param object_ids: IDs of fragments in the snapshot
+        :param quals: Qualifiers in CNF
+        :return: List of object IDs that might match the qualifiers.
+        :raises UnsupportedQualError: if one of the qualifiers can't be evaluated in-process.
+        """
+        positions = [self.positions[o] for o in object_ids]
+        result = [True] * len(positions)
+        for or_quals in quals or []:
+            or_result = [False] * len(positions)
+            for qual in or_quals:
+                or_result = [
+                    left or right
+                    for left, right in zip(or_result, self._eval_range_qual(qual, positions))
+                ]
+            result = [left and right for left, right in zip(result, or_result)]
+        return [o for o, r in zip(object_ids, result) if r]
+
+    def filter_bloom_index(self, object_ids: List[str], quals: Any) -> List[str]:
+        """
+        Discard fragments that definitely don't match the qualifiers using their bloom index.
+        Same as `splitgraph.core.indexing.bloom.filter_bloom_index`.
+
+        :param object_ids: IDs of fragments in the snapshot
+        :param quals: Qualifiers in CNF
+        :return: List of object IDs that might match the qualifiers.
+        """
+        bloom_quals = _prepare_bloom_quals(quals)
+        if not object_ids or not bloom_quals:
+            return object_ids
+
+        result = self.blooms.match([self.positions[o] for o in object_ids], bloom_quals)
+        return [o for o, r in zip(object_ids, result) if r]
@@ -0,0 +1,209 @@
+"""
+Per-fragment column statistics (NULL counts, HyperLogLog sketches of the number of distinct
+values and equi-depth histograms) that are used to estimate how many rows of a fragment
+match a query.
+"""
+import base64
+import bisect
+from decimal import InvalidOperation
+from math import log
+from typing import Any, Dict, List, Optional, Sequence
+
+from psycopg2.sql import SQL, Composed, Identifier
+
+from splitgraph.core.common import coerce_val_to_json
+from splitgraph.core.indexing.range import _inject_collation, _strip_type_mod
+from splitgraph.core.indexing.snapshot import _RANGE_TYPES
+from splitgraph.core.types import TableSchema
+from splitgraph.engine.postgres.engine import PG_INDEXABLE_TYPES, SG_UD_FLAG
+
+# Number of bits of the hash used to pick a HyperLogLog register (64 registers,
+# giving a standard error of about 13% for the number of distinct values).
+HLL_PRECISION = 6
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+# Number of buckets in the histograms of column values
+HISTOGRAM_BUCKETS = 8
+
+
+def get_column_stats_columns(table_schema: TableSchema, columns: List[str]) -> List[str]:
+    """
+    Get the columns that statistics will be collected on.
+
+    :param table_schema: Schema of the table
+    :param columns: Columns to collect statistics on
+    :return: List of columns in the order they appear in the table
+    """
+    return [c.name for c in table_schema if c.name in columns]
+
+
+def column_stats_aggregates(columns: List[str], table_schema: TableSchema) -> Composed:
+    """
+    Generate a list of aggregates that collect statistics on the rows that a fragment
+    inserts (to be passed to `build_column_stats`). For every column, these are:
+
+      * the number of NULLs
+      * distinct pairs of (register, rank) of the HyperLogLog sketch of the column's values,
+        encoded as `register * 64 + rank`
+      * boundaries of the equi-depth histogram of the column's values (NULL for
+        columns whose values can't be compared)
+
+    :param columns: Columns returned by `get_column_stats_columns`
+    :param table_schema: Schema of the table
+    :return: SQL select list with 3 aggregates for every column.
+    """
+    column_types = {c.name: _strip_type_mod(c.pg_type) for c in table_schema}
+    percentiles = ",".join(str(i / HISTOGRAM_BUCKETS) for i in range(HISTOGRAM_BUCKETS + 1))
+
+    # Use the bits after the register number to find the rank (position of the first
+    # set bit, or the number of bits + 1 if there are none).
+    hll_hash = "hashtextextended({0}::text, 0)"
+    hll_bits = 64 - HLL_PRECISION
+    hll_value = (
+        "(%s & %d) * 64 + COALESCE(NULLIF(position(B'1' IN (%s >> %d)::bit(%d)), 0), %d)"
+        % (
+            hll_hash,
+            HLL_REGISTERS - 1,
+            hll_hash,
+            HLL_PRECISION,
+            hll_bits,
+            hll_bits + 1,
+        )
+    )
+
+    aggregates = []
+    for column in columns:
+        ctype = column_types[column]
+        histogram = (
+            "percentile_disc(ARRAY["
+            + percentiles
+            + "]::double precision[]) WITHIN GROUP (ORDER BY "
+            + _inject_collation("{0}", ctype)
+            + ") FILTER (WHERE {1})"
+            if ctype in PG_INDEXABLE_TYPES
+            else "NULL"
+        )
+        aggregates.append(
+            SQL(
+                "count(*) FILTER (WHERE {1}) - count({0}) FILTER (WHERE {1}), "
+                "array_agg(DISTINCT "
+                + hll_value
+                + ") FILTER (WHERE {1} AND {0} IS NOT NULL), "
+                + histogram
+            ).format(Identifier(column), Identifier(SG_UD_FLAG))
+        )
+    return SQL(",").join(aggregates)
+
+
+def _hll_registers(encoded: Optional[List[int]]) -> bytes:
+    registers = bytearray(HLL_REGISTERS)
+    for value in encoded or []:
+        register, rank = divmod(value, 64)
+        registers[register] = max(registers[register], rank)
+    return bytes(registers)
+
+
+def build_column_stats(columns: List[str], result: Sequence[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the column statistics from the results of `column_stats_aggregates`.
+
+    :param columns: Columns returned by `get_column_stats_columns`
+    :param result: Values returned by the aggregates
+    :return: Dictionary of {column: {"nulls": number of NULLs, "hll": base64-encoded
+        HyperLogLog registers, "histogram": histogram boundaries}}.
+    """
+    stats: Dict[str, Dict[str, Any]] = {}
+    for column, nulls, hll, histogram in zip(columns, result[0::3], result[1::3], result[2::3]):
+        column_stats = {
+            "nulls": nulls or 0,
+            "hll": base64.b64encode(_hll_registers(hll)).decode("ascii"),
+        }
+        if histogram and None not in histogram:
+            column_stats["histogram"] = [coerce_val_to_json(v) for v in histogram]
+        stats[column] = column_stats
+    return stats
+
+
+def estimate_distinct(registers: bytes) -> float:
+    """
+    Estimate the number of distinct values from the registers of a HyperLogLog sketch.
+    """
+    no_registers = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / no_registers)
+    estimate = alpha * no_registers**2 / sum(2.0**-r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * no_registers and zeros:
+        # Small range correction
+        return no_registers * log(no_registers / zeros)
+    return estimate
+
+
+def _histogram_position(histogram: List[Any], value: Any) -> float:
+    """Estimate the fraction of values in the histogram that are smaller than `value`."""
+    buckets = len(histogram) - 1
+    position = bisect.bisect_left(histogram, value)
+    if position == 0:
+        return 0.0
+    if position > buckets:
+        return 1.0
+    # Assume the value is in the middle of its bucket
+    return (position - 0.5) / buckets
+
+
+def _qual_selectivity(
+    column_stats: Dict[str, Any], rows: int, qual: Any, column_types: Dict[str, str]
+) -> float:
+    column, operator, value = qual
+    stats = column_stats.get(column)
+    if not stats or value is None:
+        return 1.0
+    non_null: float = max(rows - stats["nulls"], 0) / rows
+
+    histogram = None
+    position = 0.0
+    converter = _RANGE_TYPES.get(_strip_type_mod(column_types.get(column, "")))
+    if "histogram" in stats and converter:
+        try:
+            histogram = [converter(v) for v in stats["histogram"]]
+            value = converter(value)
+            position = _histogram_position(histogram, value)
+        except (TypeError, ValueError, InvalidOperation):
+            histogram = None
+
+    if operator in ("=", "<>", "!="):
+        distinct = estimate_distinct(base64.b64decode(stats["hll"]))
+        equal = non_null / max(distinct, 1.0)
+        if histogram and (value < histogram[0] or value > histogram[-1]):
+            equal = 0.0
+        return equal if operator == "=" else non_null - equal
+    if histogram and operator in ("<", "<="):
+        return non_null * position
+    if histogram and operator in (">", ">="):
+        return non_null * (1 - position)
+    # We can't make a judgement about other operators.
+    return 1.0
+
+
+def estimate_selectivity(
+    column_stats: Optional[Dict[str, Any]], rows: int, quals: Any, column_types: Dict[str, str]
+) -> float:
+    """
+    Estimate the fraction of rows in a fragment that match the qualifiers.
+
+    :param column_stats: Statistics of the fragment (see `build_column_stats`)
+    :param rows: Number of rows the fragment inserts
+    :param quals: Qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: Fraction of rows between 0 and 1. Qualifiers on columns without statistics
+        are assumed to match all rows.
+    """
+    if not column_stats or not quals or rows <= 0:
+        return 1.0
+
+    selectivity = 1.0
+    for or_quals in quals:
+        # Assume that the clauses are independent (like Postgres does).
+        selectivity *= min(
+            sum(_qual_selectivity(column_stats, rows, q, column_types) for q in or_quals), 1.0
+        )
+    return selectivity
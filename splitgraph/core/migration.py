@@ -172,6 +172,9 @@ META_TABLES = [
     "object_locations",
     "object_cache_status",
     "object_cache_occupancy",
+    "object_cache_ghosts",
+    "fragment_groups",
+    "query_plans",
     "info",
     "version",
 ]
@@ -1,9 +1,9 @@
 """Functions related to creating, deleting and keeping track of physical Splitgraph objects."""
-import datetime
+import csv
 import itertools
 import logging
-import math
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime as dt
 from typing import (
@@ -17,12 +17,22 @@ from typing import (
     Sequence,
     Tuple,
     Union,
+    cast,
 )
 
+from psycopg2.extras import Json
 from psycopg2.sql import SQL, Identifier
 
 from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
 from splitgraph.config.config import get_singleton
+from splitgraph.core.eviction import (
+    CacheEntry,
+    EvictionPolicy,
+    EvictionState,
+    GhostEntry,
+    get_eviction_policy,
+    select_evicted_objects,
+)
 from splitgraph.core.fragment_manager import FragmentManager
 from splitgraph.core.types import Quals
 from splitgraph.engine import ResultShape
@@ -35,7 +45,14 @@ from splitgraph.exceptions import (
 from splitgraph.hooks.external_objects import get_external_object_handler
 
 from ..engine.config import switch_engine
-from .common import CallbackList, Tracer
+from ..engine.postgres.psycopg import chunk
+from .common import (
+    CACHE_LAST_USED_RESOLUTION,
+    CallbackList,
+    Tracer,
+    run_in_separate_transaction,
+    update_engine_cache,
+)
 from .migration import META_TABLES
 from .output import pluralise, pretty_size, truncate_list
 from .sql.queries import insert, select
@@ -80,6 +97,22 @@ class ObjectManager(FragmentManager):
         # of more possible cache misses.
         self.eviction_min_fraction = float(get_singleton(CONFIG, "SG_EVICTION_MIN_FRACTION"))
 
+        # Name of the policy that decides which objects to evict first (see splitgraph.core.eviction)
+        self.eviction_policy = str(get_singleton(CONFIG, "SG_EVICTION_POLICY"))
+
+        # File to record object cache accesses to (see splitgraph.core.eviction.load_trace)
+        self.eviction_trace = get_singleton(CONFIG, "SG_EVICTION_TRACE")
+
+        # Maximum number of query plans to keep in the engine's query plan cache.
+        self.query_plan_cache_size = int(get_singleton(CONFIG, "SG_QUERY_PLAN_CACHE_SIZE"))
+
+        # Number of fragments to download in the background ahead of the ones being queried
+        # (0 to download all fragments before running a query).
+        self.fragment_prefetch = int(get_singleton(CONFIG, "SG_FRAGMENT_PREFETCH"))
+
+        # Number of connections to use to apply groups of non-overlapping fragments in parallel.
+        self.fragment_apply_threads = int(get_singleton(CONFIG, "SG_FRAGMENT_APPLY_THREADS"))
+
     def get_downloaded_objects(self, limit_to: Optional[List[str]] = None) -> List[str]:
         """
         Gets a list of objects currently in the Splitgraph cache (i.e. not only existing externally.)
@@ -123,6 +156,129 @@ class ObjectManager(FragmentManager):
             )
         )
 
+    def get_cached_query_plan(self, plan_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a query plan from the engine's query plan cache.
+
+        Cache hits only read from the engine: the plan's last used timestamp only gets
+        updated (in a separate transaction) once it's more than a minute old.
+
+        :param plan_key: Key of the plan (see `splitgraph.core.table.QueryPlan`)
+        :return: Plan data or None if the plan isn't in the cache.
+        """
+        if not self.query_plan_cache_size:
+            return None
+
+        result = self.object_engine.run_sql(
+            SQL("SELECT plan, last_used FROM {}.query_plans WHERE plan_key = %s").format(
+                Identifier(SPLITGRAPH_META_SCHEMA)
+            ),
+            (plan_key,),
+            return_shape=ResultShape.ONE_MANY,
+        )
+        if result is None:
+            return None
+        plan, last_used = result
+
+        now = dt.utcnow()
+        if last_used is None or last_used < now - CACHE_LAST_USED_RESOLUTION:
+            update_engine_cache(
+                self.object_engine,
+                lambda: self.object_engine.run_sql(
+                    SQL("UPDATE {}.query_plans SET last_used = %s WHERE plan_key = %s").format(
+                        Identifier(SPLITGRAPH_META_SCHEMA)
+                    ),
+                    (now, plan_key),
+                ),
+                "query plan",
+            )
+        return cast(Dict[str, Any], plan)
+
+    def cache_query_plan(self, plan_key: str, table: "Table", plan: Dict[str, Any]) -> None:
+        """
+        Store a query plan in the engine's query plan cache, evicting least recently
+        used plans if the cache is full.
+
+        The plan is stored in a separate transaction that gets committed straight away
+        (so that the caller's transaction doesn't hold locks on the cache). Errors are
+        logged instead of raised.
+
+        :param plan_key: Key of the plan
+        :param table: Table the plan is for
+        :param plan: JSON-serializable plan data
+        """
+        if not self.query_plan_cache_size:
+            return
+
+        update_engine_cache(
+            self.object_engine,
+            lambda: self._cache_query_plan(plan_key, table, plan),
+            "query plan",
+        )
+
+    def _cache_query_plan(self, plan_key: str, table: "Table", plan: Dict[str, Any]) -> None:
+        self.object_engine.run_sql(
+            SQL(
+                "INSERT INTO {}.query_plans (plan_key, namespace, repository, image_hash, "
+                "table_name, plan, last_used) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (plan_key) DO UPDATE SET plan = EXCLUDED.plan, "
+                "last_used = EXCLUDED.last_used"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            (
+                plan_key,
+                table.repository.namespace,
+                table.repository.repository,
+                table.image.image_hash,
+                table.table_name,
+                Json(plan),
+                dt.utcnow(),
+            ),
+        )
+        cached = self.object_engine.run_sql(
+            SQL("SELECT COUNT(1) FROM {}.query_plans").format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            return_shape=ResultShape.ONE_ONE,
+        )
+        if cached > self.query_plan_cache_size:
+            self.object_engine.run_sql(
+                SQL(
+                    "DELETE FROM {0}.query_plans WHERE plan_key IN (SELECT plan_key "
+                    "FROM {0}.query_plans ORDER BY last_used DESC OFFSET %s)"
+                ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                (self.query_plan_cache_size,),
+            )
+
+    def invalidate_query_plans(
+        self,
+        namespace: str,
+        repository: str,
+        image_hashes: Optional[List[str]] = None,
+        table_name: Optional[str] = None,
+    ) -> None:
+        """
+        Delete cached query plans for a repository.
+
+        The plans are deleted in a separate transaction, like all other writes to the
+        query plan cache, so that the caller's transaction doesn't hold locks on them.
+
+        :param namespace: Namespace of the repository
+        :param repository: Name of the repository
+        :param image_hashes: If specified, only delete plans for these images.
+        :param table_name: If specified, only delete plans for this table.
+        """
+        query = SQL("DELETE FROM {}.query_plans WHERE namespace = %s AND repository = %s").format(
+            Identifier(SPLITGRAPH_META_SCHEMA)
+        )
+        args: List[Any] = [namespace, repository]
+        if image_hashes is not None:
+            query += SQL(" AND image_hash = ANY(%s)")
+            args.append(list(image_hashes))
+        if table_name is not None:
+            query += SQL(" AND table_name = %s")
+            args.append(table_name)
+        run_in_separate_transaction(
+            self.object_engine, lambda: self.object_engine.run_sql(query, args)
+        )
+
     def get_total_object_size(self):
         """
         :return: Space occupied by all objects on the engine, in bytes.
@@ -200,6 +356,7 @@ class ObjectManager(FragmentManager):
         logging.debug("Claiming %s", pluralise("object", len(required_objects)))
 
         self._claim_objects(required_objects)
+        self._record_accesses(required_objects)
         tracer.log("claim_objects")
 
         try:
@@ -278,6 +435,111 @@ class ObjectManager(FragmentManager):
             if not defer_release:
                 release_callback()
 
+    def prefetch_objects(
+        self,
+        table: Optional["Table"],
+        objects: List[str],
+        lookahead: Optional[int] = None,
+        tracer: Optional[Tracer] = None,
+        upstream_manager: Optional["ObjectManager"] = None,
+    ) -> Tuple[Iterator[str], CallbackList]:
+        """
+        Streaming version of `ensure_objects`: instead of downloading all objects before returning,
+        returns an iterator that yields objects in order as soon as they're available locally.
+
+        Objects are downloaded in the background in batches of `lookahead` objects: whilst the caller
+        is using objects from one batch, the next batch is being downloaded. Each batch is claimed
+        right before it's downloaded and, like with `ensure_objects(defer_release=True)`, all claimed
+        objects are only released when the caller calls the returned callback.
+
+        :param table: Table the objects belong to (used to find the upstream to download them from)
+        :param objects: List of objects, in the order that they will be used in.
+        :param lookahead: Number of objects to download ahead of the ones being used.
+            By default, uses SG_FRAGMENT_PREFETCH.
+        :param tracer: Optional Tracer to log the time taken by the caller in.
+        :param upstream_manager: ObjectManager of the upstream repository to download objects from.
+        :return: Iterator of objects and a callback that the caller must call when the objects
+            are no longer needed (even if the iterator hasn't been exhausted).
+        """
+        tracer = tracer or Tracer()
+        lookahead = lookahead or self.fragment_prefetch
+
+        if not lookahead or len(self.get_downloaded_objects(limit_to=objects)) == len(set(objects)):
+            # Nothing to download: claim all objects at once.
+            with self.ensure_objects(
+                table,
+                objects=objects,
+                defer_release=True,
+                tracer=tracer,
+                upstream_manager=upstream_manager,
+            ) as eo_result:
+                _, release_callback = cast(Tuple, eo_result)
+            return iter(objects), release_callback
+
+        if (
+            self.metadata_engine == self.object_engine
+            and table is not None
+            and upstream_manager is None
+        ):
+            upstream_manager = (
+                table.repository.upstream.objects if table.repository.upstream else None
+            )
+        self.object_engine.commit()
+        self.metadata_engine.commit()
+
+        # Downloading objects changes engine-wide state (e.g. puts it in autocommit mode and
+        # closes connections used by other threads), so we use separate engines for it to not
+        # interfere with the caller who will be querying the objects at the same time.
+        object_engine = cast("PostgresEngine", self.object_engine.clone())
+        metadata_engine = (
+            object_engine
+            if self.metadata_engine == self.object_engine
+            else cast("PostgresEngine", self.metadata_engine.clone())
+        )
+        prefetch_manager = type(self)(object_engine, metadata_engine)
+
+        batches = list(chunk(objects, lookahead))
+        futures: List["Future[List[str]]"] = []
+        executor = ThreadPoolExecutor(max_workers=1)
+        released = False
+
+        def _fetch(batch: List[str]) -> List[str]:
+            with prefetch_manager.ensure_objects(
+                table=None,
+                objects=batch,
+                defer_release=True,
+                upstream_manager=upstream_manager,
+            ):
+                return batch
+
+        def _submit(batch_no: int) -> None:
+            if not released and batch_no < len(batches):
+                futures.append(executor.submit(_fetch, batches[batch_no]))
+
+        def _generate() -> Iterator[str]:
+            _submit(0)
+            for batch_no in range(len(batches)):
+                if released:
+                    return
+                batch = futures[batch_no].result()
+                _submit(batch_no + 1)
+                yield from batch
+
+        def _release(**kwargs):
+            nonlocal released
+            if released:
+                return
+            released = True
+            # Wait for the batch that's currently being downloaded to finish: if it fails,
+            # ensure_objects will have already released it.
+            executor.shutdown(wait=True)
+            claimed = [o for f in futures if not f.exception() for o in f.result()]
+            object_engine.close_pool()
+            metadata_engine.close_pool()
+            self._make_release_callback(claimed, table, tracer)(**kwargs)
+
+        return _generate(), CallbackList([_release])
+
     def _generate_download_error(self, table, difference, cause=None):
         if table:
             error = "Not all objects required for %s:%s:%s have been fetched. Missing %s (%s)" % (
@@ -380,6 +642,7 @@ class ObjectManager(FragmentManager):
         external_handler = get_external_object_handler(handler, handler_params)
 
         partial_failure: Optional[IncompleteObjectUploadError] = None
+        successful: Dict[str, Optional[str]]
         try:
             with switch_engine(self.object_engine):
                 successful = {
@@ -390,7 +653,7 @@ class ObjectManager(FragmentManager):
             partial_failure = e
             successful = {o: u for o, u in zip(e.successful_objects, e.successful_object_urls)}
 
-        locations = [(o, u, handler) for o, u in successful.items()]
+        locations = [(o, u, handler) for o, u in successful.items() if u]
         self.register_object_locations(locations)
 
         # Increase the cache occupancy since the objects can now be evicted.
@@ -491,8 +754,9 @@ class ObjectManager(FragmentManager):
 
         claimed = self.object_engine.run_sql(
             SQL(  # nosec
-                "UPDATE {}.object_cache_status SET refcount = refcount + 1, "
-                "last_used = %s WHERE object_id IN ("
+                "UPDATE {0}.object_cache_status SET refcount = refcount + 1, "
+                "last_used = %s, access_count = access_count + 1, "
+                "clock = (SELECT clock FROM {0}.object_cache_occupancy) WHERE object_id IN ("
             ).format(Identifier(SPLITGRAPH_META_SCHEMA))
             + SQL(",".join(itertools.repeat("%s", len(objects))))
             + SQL(") RETURNING object_id"),
@@ -508,16 +772,105 @@ class ObjectManager(FragmentManager):
         # in a consistent order between all instances.
         remaining = sorted(remaining)
 
+        if not remaining:
+            return
+
+        # If any of the objects have recently been evicted, restore their access history.
+        access_counts = self._restore_ghost_entries(remaining)
+        clock = self._get_eviction_state().clock
+
         # Remaining: objects that are new to the cache and that we'll need to download. However, between us
         # running the first query and now, somebody else might have started downloading them. Hence, when
         # we try to insert them, we'll be blocked until the other engine finishes its download and commits
         # the transaction -- then get an integrity error. So here, we do an update on conflict (again).
         self.object_engine.run_sql_batch(
-            insert("object_cache_status", ("object_id", "ready", "refcount", "last_used"))
+            insert(
+                "object_cache_status",
+                ("object_id", "ready", "refcount", "last_used", "access_count", "clock"),
+            )
             + SQL(
-                "ON CONFLICT (object_id) DO UPDATE SET refcount = EXCLUDED.refcount + 1, last_used = %s"
+                "ON CONFLICT (object_id) DO UPDATE SET refcount = EXCLUDED.refcount + 1, last_used = %s, "
+                "access_count = {}.object_cache_status.access_count + 1"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            [
+                (object_id, False, 1, now, access_counts.get(object_id, 0) + 1, clock, now)
+                for object_id in remaining
+            ],
+        )
+
+    def _record_accesses(self, objects: List[str]) -> None:
+        if not self.eviction_trace or not objects:
+            return
+        now = dt.utcnow().isoformat()
+        object_meta = self.get_object_meta(objects)
+        with open(self.eviction_trace, "a", newline="") as f:
+            csv.writer(f).writerows(
+                (now, object_id, object_meta[object_id].size)
+                for object_id in objects
+                if object_id in object_meta
+            )
+
+    def _restore_ghost_entries(self, objects: List[str]) -> Dict[str, int]:
+        """Delete ghost entries for objects that are being downloaded again, returning their
+        access counts and letting the eviction policy adapt to them."""
+        ghosts = [
+            GhostEntry(*g)
+            for g in self.object_engine.run_sql(
+                SQL(  # nosec
+                    "DELETE FROM {}.object_cache_ghosts WHERE object_id IN ("
+                    + ",".join(itertools.repeat("%s", len(objects)))
+                    + ") RETURNING object_id, size, access_count"
+                ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                objects,
+                return_shape=ResultShape.MANY_MANY,
+            )
+        ]
+        if not ghosts:
+            return {}
+
+        policy = self._get_eviction_policy()
+        state = self._get_eviction_state()
+        ghost_sizes = cast(
+            Tuple[int, int],
+            self.object_engine.run_sql(
+                SQL(
+                    "SELECT COALESCE(SUM(size) FILTER (WHERE access_count <= 1), 0), "
+                    "COALESCE(SUM(size) FILTER (WHERE access_count > 1), 0) "
+                    "FROM {}.object_cache_ghosts"
+                ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                return_shape=ResultShape.ONE_MANY,
+            ),
+        )
+        for ghost in ghosts:
+            state = policy.on_ghost_hit(ghost, ghost_sizes, self.cache_size, state)
+        self._set_eviction_state(state)
+        return {g.object_id: g.access_count for g in ghosts}
+
+    def _get_eviction_policy(self) -> EvictionPolicy:
+        return get_eviction_policy(
+            self.eviction_policy,
+            decay_constant=self.eviction_decay_constant,
+            floor=self.eviction_floor,
+        )
+
+    def _get_eviction_state(self) -> EvictionState:
+        clock, arc_target = cast(
+            Tuple[float, int],
+            self.object_engine.run_sql(
+                SQL("SELECT clock, arc_target FROM {}.object_cache_occupancy").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA)
+                ),
+                return_shape=ResultShape.ONE_MANY,
+            ),
+        )
+        return EvictionState(clock=clock, arc_target=arc_target)
+
+    def _set_eviction_state(self, state: EvictionState) -> None:
+        self.object_engine.run_sql(
+            SQL("UPDATE {}.object_cache_occupancy SET clock = %s, arc_target = %s").format(
+                Identifier(SPLITGRAPH_META_SCHEMA)
             ),
-            [(object_id, False, 1, now, now) for object_id in remaining],
+            (state.clock, state.arc_target),
         )
 
     def _set_ready_flags(self, objects: List[str], is_ready: bool = True) -> None:
@@ -564,7 +917,12 @@ class ObjectManager(FragmentManager):
             (size_freed,),
         )
 
-    def run_eviction(self, keep_objects: List[str], required_space: Optional[int] = None) -> None:
+    def run_eviction(
+        self,
+        keep_objects: List[str],
+        required_space: Optional[int] = None,
+        best_effort: bool = False,
+    ) -> int:
         """
         Delete enough objects with zero reference count (only those, since we guarantee that whilst refcount is >0,
         the object stays alive) to free at least `required_space` in the cache.
@@ -572,6 +930,9 @@ class ObjectManager(FragmentManager):
         :param keep_objects: List of objects (besides those with nonzero refcount) that can't be deleted.
         :param required_space: Space, in bytes, to free. If the routine can't free at least this much space,
             it shall raise an exception. If None, removes all eligible objects.
+        :param best_effort: If the routine can't free `required_space`, free as much as possible instead
+            of raising an exception.
+        :return: Space, in bytes, that was freed.
         """
 
         logging.info("Performing eviction...")
@@ -580,7 +941,9 @@ class ObjectManager(FragmentManager):
         candidates = [
             o
             for o in self.object_engine.run_sql(
-                select("object_cache_status", "object_id,last_used", "refcount=0"),
+                select(
+                    "object_cache_status", "object_id,last_used,access_count,clock", "refcount=0"
+                ),
                 return_shape=ResultShape.MANY_MANY,
             )
             if o[0] not in keep_objects
@@ -610,38 +973,80 @@ class ObjectManager(FragmentManager):
                 pretty_size(freed_space),
             )
         else:
-            if required_space > sum(object_sizes.values()) + sum(orphaned_object_sizes.values()):
-                raise ObjectCacheError("Not enough space will be reclaimed after eviction!")
-
-            to_delete, freed_space = self._prepare_eviction_candidates(
-                candidates, object_sizes, orphaned_object_sizes, orphaned_objects, required_space
-            )
+            reclaimable_space = sum(object_sizes.values()) + sum(orphaned_object_sizes.values())
+            if required_space > reclaimable_space:
+                if not best_effort:
+                    raise ObjectCacheError("Not enough space will be reclaimed after eviction!")
+                required_space = reclaimable_space
+
+            if required_space > 0:
+                to_delete, freed_space = self._prepare_eviction_candidates(
+                    candidates,
+                    object_sizes,
+                    orphaned_object_sizes,
+                    orphaned_objects,
+                    required_space,
+                )
+            else:
+                to_delete, freed_space = [], 0
 
         if to_delete:
             # NB delete_objects commits as well, releasing the lock. Make sure to do all bookkeeping first so that
             # other object managers in this function think that the objects have been deleted and don't try to delete
             # them again.
+            deleted = set(to_delete)
+            self._record_evictions(
+                [
+                    CacheEntry(o[0], object_sizes[o[0]], o[1], o[2], o[3])
+                    for o in candidates
+                    if o[0] in deleted and o[0] in object_sizes
+                ]
+            )
             self._delete_cache_entries(to_delete)
             self._decrease_cache_occupancy(freed_space)
             self.delete_objects(to_delete)
             logging.info(
                 "Eviction done. Cache occupancy: %s", pretty_size(self.get_cache_occupancy())
             )
+        return freed_space
+
+    def evict_to_watermark(self, high_watermark: float, low_watermark: float) -> int:
+        """
+        Run eviction if the cache occupancy is above `high_watermark` (as a fraction of the cache size),
+        freeing enough space to bring it down to `low_watermark`. This is meant to be called periodically
+        by a background worker (see splitgraph.core.eviction.EvictionWorker) so that queries don't have
+        to run eviction themselves when they need to download objects.
+
+        If there aren't enough objects with zero reference count to reach the low watermark, deletes
+        as many as possible.
 
-    def _eviction_score(
-        self, now: datetime.datetime, object_size: int, last_used: datetime.datetime
-    ) -> float:
-        # We want to evict objects in order to minimize
-        # P(object is requested again) * (cost of redownloading the object).
-        # To approximate the probability, we use an exponential decay function (1 if last_used = now, dropping down
-        # to 0 as time since the object's last usage time passes).
-        # To approximate the cost, we use the object's size, floored to a constant (so if the object has
-        # size <= floor, we'd use the floor value -- this is to simulate the latency of re-fetching the object,
-        # as opposed to the bandwidth)
-        time_since_used = (now - last_used).total_seconds()
-        time_factor = math.exp(-self.eviction_decay_constant * time_since_used)
-        size_factor = object_size if object_size > self.eviction_floor else self.eviction_floor
-        return time_factor * size_factor
+        :param high_watermark: Fraction of the cache size above which eviction is run.
+        :param low_watermark: Fraction of the cache size to free the cache down to.
+        :return: Space, in bytes, that was freed.
+        """
+        # Check the occupancy without locking first: most of the time, there's nothing to do.
+        if self.get_cache_occupancy() <= high_watermark * self.cache_size:
+            self.object_engine.commit()
+            return 0
+
+        # Same as when downloading objects, take out an exclusive lock on the cache and recheck
+        # the occupancy, since someone else could have run eviction in the meantime.
+        self.object_engine.lock_table(SPLITGRAPH_META_SCHEMA, "object_cache_status")
+        current_occupied = self.get_cache_occupancy()
+        if current_occupied <= high_watermark * self.cache_size:
+            self.object_engine.commit()
+            return 0
+
+        to_free = current_occupied - int(low_watermark * self.cache_size)
+        logging.info(
+            "Cache occupancy %s/%s above the high watermark, need to free %s",
+            pretty_size(current_occupied),
+            pretty_size(self.cache_size),
+            pretty_size(to_free),
+        )
+        freed_space = self.run_eviction(keep_objects=[], required_space=to_free, best_effort=True)
+        self.object_engine.commit()
+        return freed_space
 
     def _prepare_eviction_candidates(
         self, candidates, object_sizes, orphaned_object_sizes, orphaned_objects, required_space
@@ -657,19 +1062,23 @@ class ObjectManager(FragmentManager):
         last_useds = [o[1] for o in candidates if o[0] in orphaned_objects]
         freed_space = sum(orphaned_object_sizes.values())
 
-        # Sort candidates by deletion priority (lowest is smallest expected retrieval cost -- more likely to delete)
-        candidates = sorted(
-            [o for o in candidates if o[0] not in orphaned_objects],
-            key=lambda o: self._eviction_score(now, object_sizes[o[0]], o[1]),
+        # Keep adding deletion candidates in the order picked by the eviction policy
+        # until we've freed enough space.
+        evicted, evicted_space = select_evicted_objects(
+            self._get_eviction_policy(),
+            [
+                CacheEntry(o[0], object_sizes[o[0]], o[1], o[2], o[3])
+                for o in candidates
+                if o[0] not in orphaned_objects
+            ],
+            now,
+            self._get_eviction_state(),
+            required_space - freed_space,
         )
+        to_delete.extend(e.object_id for e in evicted)
+        last_useds.extend(e.last_used for e in evicted)
+        freed_space += evicted_space
 
-        # Keep adding deletion candidates until we've freed enough space.
-        for object_id, last_used in candidates:
-            if freed_space >= required_space:
-                break
-            last_useds.append(last_used)
-            to_delete.append(object_id)
-            freed_space += object_sizes[object_id]
         logging.info(
             "Will delete %s last used between %s and %s, total size %s: %s",
             pluralise("object", len(to_delete)),
@@ -680,6 +1089,33 @@ class ObjectManager(FragmentManager):
         )
         return to_delete, freed_space
 
+    def _record_evictions(self, evicted: List[CacheEntry]) -> None:
+        """Update the eviction policy state and add ghost entries for evicted objects."""
+        if not evicted:
+            return
+        now = dt.utcnow()
+        state = self._get_eviction_state()
+        self._set_eviction_state(self._get_eviction_policy().on_evict(evicted, now, state))
+
+        self.object_engine.run_sql_batch(
+            insert("object_cache_ghosts", ("object_id", "size", "access_count", "evicted"))
+            + SQL(
+                "ON CONFLICT (object_id) DO UPDATE SET size = EXCLUDED.size, "
+                "access_count = EXCLUDED.access_count, evicted = EXCLUDED.evicted"
+            ),
+            [(e.object_id, e.size, e.access_count, now) for e in evicted],
+        )
+
+        # Only keep the most recently evicted objects, totalling up to the cache size.
+        self.object_engine.run_sql(
+            SQL(
+                "DELETE FROM {0}.object_cache_ghosts WHERE object_id IN (SELECT object_id FROM "
+                "(SELECT object_id, SUM(size) OVER (ORDER BY evicted DESC, object_id) AS total "
+                "FROM {0}.object_cache_ghosts) g WHERE total > %s)"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            (self.cache_size,),
+        )
+
     def _delete_cache_entries(self, to_delete: List[str]) -> None:
         if not to_delete:
             return
@@ -793,13 +1229,29 @@ class ObjectManager(FragmentManager):
         deleted_objects = self.cleanup_metadata()
         registered_objects = self.get_all_objects()
 
-        # Delete unneeded/dangling objects from the cache status table
-        query = SQL("DELETE FROM {}.object_cache_status").format(Identifier(SPLITGRAPH_META_SCHEMA))
-        if registered_objects:
-            query += SQL(" WHERE object_id != ALL(%s)")
-            self.object_engine.run_chunked_sql(query, (registered_objects,), chunk_position=0)
-        else:
-            self.object_engine.run_sql(query)
+        # Delete unneeded/dangling objects from the cache status table (and their eviction history)
+        for cache_table in ("object_cache_status", "object_cache_ghosts"):
+            query = SQL("DELETE FROM {}.{}").format(
+                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(cache_table)
+            )
+            if registered_objects:
+                query += SQL(" WHERE object_id != ALL(%s)")
+                self.object_engine.run_chunked_sql(query, (registered_objects,), chunk_position=0)
+            else:
+                self.object_engine.run_sql(query)
+
+        # Drop the cached fragment groupings and query plans (they get recalculated
+        # on the next query). These caches are only ever written to in separate
+        # transactions, so that the caller's transaction doesn't hold locks on them.
+        def _drop_caches() -> None:
+            for cache_table in ("fragment_groups", "query_plans"):
+                self.object_engine.run_sql(
+                    SQL("DELETE FROM {}.{}").format(
+                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(cache_table)
+                    )
+                )
+
+        run_in_separate_transaction(self.object_engine, _drop_caches)
 
         # Go through the physical objects and delete them as well
         # This is slightly dirty, but since the info about the objects
@@ -811,6 +1263,9 @@ class ObjectManager(FragmentManager):
             if c not in META_TABLES
         }
         tables_in_meta.update(self.get_downloaded_objects())
+        # Also delete files left over from failed downloads of objects that we don't need
+        # anymore (partial downloads of registered objects are kept so that they can be resumed).
+        tables_in_meta.update(self.object_engine.run_api_call("list_partial_objects"))
 
         to_delete = [
             t for t in tables_in_meta if t not in registered_objects or t in deleted_objects
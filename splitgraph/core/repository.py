@@ -242,6 +242,7 @@ class Repository:
                     ),
                     (self.namespace, self.repository),
                 )
+                self.objects.invalidate_query_plans(self.namespace, self.repository)
         self.engine.commit()
 
     @property
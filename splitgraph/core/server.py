@@ -5,17 +5,38 @@ When inside of an LQFDW shim, these are called directly by the Splitgraph core c
 to avoid a redundant connection to the engine.
 """
 import contextlib
+import hashlib
+import logging
 import os.path
-from typing import List, Tuple
+import re
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple
 from urllib.parse import urlparse
 
 from splitgraph.config import CONFIG
+from splitgraph.config.config import get_singleton
+from splitgraph.exceptions import ObjectIntegrityError
+
+if TYPE_CHECKING:
+    import requests
 
 SG_ENGINE_OBJECT_PATH = str(CONFIG["SG_ENGINE_OBJECT_PATH"])
 
 # An object consists of three files: CStore file, CStore footer and the JSON schema spec.
 # We have to download them separately.
 ObjectUrls = Tuple[str, str, str]
+_OBJECT_SUFFIXES = ("", ".footer", ".schema")
+
+# Files that are still being downloaded are stored with this suffix and only moved into
+# place once the whole object has been downloaded and verified.
+PARTIAL_SUFFIX = ".partial"
+
+# Number of times to retry a failed transfer (resuming downloads from where they stopped)
+# and the delay before the first retry (doubled after every retry).
+TRANSFER_RETRIES = int(get_singleton(CONFIG, "SG_OBJECT_TRANSFER_RETRIES"))
+RETRY_BACKOFF = 1.0
+
+_CHUNK_SIZE = 64 * 1024
 
 
 def verify(url: str):
@@ -34,28 +55,142 @@ def _remove(path: str):
         os.remove(path)
 
 
-def upload_object(object_id: str, urls: ObjectUrls):
+def _file_md5(path: str) -> str:
+    md5 = hashlib.md5()  # nosec
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def _get_md5_etag(response: "requests.Response") -> Optional[str]:
+    # S3 uses the MD5 of the object as its ETag, unless the object was uploaded
+    # in multiple parts (in which case the ETag isn't a valid MD5).
+    etag = response.headers.get("ETag", "").strip('"')
+    return etag if re.match(r"^[0-9a-f]{32}$", etag) else None
+
+
+def _is_retryable(error: Exception) -> bool:
     import requests
 
-    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            ObjectIntegrityError,
+        ),
+    )
+
+
+def _retry(func, description: str):
+    retries = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if retries >= TRANSFER_RETRIES or not _is_retryable(e):
+                raise
+            retries += 1
+            delay = RETRY_BACKOFF * 2 ** (retries - 1)
+            logging.warning(
+                "Error %s, retrying in %.1fs (%d/%d): %s",
+                description,
+                delay,
+                retries,
+                TRANSFER_RETRIES,
+                e,
+            )
+            time.sleep(delay)
+
+
+def _upload_file(path: str, url: str) -> None:
+    import requests
+
+    md5 = _file_md5(path)
 
-    for suffix, url in zip(("", ".footer", ".schema"), urls):
-        with open(object_path + suffix, "rb") as f:
+    def _upload():
+        with open(path, "rb") as f:
             response = requests.put(url, data=f, verify=verify(url))
             response.raise_for_status()
+        etag = _get_md5_etag(response)
+        if etag and etag != md5:
+            raise ObjectIntegrityError(
+                "Checksum mismatch uploading %s: expected %s, got %s" % (path, md5, etag)
+            )
 
+    _retry(_upload, "uploading " + path)
 
-def download_object(object_id: str, urls: ObjectUrls):
-    import shutil
 
+def _download_file(url: str, path: str) -> None:
+    """
+    Download a file, resuming from where the file at `path` ends if it already exists
+    (e.g. if a previous download failed halfway through) and retrying on network errors.
+    Once the file is downloaded, its MD5 is checked against the ETag reported by S3.
+    """
     import requests
 
-    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
-    for suffix, url in zip(("", ".footer", ".schema"), urls):
-        with requests.get(url, stream=True, verify=verify(url)) as response:
+    def _download():
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # When resuming, request the last byte that we already have too: this way we always
+        # get a 206 with the object's headers back instead of a 416 if we already have
+        # the whole file.
+        headers = {"Range": "bytes=%d-" % (offset - 1)} if offset else {}
+        with requests.get(url, stream=True, headers=headers, verify=verify(url)) as response:
+            if response.status_code == 416:
+                # The partial file is longer than the actual one: start again.
+                _remove(path)
+                raise ObjectIntegrityError("Partially downloaded file %s is too long" % path)
             response.raise_for_status()
-            with open(object_path + suffix, "wb") as f:
-                shutil.copyfileobj(response.raw, f)
+            expected_md5 = _get_md5_etag(response)
+
+            skip = 0
+            if offset and response.status_code == 206:
+                skip = 1
+                mode = "ab"
+            else:
+                # Either it's a new download or the server doesn't support ranged requests.
+                mode = "wb"
+
+            with open(path, mode) as f:
+                for data in response.iter_content(chunk_size=_CHUNK_SIZE):
+                    if skip:
+                        data, skip = data[skip:], 0
+                    f.write(data)
+
+        if expected_md5:
+            actual_md5 = _file_md5(path)
+            if actual_md5 != expected_md5:
+                # Don't keep corrupted data around for the next attempt to resume from.
+                _remove(path)
+                raise ObjectIntegrityError(
+                    "Checksum mismatch downloading %s: expected %s, got %s"
+                    % (path, expected_md5, actual_md5)
+                )
+
+    _retry(_download, "downloading " + path)
+
+
+def upload_object(object_id: str, urls: ObjectUrls):
+    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+
+    for suffix, url in zip(_OBJECT_SUFFIXES, urls):
+        _upload_file(object_path + suffix, url)
+
+
+def download_object(object_id: str, urls: ObjectUrls):
+    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+
+    # Download all files first (keeping the partial files around if the download fails so that
+    # it can be resumed) and only move them into place once they've all been verified.
+    for suffix, url in zip(_OBJECT_SUFFIXES, urls):
+        _download_file(url, object_path + suffix + PARTIAL_SUFFIX)
+    for suffix in _OBJECT_SUFFIXES:
+        os.rename(object_path + suffix + PARTIAL_SUFFIX, object_path + suffix)
 
 
 def set_object_schema(object_id: str, schema: str):
@@ -70,9 +205,9 @@ def get_object_schema(object_id: str) -> str:
 
 def delete_object_files(object_id: str):
     object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
-    _remove(object_path)
-    _remove(object_path + ".footer")
-    _remove(object_path + ".schema")
+    for suffix in _OBJECT_SUFFIXES:
+        _remove(object_path + suffix)
+        _remove(object_path + suffix + PARTIAL_SUFFIX)
 
 
 def rename_object_files(old_object_id: str, new_object_id: str):
@@ -103,11 +238,24 @@ def list_objects() -> List[str]:
     # Make sure to only return objects that have been fully downloaded.
     objects = defaultdict(list)
     for f in files:
+        if f.endswith(PARTIAL_SUFFIX):
+            continue
         objects[f.replace(".schema", "").replace(".footer", "")].append(f)
 
     return [f for f, fs in objects.items() if len(fs) == 3]
 
 
+def list_partial_objects() -> List[str]:
+    # Objects that have partially downloaded files left over from failed downloads.
+    return sorted(
+        {
+            f[: -len(PARTIAL_SUFFIX)].replace(".schema", "").replace(".footer", "")
+            for f in os.listdir(SG_ENGINE_OBJECT_PATH)
+            if f.endswith(PARTIAL_SUFFIX)
+        }
+    )
+
+
 def object_exists(object_id: str) -> bool:
     # Check if the physical object file exists in storage.
     # Make sure to check for all 3 files to guard against partially failed writes.
@@ -2,7 +2,9 @@
 import itertools
 import logging
 import threading
+from collections import defaultdict
 from contextlib import contextmanager
+from hashlib import sha256
 from math import ceil
 from typing import (
     TYPE_CHECKING,
@@ -29,11 +31,11 @@ from splitgraph.config import (
 from splitgraph.core.common import Tracer, get_temporary_table_id
 from splitgraph.core.fragment_manager import ExtraIndexInfo, get_chunk_groups
 from splitgraph.core.indexing.range import quals_to_sql
+from splitgraph.core.indexing.stats import estimate_selectivity
 from splitgraph.core.output import pluralise, truncate_list
 from splitgraph.core.sql.queries import select
 from splitgraph.core.types import Quals, TableSchema
 from splitgraph.engine import ResultShape
-from splitgraph.engine.postgres.engine import get_change_key
 from splitgraph.exceptions import ObjectIndexingError
 
 if TYPE_CHECKING:
@@ -111,7 +113,13 @@ class QueryPlan:
     qualifiers.
     """
 
-    def __init__(self, table: "Table", quals: Optional[Quals], columns: Sequence[str]) -> None:
+    def __init__(
+        self,
+        table: "Table",
+        quals: Optional[Quals],
+        columns: Sequence[str],
+        use_cache: bool = True,
+    ) -> None:
         self.table = table
         self.quals = quals
         self.columns = columns
@@ -124,12 +132,75 @@ class QueryPlan:
         # "fast path" and requiring materialization.
         self.required_objects = list(dict.fromkeys(table.objects))
         self.tracer.log("resolve_objects")
+
+        # Check if the plan for the same query against this table has already been made
+        # by a different process and cached on the engine.
+        plan_key = _get_persistent_plan_cache_key(table, quals, columns)
+        cached_plan = self.object_manager.get_cached_query_plan(plan_key) if use_cache else None
+
+        if cached_plan:
+            self.filtered_objects = cached_plan["filtered_objects"]
+            self.estimated_rows = cached_plan["estimated_rows"]
+            self.size_per_row = cached_plan["size_per_row"]
+            self.tracer.log("filter_objects")
+            self.non_singletons = cached_plan["non_singletons"]
+            self.singletons = cached_plan["singletons"]
+            self.tracer.log("group_fragments")
+        else:
+            self._plan_objects()
+            self.object_manager.cache_query_plan(
+                plan_key,
+                table,
+                {
+                    "filtered_objects": self.filtered_objects,
+                    "estimated_rows": self.estimated_rows,
+                    "size_per_row": self.size_per_row,
+                    "non_singletons": self.non_singletons,
+                    "singletons": self.singletons,
+                },
+            )
+
+        logging.info(
+            "Fragment grouping: %d singletons, %d non-singletons",
+            len(self.singletons),
+            len(self.non_singletons),
+        )
+
+        self.sql_quals, self.sql_qual_vals = quals_to_sql(
+            quals, column_types={c.name: c.pg_type for c in self.table.table_schema}
+        )
+
+        if self.singletons:
+            self.singleton_queries = _generate_table_names(
+                self.object_manager.object_engine, SPLITGRAPH_META_SCHEMA, self.singletons
+            )
+        else:
+            self.singleton_queries = []
+        self.tracer.log("generate_singleton_queries")
+
+    def _plan_objects(self) -> None:
         self.filtered_objects = self.object_manager.filter_fragments(
-            self.required_objects, table, quals
+            self.required_objects, self.table, self.quals
         )
         # Estimate the number of rows in the filtered objects
         object_meta = self.object_manager.get_object_meta(self.filtered_objects)
-        self.estimated_rows = sum([o.rows_inserted - o.rows_deleted for o in object_meta.values()])
+        # If fragments have column statistics, use them to estimate how many of
+        # their rows match the qualifiers.
+        column_types = {c.name: c.pg_type for c in self.table.table_schema}
+        self.estimated_rows = int(
+            round(
+                sum(
+                    (o.rows_inserted - o.rows_deleted)
+                    * estimate_selectivity(
+                        (o.object_index or {}).get("stats"),
+                        o.rows_inserted,
+                        self.quals,
+                        column_types,
+                    )
+                    for o in object_meta.values()
+                )
+            )
+        )
 
         # Estimate the row size in bytes by looking at the total object size
         # This can sometimes be important if we're querying wide tables with JSON data where
@@ -163,49 +234,49 @@ class QueryPlan:
         # collected. The tradeoff is that we perform more calls to apply_fragments (hence
         # more roundtrips).
         self.non_singletons, self.singletons = self._extract_singleton_fragments()
-
-        logging.info(
-            "Fragment grouping: %d singletons, %d non-singletons",
-            len(self.singletons),
-            len(self.non_singletons),
-        )
         self.tracer.log("group_fragments")
 
-        self.sql_quals, self.sql_qual_vals = quals_to_sql(
-            quals, column_types={c.name: c.pg_type for c in self.table.table_schema}
-        )
-
-        if self.singletons:
-            self.singleton_queries = _generate_table_names(
-                self.object_manager.object_engine, SPLITGRAPH_META_SCHEMA, self.singletons
-            )
-        else:
-            self.singleton_queries = []
-        self.tracer.log("generate_singleton_queries")
-
     def _extract_singleton_fragments(self) -> Tuple[List[str], List[str]]:
-        # Get fragment boundaries (min-max PKs of every fragment).
-        table_pk = get_change_key(self.table.table_schema)
-        object_pks = self.object_manager.get_min_max_pks(self.filtered_objects, table_pk)
-
-        surrogate_pk = not any(t.is_pk for t in self.table.table_schema)
-        if surrogate_pk:
-            object_pks = self.table.repository.objects.generate_surrogate_pk(self.table, object_pks)
-
-        # Group fragments into non-overlapping groups: those can be applied independently of each other.
-        object_groups = get_chunk_groups(
-            [
-                (object_id, min_max[0], min_max[1])
-                for object_id, min_max in zip(self.filtered_objects, object_pks)
-            ]
+        # Use the precomputed grouping of all fragments in the table to split filtered
+        # fragments by their group: fragments from different groups never overlap.
+        fragment_groups = self.object_manager.get_fragment_groups(self.table)
+        filtered_groups: Dict[int, List[str]] = defaultdict(list)
+        for object_id in self.filtered_objects:
+            filtered_groups[fragment_groups[object_id]].append(object_id)
+
+        # Only fragments that share their group with other fragments can overlap, so we
+        # only need to get boundaries for those and regroup them.
+        to_regroup = [
+            object_id for group in filtered_groups.values() if len(group) > 1 for object_id in group
+        ]
+        object_pks = (
+            dict(
+                zip(to_regroup, self.object_manager.get_fragment_boundaries(self.table, to_regroup))
+            )
+            if to_regroup
+            else {}
         )
+
         singletons: List[str] = []
         non_singletons: List[str] = []
-        for group in object_groups:
+        for group_id in sorted(filtered_groups):
+            group = filtered_groups[group_id]
             if len(group) == 1:
-                singletons.append(group[0][0])
-            else:
-                non_singletons.extend(object_id for object_id, _, _ in group)
+                singletons.append(group[0])
+                continue
+
+            # Group the remaining fragments into non-overlapping groups: those can
+            # be applied independently of each other.
+            for object_group in get_chunk_groups(
+                [
+                    (object_id, object_pks[object_id][0], object_pks[object_id][1])
+                    for object_id in group
+                ]
+            ):
+                if len(object_group) == 1:
+                    singletons.append(object_group[0][0])
+                else:
+                    non_singletons.extend(object_id for object_id, _, _ in object_group)
         return non_singletons, singletons
 
 
@@ -225,6 +296,25 @@ def _get_plan_cache_key(quals: Optional[Quals], columns: Sequence[str]) -> Query
     return quals, columns
 
 
+def _get_persistent_plan_cache_key(
+    table: "Table", quals: Optional[Quals], columns: Sequence[str]
+) -> str:
+    # Include the actual list of objects in the key since it's possible to add objects
+    # to an existing table.
+    return sha256(
+        repr(
+            (
+                table.repository.namespace,
+                table.repository.repository,
+                table.image.image_hash,
+                table.table_name,
+                sha256(",".join(table.objects).encode("ascii")).hexdigest(),
+                _get_plan_cache_key(quals, columns),
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+
+
 def merge_index_data(current_index: Dict[str, Any], new_index: Dict[str, Any]):
     for index_type, index_data in new_index.items():
         for col_name, col_index_data in index_data.items():
@@ -270,7 +360,8 @@ class Table:
 
         :param quals: Qualifiers in CNF form
         :param columns: List of columns
-        :param use_cache: If True, will fetch the plan from the cache for the same qualifiers and columns.
+        :param use_cache: If True, will fetch the plan from the cache for the same qualifiers and columns
+            (first from this instance, then from the query plan cache on the engine).
         :return: QueryPlan
         """
         key = _get_plan_cache_key(quals, columns)
@@ -287,7 +378,7 @@ class Table:
             plan.tracer.log("generate_singleton_queries")
             return plan
 
-        plan = QueryPlan(self, quals, columns)
+        plan = QueryPlan(self, quals, columns, use_cache=use_cache)
         self._query_plans[key] = plan
         return plan
 
@@ -345,6 +436,7 @@ class Table:
                         destination_schema,
                         destination,
                         progress_every=progress_every,
+                        **self._get_apply_options(cast(List[str], required_objects)),
                     )
         else:
             query, args = create_foreign_table(
@@ -389,14 +481,31 @@ class Table:
             return cast(Iterator[bytes], []), cast(Callable, _empty_callback), plan
 
         object_manager = self.repository.objects
-        if not plan.non_singletons:
+        if object_manager.fragment_prefetch:
+            # Download fragments in the background and start returning queries to singletons
+            # as soon as they're available. Fragments that have to be applied go last.
+            ready_objects, release_callback = object_manager.prefetch_objects(
+                self, plan.singletons + plan.non_singletons, tracer=plan.tracer
+            )
+            singleton_queries: Iterator[bytes] = (
+                query for _, query in zip(ready_objects, plan.singleton_queries)
+            )
+        else:
             with object_manager.ensure_objects(
                 self, objects=required_objects, defer_release=True, tracer=plan.tracer
             ) as eo_result:
                 _, release_callback = cast(Tuple, eo_result)
-                return iter(plan.singleton_queries), cast(Callable, release_callback), plan
+            ready_objects = iter(required_objects)
+            singleton_queries = iter(plan.singleton_queries)
+
+        if not plan.non_singletons:
+            return singleton_queries, cast(Callable, release_callback), plan
 
         def _generate_nonsingleton_query() -> Generator[bytes, None, None]:
+            # Wait until all fragments that we need to apply have been downloaded.
+            for _ in ready_objects:
+                pass
+
             # If we have fragments that need applying to a staging area, we don't want to
             # do it immediately: the caller might be satisfied with the data they got from
             # the queries to singleton fragments. So here we have a callback that, when called,
@@ -448,6 +557,7 @@ class Table:
                     extra_quals=plan.sql_quals,
                     extra_qual_args=plan.sql_qual_vals,
                     schema_spec=self.table_schema,
+                    **self._get_apply_options(plan.non_singletons),
                 )
             else:
                 engine.apply_fragments(
@@ -455,20 +565,17 @@ class Table:
                     SPLITGRAPH_META_SCHEMA,
                     staging_table,
                     schema_spec=self.table_schema,
+                    **self._get_apply_options(plan.non_singletons),
                 )
             engine.commit()
             table_name = _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, [staging_table])[0]
             yield table_name
 
-        with object_manager.ensure_objects(
-            self, objects=required_objects, defer_release=True, tracer=plan.tracer
-        ) as eo_result:
-            _, release_callback = cast(Tuple, eo_result)
-            return (
-                itertools.chain(plan.singleton_queries, _generate_nonsingleton_query()),
-                cast(Callable, release_callback),
-                plan,
-            )
+        return (
+            itertools.chain(singleton_queries, _generate_nonsingleton_query()),
+            cast(Callable, release_callback),
+            plan,
+        )
 
     @contextmanager
     def query_lazy(self, columns: List[str], quals: Quals) -> Iterator[Iterator[Dict[str, Any]]]:
@@ -608,8 +715,28 @@ class Table:
                 merge_index_data(current_index, index_struct)
 
         object_manager.register_objects(list(valid_objects.values()))
+
+        # The new indexes can change which objects queries against this table need
+        self._query_plans = {}
+        object_manager.invalidate_query_plans(
+            self.repository.namespace,
+            self.repository.repository,
+            image_hashes=[self.image.image_hash],
+            table_name=self.table_name,
+        )
         return list(valid_objects)
 
+    def _get_apply_options(self, objects: List[str]) -> Dict[str, Any]:
+        """
+        Get extra arguments to `apply_fragments` that make it apply groups
+        of non-overlapping fragments in parallel, if enabled (see SG_FRAGMENT_APPLY_THREADS).
+        """
+        threads = self.repository.objects.fragment_apply_threads
+        if threads <= 1 or len(objects) <= 1:
+            return {}
+        fragment_groups = self.repository.objects.get_fragment_groups(self)
+        return {"group_ids": [fragment_groups[o] for o in objects], "threads": threads}
+
     def _create_staging_table(self) -> str:
         staging_table = get_temporary_table_id()
 
@@ -462,6 +462,20 @@ class ChangeEngine(SQLEngine, ABC):
             have been inserted/updated otherwise.
         """
 
+    @abstractmethod
+    def store_pending_changes(self, schema, table, target_table, old_rows_table, schema_spec=None):
+        """
+        Store the pending changes for a given tracked table as a fragment in a temporary table,
+        conflating them on the engine.
+
+        :param schema: Schema the table belongs to
+        :param table: Table to store the changes of
+        :param target_table: Temporary table to store the fragment in
+        :param old_rows_table: Temporary table to store the old values of the changed rows in
+        :param schema_spec: Schema of the table (optional)
+        :return: Number of rows in the fragment
+        """
+
     @abstractmethod
     def get_changed_tables(self, schema):
         """
@@ -534,6 +548,9 @@ class ObjectEngine(ABC):
         extra_qual_args=None,
         schema_spec=None,
         progress_every: Optional[int] = None,
+        group_ids: Optional[List[int]] = None,
+        threads: Optional[int] = None,
+        strategy: Optional[str] = None,
     ):
         """
         Apply multiple fragments to a target table as a single-query batch operation.
@@ -548,6 +565,14 @@ class ObjectEngine(ABC):
             If not specified, uses the schema of target_table.
         :param progress_every: If set, will report the materialization progress via
             tqdm every `progress_every` objects.
+        :param group_ids: Optional, group number for every object. Fragments in different
+            groups must not overlap (see `splitgraph.core.fragment_manager.get_chunk_groups`).
+            Fragments in the same group are applied in the order they appear in `objects`.
+        :param threads: If set together with `group_ids`, apply up to this many groups in
+            parallel on separate connections.
+        :param strategy: How to apply a chain of fragments: `sequential` applies fragments one
+            by one, `bulk` finds the final version of every row across the whole chain and only
+            writes that out. Default SG_FRAGMENT_APPLY_STRATEGY.
         """
 
     @abstractmethod
@@ -5,37 +5,59 @@ import json
 import logging
 import random
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from contextlib import contextmanager
-from io import BytesIO, TextIOWrapper
+from io import TextIOWrapper
 from pathlib import PurePosixPath
-from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, cast
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union, cast
 
 import psycopg2
 import psycopg2.extensions
-from psycopg2.sql import SQL, Composed, Identifier
+from psycopg2.sql import SQL, Composed, Identifier, Literal
 from tqdm import tqdm
 
-from splitgraph.config import SG_CMD_ASCII, SPLITGRAPH_META_SCHEMA
+from splitgraph.config import CONFIG, SG_CMD_ASCII, SPLITGRAPH_META_SCHEMA
+from splitgraph.config.config import get_singleton
+from splitgraph.core.common import get_temporary_table_id
+from splitgraph.core.output import pretty_size
 from splitgraph.core.types import TableColumn, TableSchema
 from splitgraph.engine import ResultShape
 from splitgraph.engine.base import ChangeEngine, ObjectEngine, validate_type
-from splitgraph.engine.config import switch_engine
 from splitgraph.engine.postgres.psycopg import _AUDIT_SCHEMA, PsycopgEngine, chunk
-from splitgraph.exceptions import IncompleteObjectDownloadError, ObjectMountingError
-from splitgraph.hooks.mount_handlers import mount_postgres
+from splitgraph.exceptions import (
+    IncompleteObjectDownloadError,
+    IncompleteObjectUploadError,
+    ObjectMountingError,
+)
 
 CSTORE_SERVER = "cstore_server"
 _PACKAGE = "splitgraph"
 ROW_TRIGGER_NAME = "audit_trigger_row"
 STM_TRIGGER_NAME = "audit_trigger_stm"
-REMOTE_TMP_SCHEMA = "tmp_remote_data"
 SG_UD_FLAG = "sg_ud_flag"
 
+# Ways to apply a chain of fragments to a table:
+#   * sequential: run a DELETE and an INSERT for every fragment in turn
+#   * bulk: find the final version of every row across the whole chain with a window
+#     function and only write that out (one DELETE and one INSERT per chain)
+FRAGMENT_APPLY_STRATEGIES = ("sequential", "bulk")
+
+# Temporary columns used by the bulk fragment application
+_FRAGMENT_NO = "sg_fragment_no"
+_FRAGMENT_RANK = "sg_fragment_rank"
+
 # When writing a table into a single chunk, do it in batches of 150k rows (which matches the
 # default CStore stripe length). This is because CStore seems to buffer the result of the full
 # SELECT in an INSERT ... (SELECT ...) in memory.
 SINGLE_CHUNK_WRITE_SIZE = 150000
 
+# When streaming objects between engines, the maximum amount of binary COPY data buffered in memory
+# for every object and the size of reads that COPY FROM does from the buffer.
+STREAM_BUFFER_SIZE = 8 * 1024 * 1024
+STREAM_READ_SIZE = 64 * 1024
+
 
 # PG types we can run max/min/comparisons on
 
@@ -199,6 +221,164 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
             result.extend(_convert_audit_change(action, row_data, changed_fields, ri_cols))
         return result
 
+    def store_pending_changes(
+        self,
+        schema: str,
+        table: str,
+        target_table: str,
+        old_rows_table: str,
+        schema_spec: Optional[TableSchema] = None,
+    ) -> int:
+        """
+        Conflate the pending changes for a tracked table and store them as a fragment in a temporary
+        table without loading them into Python. This is the same as conflating the output of
+        `get_pending_changes` and passing it to `store_fragment`.
+
+        :param schema: Schema the table belongs to
+        :param table: Table to store the changes of
+        :param target_table: Temporary table to store the fragment in
+        :param old_rows_table: Temporary table to store the old values of the rows that the fragment
+            updates or deletes in. These are stored with the upsert flag set so that they can be
+            hashed and indexed in the same way as the rows that the fragment inserts.
+        :param schema_spec: Schema of the table (optional)
+        :return: Number of rows in the fragment
+        """
+        schema_spec = schema_spec or self.get_full_table_schema(schema, table)
+        ri_cols, ri_types = zip(*get_change_key(schema_spec))
+        non_ri_cols = [c.name for c in schema_spec if c.name not in ri_cols]
+        all_cols = list(ri_cols) + non_ri_cols
+
+        def _ri_cols_sql(template: str) -> Composed:
+            return SQL(",").join(
+                SQL(template + "::" + validate_type(t) + " AS {0}").format(
+                    Identifier(c), Literal(c)
+                )
+                for c, t in zip(ri_cols, ri_types)
+            )
+
+        def _join_sql(left: str, right: str) -> Composed:
+            return SQL(" AND ").join(
+                SQL(left + ".{0} = " + right + ".{0}").format(Identifier(c)) for c in ri_cols
+            )
+
+        # Turn every audit log entry into changes to a row with a given replica identity.
+        # Like in `_convert_audit_change`, updates that change the RI (e.g. on tables
+        # without a PK) delete the row with the old RI and insert a row with the new one.
+        changes = (
+            SQL(
+                "WITH log AS (SELECT event_id, action, row_data, changed_fields, "
+                "action = 'U' AND changed_fields ?| %s AS ri_changed "
+                "FROM {}.{} WHERE schema_name = %s AND table_name = %s), "
+                "changes AS (SELECT event_id, 0 AS seq, "
+            ).format(Identifier(_AUDIT_SCHEMA), Identifier("logged_actions"))
+            + _ri_cols_sql("(row_data ->> {1})")
+            + SQL(
+                ", action = 'I' OR (action = 'U' AND NOT ri_changed) AS upserted, "
+                "CASE WHEN action = 'I' THEN NULL ELSE row_data END AS old_row FROM log "
+                "UNION ALL SELECT event_id, 1 AS seq, "
+            )
+            + _ri_cols_sql("(COALESCE(changed_fields ->> {1}, row_data ->> {1}))")
+            + SQL(", true AS upserted, NULL AS old_row FROM log WHERE ri_changed) ")
+        )
+
+        # Conflate the changes: every row is upserted or deleted depending on its last change
+        # and the fragment has to delete its value from before the first change.
+        ri_cols_sql = SQL(",").join(Identifier(c) for c in ri_cols)
+        conflated = (
+            SQL("SELECT ")
+            + ri_cols_sql
+            + SQL(
+                ", (array_agg(upserted ORDER BY event_id DESC, seq DESC))[1] AS upserted, "
+                "(array_agg(old_row ORDER BY event_id, seq))[1] AS old_row FROM changes GROUP BY "
+            )
+            + ri_cols_sql
+        )
+
+        # Discard rows that ended up the same as they were before the changes (e.g.
+        # deleted and then reinserted). If the whole row is the RI, it's the same if it
+        # existed before.
+        changes_table = get_temporary_table_id()
+        if non_ri_cols:
+            query = (
+                SQL("CREATE TEMPORARY TABLE {} AS ").format(Identifier(changes_table))
+                + changes
+                + SQL("SELECT c.* FROM (")
+                + conflated
+                + SQL(") c LEFT JOIN {}.{} t ON ").format(Identifier(schema), Identifier(table))
+                + _join_sql("t", "c")
+                + SQL(
+                    " WHERE (c.old_row IS NOT NULL OR c.upserted) "
+                    "AND NOT (c.upserted AND c.old_row IS NOT DISTINCT FROM to_jsonb(t))"
+                )
+            )
+        else:
+            query = (
+                SQL("CREATE TEMPORARY TABLE {} AS ").format(Identifier(changes_table))
+                + changes
+                + SQL("SELECT c.* FROM (")
+                + conflated
+                + SQL(") c WHERE (c.old_row IS NULL) = c.upserted")
+            )
+        self.run_sql(query, (list(ri_cols), schema, table), return_shape=ResultShape.NONE)
+
+        # Store the fragment in the same way as `store_fragment`: upserted rows are
+        # joined with the actual table and deleted rows only have their RI set.
+        self.create_table(
+            "pg_temp", target_table, schema_spec=add_ud_flag_column(schema_spec), temporary=True
+        )
+        if non_ri_cols:
+            upserted = (
+                SQL("SELECT true, ")
+                + SQL(",").join(SQL("t.") + Identifier(c) for c in all_cols)
+                + SQL(" FROM pg_temp.{} c JOIN {}.{} t ON ").format(
+                    Identifier(changes_table), Identifier(schema), Identifier(table)
+                )
+                + _join_sql("t", "c")
+                + SQL(" WHERE c.upserted")
+            )
+        else:
+            upserted = (
+                SQL("SELECT true, ")
+                + SQL(",").join(SQL("c.") + Identifier(c) for c in ri_cols)
+                + SQL(" FROM pg_temp.{} c WHERE c.upserted").format(Identifier(changes_table))
+            )
+        deleted = (
+            SQL("SELECT false, ")
+            + SQL(",").join(SQL("c.") + Identifier(c) for c in ri_cols)
+            + SQL(" FROM pg_temp.{} c WHERE NOT c.upserted").format(Identifier(changes_table))
+        )
+        for columns, source in ((all_cols, upserted), (ri_cols, deleted)):
+            self.run_sql(
+                SQL("INSERT INTO pg_temp.{} (").format(Identifier(target_table))
+                + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + list(columns))
+                + SQL(") ")
+                + source,
+                return_shape=ResultShape.NONE,
+            )
+
+        # Turn the JSON with old values (including the RI) back into rows of the table.
+        self.create_table(
+            "pg_temp", old_rows_table, schema_spec=add_ud_flag_column(schema_spec), temporary=True
+        )
+        self.run_sql(
+            SQL("INSERT INTO pg_temp.{0} (").format(Identifier(old_rows_table))
+            + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + all_cols)
+            + SQL(") SELECT true, ")
+            + SQL(",").join(SQL("r.") + Identifier(c) for c in all_cols)
+            + SQL(
+                " FROM pg_temp.{1} c, jsonb_populate_record(NULL::pg_temp.{0}, c.old_row) r "
+                "WHERE c.old_row IS NOT NULL"
+            ).format(Identifier(old_rows_table), Identifier(changes_table)),
+            return_shape=ResultShape.NONE,
+        )
+
+        result = self.run_sql(
+            SQL("SELECT count(*) FROM pg_temp.{}").format(Identifier(changes_table)),
+            return_shape=ResultShape.ONE_ONE,
+        )
+        self.delete_table("pg_temp", changes_table)
+        return cast(int, result)
+
     def get_changed_tables(self, schema: str) -> List[str]:
         """Get list of tables that have changed content"""
         return cast(
@@ -629,6 +809,7 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         target_table: str,
         cols: Tuple[List[str], List[str]],
         extra_quals: Optional[Composed] = None,
+        keep_deletions: bool = False,
     ) -> Composed:
         ri_cols, non_ri_cols = cols
         all_cols = ri_cols + non_ri_cols
@@ -655,21 +836,119 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         # INSERT INTO target_table (col1, col2...)
         #   (SELECT col1, col2, ...
         #    FROM fragment_table WHERE sg_ud_flag = true (AND optional quals))
+        #
+        # If we're keeping deletions (the target table is a fragment itself), insert all rows
+        # instead, marking rows that don't match the qualifiers as deleted:
+        #
+        # INSERT INTO target_table (col1, col2..., sg_ud_flag)
+        #   (SELECT col1, col2, ..., sg_ud_flag AND (optional quals) FROM fragment_table)
+        target_cols = all_cols + [SG_UD_FLAG] if keep_deletions else all_cols
         query += (
             SQL(";INSERT INTO {}.{} (").format(Identifier(target_schema), Identifier(target_table))
-            + SQL(",").join(Identifier(c) for c in all_cols)
+            + SQL(",").join(Identifier(c) for c in target_cols)
             + SQL(")")
             + SQL("(SELECT ")
             + SQL(",").join(Identifier(c) for c in all_cols)
-            + SQL(" FROM {}.{}").format(Identifier(source_schema), Identifier(source_table))
         )
-        extra_quals = [extra_quals] if extra_quals else []
-        extra_quals.append(SQL("{} = true").format(Identifier(SG_UD_FLAG)))
-        if extra_quals:
+        if keep_deletions:
+            query += SQL(",{}").format(Identifier(SG_UD_FLAG))
+            if extra_quals:
+                query += SQL(" AND (") + extra_quals + SQL(")")
+            query += SQL(" FROM {}.{}").format(Identifier(source_schema), Identifier(source_table))
+        else:
+            query += SQL(" FROM {}.{}").format(Identifier(source_schema), Identifier(source_table))
+            extra_quals = [extra_quals] if extra_quals else []
+            extra_quals.append(SQL("{} = true").format(Identifier(SG_UD_FLAG)))
             query += SQL(" WHERE ") + SQL(" AND ").join(extra_quals)
         query += SQL(")")
         return query
 
+    @staticmethod
+    def _generate_bulk_fragment_application(
+        objects: List[Tuple[str, str]],
+        target_schema: str,
+        target_table: str,
+        cols: Tuple[List[str], List[str]],
+        extra_quals: Optional[Composed] = None,
+        keep_deletions: bool = False,
+    ) -> Composed:
+        ri_cols, non_ri_cols = cols
+        all_cols = ri_cols + non_ri_cols
+
+        # Instead of applying fragments one by one (rewriting the target table for every
+        # fragment), find the final version of every row in the whole chain of fragments
+        # and only write that out.
+
+        # First, delete all PKs from the target that are mentioned in any of the fragments.
+        query = (
+            SQL("DELETE FROM {}.{} t USING (").format(
+                Identifier(target_schema), Identifier(target_table)
+            )
+            + SQL(" UNION ALL ").join(
+                SQL("SELECT ")
+                + SQL(",").join(Identifier(c) for c in ri_cols)
+                + SQL(" FROM {}.{}").format(Identifier(ss), Identifier(st))
+                for ss, st in objects
+            )
+            + SQL(") s WHERE ")
+            + _generate_where_clause("t", ri_cols, "s")
+        )
+
+        # All rows from all fragments, tagged with the position of the fragment in the chain:
+        #
+        # SELECT 0 AS sg_fragment_no, col1, col2..., sg_ud_flag FROM fragment_1
+        # UNION ALL SELECT 1 AS sg_fragment_no, ... FROM fragment_2 ...
+        fragment_rows = SQL(" UNION ALL ").join(
+            SQL("SELECT {} AS {},").format(Literal(i), Identifier(_FRAGMENT_NO))
+            + SQL(",").join(Identifier(c) for c in all_cols + [SG_UD_FLAG])
+            + SQL(" FROM {}.{}").format(Identifier(ss), Identifier(st))
+            for i, (ss, st) in enumerate(objects)
+        )
+
+        # Only keep rows from the last fragment that mentions every PK (this is a rank rather
+        # than a DISTINCT ON so that tables without a PK that have duplicate rows work too).
+        latest_rows = (
+            SQL("SELECT ")
+            + SQL(",").join(Identifier(c) for c in all_cols + [SG_UD_FLAG])
+            + SQL(",rank() OVER (PARTITION BY ")
+            + SQL(",").join(Identifier(c) for c in ri_cols)
+            + SQL(" ORDER BY {} DESC) AS {} FROM (").format(
+                Identifier(_FRAGMENT_NO), Identifier(_FRAGMENT_RANK)
+            )
+            + fragment_rows
+            + SQL(") f")
+        )
+
+        target_cols = all_cols + [SG_UD_FLAG] if keep_deletions else all_cols
+        query += (
+            SQL(";INSERT INTO {}.{} (").format(Identifier(target_schema), Identifier(target_table))
+            + SQL(",").join(Identifier(c) for c in target_cols)
+            + SQL(")")
+            + SQL("(SELECT ")
+            + SQL(",").join(Identifier(c) for c in all_cols)
+        )
+        if keep_deletions:
+            query += SQL(",{}").format(Identifier(SG_UD_FLAG))
+            if extra_quals:
+                query += SQL(" AND (") + extra_quals + SQL(")")
+            query += (
+                SQL(" FROM (")
+                + latest_rows
+                + SQL(") s WHERE {} = 1").format(Identifier(_FRAGMENT_RANK))
+            )
+        else:
+            query += (
+                SQL(" FROM (")
+                + latest_rows
+                + SQL(") s WHERE {} = 1 AND {} = true").format(
+                    Identifier(_FRAGMENT_RANK), Identifier(SG_UD_FLAG)
+                )
+            )
+            if extra_quals:
+                query += SQL(" AND (") + extra_quals + SQL(")")
+        query += SQL(")")
+        return query
+
     def apply_fragments(
         self,
         objects: List[Tuple[str, str]],
@@ -679,6 +958,9 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         extra_qual_args: Optional[Tuple[Any, ...]] = None,
         schema_spec: Optional["TableSchema"] = None,
         progress_every: Optional[int] = None,
+        group_ids: Optional[List[int]] = None,
+        threads: Optional[int] = None,
+        strategy: Optional[str] = None,
     ) -> None:
         if not objects:
             return
@@ -686,34 +968,189 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         # Assume that the target table already has the required schema (including PKs)
         # and use that to generate queries to apply fragments.
         cols = self.schema_spec_to_cols(schema_spec)
+        strategy = strategy or get_singleton(CONFIG, "SG_FRAGMENT_APPLY_STRATEGY")
+        if strategy not in FRAGMENT_APPLY_STRATEGIES:
+            raise ValueError(
+                "Unknown fragment application strategy %s! Supported strategies: %s"
+                % (strategy, ", ".join(FRAGMENT_APPLY_STRATEGIES))
+            )
 
-        if progress_every:
+        if group_ids and threads and threads > 1 and len(set(group_ids)) > 1:
+            self._apply_groups(
+                objects,
+                group_ids,
+                target_schema,
+                target_table,
+                extra_quals,
+                cols,
+                extra_qual_args,
+                schema_spec,
+                threads,
+                strategy,
+                show_progress=bool(progress_every),
+            )
+        elif progress_every:
             batches = list(chunk(objects, chunk_size=progress_every))
             with tqdm(total=len(objects), unit="obj") as pbar:
                 for batch in batches:
                     self._apply_batch(
-                        batch, target_schema, target_table, extra_quals, cols, extra_qual_args
+                        batch,
+                        target_schema,
+                        target_table,
+                        extra_quals,
+                        cols,
+                        extra_qual_args,
+                        strategy,
                     )
                     pbar.update(len(batch))
                     pbar.set_postfix({"object": batch[-1][1][:10] + "..."})
         else:
             self._apply_batch(
-                objects, target_schema, target_table, extra_quals, cols, extra_qual_args
+                objects, target_schema, target_table, extra_quals, cols, extra_qual_args, strategy
             )
 
     def _apply_batch(
-        self, objects, target_schema, target_table, extra_quals, cols, extra_qual_args
+        self,
+        objects,
+        target_schema,
+        target_table,
+        extra_quals,
+        cols,
+        extra_qual_args,
+        strategy="sequential",
+        keep_deletions=False,
     ):
+        if strategy == "bulk" and len(objects) > 1:
+            query = self._generate_bulk_fragment_application(
+                objects, target_schema, target_table, cols, extra_quals, keep_deletions
+            )
+            self.run_sql(query, extra_qual_args)
+            return
+
         query = SQL(";").join(
             self._generate_fragment_application(
-                ss, st, target_schema, target_table, cols, extra_quals
+                ss, st, target_schema, target_table, cols, extra_quals, keep_deletions
             )
             for ss, st in objects
         )
         self.run_sql(query, (extra_qual_args * len(objects)) if extra_qual_args else None)
 
-    def upload_objects(self, objects: List[str], remote_engine: "PostgresEngine") -> None:
+    def _apply_groups(
+        self,
+        objects: List[Tuple[str, str]],
+        group_ids: List[int],
+        target_schema: str,
+        target_table: str,
+        extra_quals: Optional[Composed],
+        cols: Tuple[List[str], List[str]],
+        extra_qual_args: Optional[Tuple[Any, ...]],
+        schema_spec: "TableSchema",
+        threads: int,
+        strategy: str,
+        show_progress: bool = False,
+    ) -> None:
+        # Fragments in different groups don't overlap, so each group can be applied on its
+        # own connection. Since the target table might not be visible to other connections
+        # (e.g. it's temporary or hasn't been committed yet), we apply every group to a separate
+        # staging table that has the same format as an object (including deletions), so that
+        # we can then apply all staging tables to the target table as if they were fragments.
+        groups: Dict[int, List[Tuple[str, str]]] = {}
+        for obj, group_id in zip(objects, group_ids):
+            groups.setdefault(group_id, []).append(obj)
+        group_list = list(groups.values())
+        staging_tables = [get_temporary_table_id() for _ in group_list]
+        staging_schema = add_ud_flag_column(schema_spec)
+
+        def _apply_group(group_no: int) -> int:
+            group = group_list[group_no]
+            try:
+                self.create_table(
+                    SPLITGRAPH_META_SCHEMA,
+                    staging_tables[group_no],
+                    staging_schema,
+                    unlogged=True,
+                )
+                self._apply_batch(
+                    group,
+                    SPLITGRAPH_META_SCHEMA,
+                    staging_tables[group_no],
+                    extra_quals,
+                    cols,
+                    extra_qual_args,
+                    strategy,
+                    keep_deletions=True,
+                )
+                self.commit()
+            except Exception:
+                logging.exception(
+                    "Error applying fragment group %d/%d (%s)",
+                    group_no + 1,
+                    len(group_list),
+                    ", ".join(st for _, st in group),
+                )
+                self.rollback()
+                raise
+            return group_no
+
+        logging.debug(
+            "Applying %d fragments in %d groups using %d threads",
+            len(objects),
+            len(group_list),
+            min(threads, len(group_list)),
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=min(threads, len(group_list))) as tpe:
+                futures = [tpe.submit(_apply_group, i) for i in range(len(group_list))]
+                with tqdm(
+                    total=len(objects), unit="obj", ascii=SG_CMD_ASCII, disable=not show_progress
+                ) as pbar:
+                    for future in as_completed(futures):
+                        group = group_list[future.result()]
+                        pbar.update(len(group))
+                        pbar.set_postfix({"object": group[-1][1][:10] + "..."})
+
+            # Stitch the groups together.
+            self.run_sql(
+                SQL(";").join(
+                    self._generate_fragment_application(
+                        SPLITGRAPH_META_SCHEMA, staging_table, target_schema, target_table, cols
+                    )
+                    for staging_table in staging_tables
+                )
+            )
+        except Exception:
+            # The staging tables have been committed by other connections, so we can't
+            # rely on the caller committing our transaction to delete them.
+            with ThreadPoolExecutor(max_workers=1) as tpe:
+                tpe.submit(self._drop_staging_tables, staging_tables, True).result()
+            raise
+        finally:
+            self.close_others()
+        self._drop_staging_tables(staging_tables)
 
+    def _drop_staging_tables(self, staging_tables: List[str], commit: bool = False) -> None:
+        try:
+            if commit:
+                # Don't wait for too long if someone is still holding a lock on these tables.
+                self.run_sql("SET LOCAL lock_timeout TO '5s'")
+            self.run_sql(
+                SQL(";").join(
+                    SQL("DROP TABLE IF EXISTS {}.{}").format(
+                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(staging_table)
+                    )
+                    for staging_table in staging_tables
+                )
+            )
+            if commit:
+                self.commit()
+        except Exception:
+            if not commit:
+                raise
+            logging.exception("Error deleting staging tables %s", ", ".join(staging_tables))
+
+    def upload_objects(
+        self, objects: List[str], remote_engine: "PostgresEngine", threads: Optional[int] = None
+    ) -> None:
         # We don't have direct access to the remote engine's storage and we also
         # can't use the old method of first creating a CStore table remotely and then
         # mounting it via FDW (because this is done on two separate connections, after
@@ -723,114 +1160,235 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         # and then piping that binary into the remote engine.
         #
         # Perhaps we should drop direct uploading altogether and require people to use S3 throughout.
+        successful = _stream_objects(
+            objects,
+            source=self,
+            target=remote_engine,
+            get_schema=self.get_object_schema,
+            threads=threads,
+        )
+        if len(successful) < len(objects):
+            # Objects uploaded directly into the remote engine don't have an external URL
+            # (same as `ObjectManager.upload_objects` returns on success).
+            raise IncompleteObjectUploadError(
+                reason=None,
+                successful_objects=successful,
+                successful_object_urls=[None] * len(successful),
+            )
 
-        pbar = tqdm(objects, unit="objs", ascii=SG_CMD_ASCII)
-        for object_id in pbar:
-            pbar.set_postfix(object=object_id[:10] + "...")
-            schema_spec = self.get_object_schema(object_id)
-            remote_engine.mount_object(object_id, schema_spec=schema_spec)
+    def download_objects(
+        self, objects: List[str], remote_engine: "PostgresEngine", threads: Optional[int] = None
+    ) -> List[str]:
+        # Stream the objects from the remote engine via binary COPY (same as uploads),
+        # several at a time.
+        def _get_remote_schema(object_id: str) -> TableSchema:
+            return remote_engine.get_full_table_schema(SPLITGRAPH_META_SCHEMA, object_id)
+
+        downloaded_objects = _stream_objects(
+            objects,
+            source=remote_engine,
+            target=self,
+            get_schema=_get_remote_schema,
+            threads=threads,
+            delete_failed=True,
+        )
+        if len(downloaded_objects) < len(objects):
+            raise IncompleteObjectDownloadError(reason=None, successful_objects=downloaded_objects)
+        return downloaded_objects
 
-            # Truncate the remote object in case it already exists (we'll overwrite it).
-            remote_engine.run_sql(
-                SQL("TRUNCATE TABLE {}.{}").format(
-                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
-                )
-            )
+    def get_change_key(self, schema: str, table: str) -> List[Tuple[str, str]]:
+        return get_change_key(self.get_full_table_schema(schema, table))
+
+
+class _CopyPipe:
+    """
+    Bounded in-memory pipe that one connection can COPY binary data into
+    (COPY ... TO STDOUT) while another one is reading from it (COPY ... FROM STDIN).
+    """
 
-            stream = BytesIO()
-            with self.copy_cursor() as cur:
+    def __init__(self, max_size: int = STREAM_BUFFER_SIZE) -> None:
+        self.max_size = max_size
+        self.total_size = 0
+        self.peak_size = 0
+
+        self._buffer = bytearray()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+
+    def write(self, data: bytes) -> int:
+        with self._cond:
+            while len(self._buffer) >= self.max_size and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise BrokenPipeError("The reading side of the pipe has been closed")
+            self._buffer.extend(data)
+            self.total_size += len(data)
+            self.peak_size = max(self.peak_size, len(self._buffer))
+            self._cond.notify_all()
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        with self._cond:
+            while not self._buffer and not self._closed:
+                self._cond.wait()
+            # Make sure that the reader fails instead of seeing an EOF (and committing
+            # partial data) if the writer failed.
+            if self._error:
+                raise IOError("Error writing into the pipe") from self._error
+            if size < 0:
+                size = len(self._buffer)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._cond.notify_all()
+        return data
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self._closed = True
+            self._error = self._error or error
+            self._cond.notify_all()
+
+
+def _stream_object(
+    object_id: str,
+    source: "PostgresEngine",
+    target: "PostgresEngine",
+    schema_spec: TableSchema,
+    copy_out_pool: ThreadPoolExecutor,
+) -> _CopyPipe:
+    """
+    Copy an object between two engines, streaming the output of COPY TO on the source
+    into COPY FROM on the target without buffering the whole object. Must be run in a thread
+    that doesn't use the source engine (the source side is run in `copy_out_pool`).
+    """
+    pipe = _CopyPipe()
+
+    def _copy_out() -> None:
+        try:
+            with source.connection.cursor() as cur:
                 cur.copy_expert(
                     SQL("COPY {}.{} TO STDOUT WITH (FORMAT 'binary')").format(
                         Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
                     ),
-                    stream,
+                    pipe,
                 )
-            stream.seek(0)
-            with remote_engine.copy_cursor() as cur:
-                cur.copy_expert(
-                    SQL("COPY {}.{} FROM STDIN WITH (FORMAT 'binary')").format(
-                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
-                    ),
-                    stream,
-                )
-            remote_engine._set_object_schema(object_id, schema_spec)
-            remote_engine.commit()
+            source.commit()
+        except BaseException as e:
+            source.rollback()
+            pipe.close(error=e)
+            raise
+        pipe.close()
+
+    target.mount_object(object_id, schema_spec=schema_spec)
+    # Truncate the target object in case it already exists (we'll overwrite it).
+    target.run_sql(
+        SQL("TRUNCATE TABLE {}.{}").format(
+            Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+        )
+    )
 
-    @contextmanager
-    def _mount_remote_engine(self, remote_engine: "PostgresEngine") -> Iterator[str]:
-        # Switch the global engine to "self" instead of LOCAL since `mount_postgres` uses the global engine
-        # (we can't easily pass args into it as it's also invoked from the command line with its arguments
-        # used to populate --help)
-        user = remote_engine.conn_params["SG_ENGINE_USER"]
-        pwd = remote_engine.conn_params["SG_ENGINE_PWD"]
-        host = remote_engine.conn_params["SG_ENGINE_FDW_HOST"]
-        port = remote_engine.conn_params["SG_ENGINE_FDW_PORT"]
-        dbname = remote_engine.conn_params["SG_ENGINE_DB_NAME"]
-
-        # conn_params might contain Nones for some parameters (host/port for Unix
-        # socket connection, so here we have to validate that they aren't None).
-        assert user is not None
-        assert pwd is not None
-        assert host is not None
-        assert port is not None
-        assert dbname is not None
-
-        logging.info(
-            "Mounting remote schema %s@%s:%s/%s/%s to %s...",
-            user,
-            host,
-            port,
-            dbname,
-            SPLITGRAPH_META_SCHEMA,
-            REMOTE_TMP_SCHEMA,
-        )
-        self.delete_schema(REMOTE_TMP_SCHEMA)
-        with switch_engine(self):
-            mount_postgres(
-                mountpoint=REMOTE_TMP_SCHEMA,
-                host=host,
-                port=int(port),
-                username=user,
-                password=pwd,
-                dbname=dbname,
-                remote_schema=SPLITGRAPH_META_SCHEMA,
+    copy_out = copy_out_pool.submit(_copy_out)
+    try:
+        with target.connection.cursor() as cur:
+            cur.copy_expert(
+                SQL("COPY {}.{} FROM STDIN WITH (FORMAT 'binary')").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+                ),
+                pipe,
+                size=STREAM_READ_SIZE,
             )
-        try:
-            yield REMOTE_TMP_SCHEMA
-        finally:
-            self.delete_schema(REMOTE_TMP_SCHEMA)
-
-    def download_objects(self, objects: List[str], remote_engine: "PostgresEngine") -> List[str]:
-        # Instead of connecting and pushing queries to it from the Python client, we just mount the remote mountpoint
-        # into a temporary space (without any checking out) and SELECT the  required data into our local tables.
+    except BaseException:
+        # Unblock the writer if it's waiting for us to read from the pipe and wait
+        # for it to finish before raising the original error.
+        pipe.close()
+        wait([copy_out])
+        raise
+    copy_out.result()
+
+    target._set_object_schema(object_id, schema_spec=schema_spec)
+    target.commit()
+    return pipe
+
+
+def _stream_objects(
+    objects: List[str],
+    source: "PostgresEngine",
+    target: "PostgresEngine",
+    get_schema: Callable[[str], TableSchema],
+    threads: Optional[int] = None,
+    delete_failed: bool = False,
+) -> List[str]:
+    """
+    Copy multiple objects between two engines via binary COPY, several at a time.
+
+    :param objects: List of object IDs
+    :param source: Engine to copy the objects from
+    :param target: Engine to copy the objects to
+    :param get_schema: Function returning the schema of an object on the source engine
+        (or an empty schema if the object doesn't exist).
+    :param threads: Number of objects to copy concurrently. By default, uses up the whole
+        connection pool, less one connection for the main thread.
+    :param delete_failed: Delete objects on the target engine if they failed to copy.
+    :return: List of objects that were copied successfully.
+    """
+    threads = threads or int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1
+    threads = max(1, min(threads, len(objects)))
 
-        with self._mount_remote_engine(remote_engine) as remote_schema:
-            downloaded_objects = []
-            pbar = tqdm(objects, unit="objs", ascii=SG_CMD_ASCII)
+    def _do_transfer(object_id: str) -> Optional[str]:
+        try:
+            # Only use the source engine from the copy-out threads so that we don't use
+            # more than `threads` connections to it.
+            schema_spec = copy_out_pool.submit(get_schema, object_id).result()
+            if not schema_spec:
+                logging.error("%s not found on the source engine!", object_id)
+                return None
+
+            start = time.time()
+            pipe = _stream_object(object_id, source, target, schema_spec, copy_out_pool)
+            elapsed = time.time() - start
+            logging.info(
+                "Copied %s: %s in %.2fs (%s/s), peak buffer %s",
+                object_id,
+                pretty_size(pipe.total_size),
+                elapsed,
+                pretty_size(pipe.total_size / elapsed if elapsed else 0),
+                pretty_size(pipe.peak_size),
+            )
+            return object_id
+        except Exception:
+            logging.exception("Error copying object %s", object_id)
+            target.rollback()
+            if delete_failed:
+                target.delete_objects([object_id])
+                target.commit()
+            return None
+
+    successful: List[str] = []
+    # Suspend the callback that terminates the connection on Ctrl+C since it doesn't work
+    # with copy_expert (see PsycopgEngine.copy_cursor). It's global, so we do it here rather
+    # than in every thread.
+    wait_callback = psycopg2.extensions.get_wait_callback()
+    try:
+        psycopg2.extensions.set_wait_callback(None)
+        with ThreadPoolExecutor(max_workers=threads) as copy_out_pool, ThreadPoolExecutor(
+            max_workers=threads
+        ) as tpe:
+            pbar = tqdm(
+                tpe.map(_do_transfer, objects),
+                total=len(objects),
+                unit="objs",
+                ascii=SG_CMD_ASCII,
+            )
             for object_id in pbar:
-                pbar.set_postfix(object=object_id[:10] + "...")
-                if not self.table_exists(remote_schema, object_id):
-                    logging.error("%s not found on the remote engine!", object_id)
-                    continue
-
-                # Create the CStore table on the engine and copy the contents of the object into it.
-                schema_spec = remote_engine.get_full_table_schema(SPLITGRAPH_META_SCHEMA, object_id)
-                self.mount_object(object_id, schema_spec=schema_spec)
-                self.copy_table(
-                    remote_schema,
-                    object_id,
-                    SPLITGRAPH_META_SCHEMA,
-                    object_id,
-                    with_pk_constraints=False,
-                )
-                self._set_object_schema(object_id, schema_spec=schema_spec)
-                downloaded_objects.append(object_id)
-        if len(downloaded_objects) < len(objects):
-            raise IncompleteObjectDownloadError(reason=None, successful_objects=downloaded_objects)
-        return downloaded_objects
-
-    def get_change_key(self, schema: str, table: str) -> List[Tuple[str, str]]:
-        return get_change_key(self.get_full_table_schema(schema, table))
+                if object_id:
+                    successful.append(object_id)
+                    pbar.set_postfix(object=object_id[:10] + "...")
+    finally:
+        psycopg2.extensions.set_wait_callback(wait_callback)
+        source.close_others()
+        target.close_others()
+    return successful
 
 
 def get_change_key(schema_spec: TableSchema) -> List[Tuple[str, str]]:
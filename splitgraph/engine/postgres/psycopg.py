@@ -125,7 +125,7 @@ def _paginate_by_size(cur, query, argslist, max_size=API_MAX_QUERY_LENGTH):
 T = TypeVar("T")
 
 
-def chunk(sequence: Sequence[T], chunk_size: int = API_MAX_VARIADIC_ARGS) -> Iterator[List[T]]:
+def chunk(sequence: Iterable[T], chunk_size: int = API_MAX_VARIADIC_ARGS) -> Iterator[List[T]]:
     curr_chunk: List[T] = []
     for i, curr in enumerate(sequence):
         curr_chunk.append(curr)
@@ -237,6 +237,32 @@ class PsycopgEngine(SQLEngine):
             for c in other_conns:
                 self._pool.putconn(c, close=True)
 
+    def close_pool(self) -> None:
+        """
+        Close all connections in the connection pool, including ones used by other threads.
+        """
+        if self.connected:
+            self._pool.closeall()
+            self.connected = False
+
+    def clone(self) -> "PsycopgEngine":
+        """
+        Create an engine that connects to the same database but uses its own connection pool.
+
+        This engine's state (connection pool and the autocommit flag) is shared between all threads
+        that use it, so this can be used to run operations that change it (like object downloads)
+        in the background without affecting the foreground thread. The new engine must be closed
+        with `close_pool()` when it's no longer needed.
+        """
+        return type(self)(
+            name=self.name,
+            conn_params=self.conn_params,
+            autocommit=self.autocommit,
+            registry=self.registry,
+            in_fdw=self.in_fdw,
+            check_version=False,
+        )
+
     def close(self) -> None:
         if self.connected:
             conn = self.connection
@@ -1,7 +1,7 @@
 """
 Exceptions that can be raised by the Splitgraph library.
 """
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 
 class SplitGraphError(Exception):
@@ -41,6 +41,10 @@ class ObjectMountingError(SplitGraphError):
     """Errors related to incompatible objects."""
 
 
+class ObjectIntegrityError(SplitGraphError):
+    """Raised when the checksum of a transferred object doesn't match the expected one."""
+
+
 class RepositoryNotFoundError(SplitGraphError):
     """A Splitgraph repository doesn't exist."""
 
@@ -86,7 +90,7 @@ class IncompleteObjectUploadError(SplitGraphError):
         self,
         reason: Optional[BaseException],
         successful_objects: List[str],
-        successful_object_urls: List[str],
+        successful_object_urls: Sequence[Optional[str]],
     ):
         self.reason = reason
         self.successful_objects = successful_objects
@@ -2,13 +2,27 @@ import json
 import logging
 import re
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
-from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Tuple, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 import psycopg2
 from psycopg2.sql import SQL, Composed, Identifier
+from tqdm import tqdm
 
-from splitgraph.config import DEFAULT_CHUNK_SIZE
+from splitgraph.config import CONFIG, DEFAULT_CHUNK_SIZE, SG_CMD_ASCII
+from splitgraph.config.config import get_singleton
 from splitgraph.core.common import get_temporary_table_id
 from splitgraph.core.engine import repository_exists
 from splitgraph.core.repository import Repository
@@ -331,22 +345,120 @@ class ForeignDataWrapperDataSource(MountableDataSource, SyncableDataSource, ABC)
 
             self.engine.commit()
 
-            for t in self.engine.get_all_tables(tmp_schema):
+            def _copy(t: str) -> None:
                 try:
-                    self.engine.copy_table(
-                        tmp_schema, t, schema, t, cursor_fields=cursor_values.get(t)
-                    )
+                    self._copy_table(tmp_schema, t, schema, cursor_fields=cursor_values.get(t))
                     self.engine.commit()
                 except psycopg2.DatabaseError as e:
                     logging.exception("Error ingesting table %s", t, exc_info=e)
                     raise DataSourceError(
                         "Error ingesting table %s: %s: %s" % (t, get_exception_name(e), e)
                     )
+
+            self._run_table_tasks(
+                tmp_schema, self.engine.get_all_tables(tmp_schema), _copy, [self.engine]
+            )
         finally:
             self.engine.rollback()
             self.engine.delete_schema(tmp_schema)
             self.engine.commit()
 
+    def _copy_table(
+        self,
+        tmp_schema: str,
+        table: str,
+        schema: str,
+        cursor_fields: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Copy a mounted foreign table into the staging schema. Data sources can override this
+        to load the data bypassing the FDW.
+        """
+        self.engine.copy_table(tmp_schema, table, schema, table, cursor_fields=cursor_fields)
+
+    def _get_table_sizes(self, schema: str, tables: List[str]) -> Dict[str, int]:
+        """
+        Estimate the sizes of mounted tables in bytes (used to ingest the largest tables first).
+        By default, this uses the planner's row count and width estimates for the foreign
+        tables. Data sources can override this if they can find out the sizes directly.
+        """
+        sizes: Dict[str, int] = {}
+        for table in tables:
+            try:
+                plan = self.engine.run_sql(
+                    SQL("EXPLAIN (FORMAT JSON) SELECT * FROM {}.{}").format(
+                        Identifier(schema), Identifier(table)
+                    ),
+                    return_shape=ResultShape.ONE_ONE,
+                )[0]["Plan"]
+                sizes[table] = int(plan["Plan Rows"] * plan["Plan Width"])
+            except psycopg2.DatabaseError as e:
+                logging.warning("Could not estimate the size of table %s: %s", table, e)
+                self.engine.rollback()
+                sizes[table] = 0
+        return sizes
+
+    def _run_table_tasks(
+        self,
+        schema: str,
+        tables: List[str],
+        task: Callable[[str], None],
+        engines: Sequence["PsycopgEngine"],
+    ) -> None:
+        """
+        Run a task (like copying or snapshotting a table) for every table in a schema.
+
+        If SG_INGESTION_THREADS is more than 1, the tasks run concurrently on separate
+        connections, largest tables first (see `_get_table_sizes`), so that the wall time
+        is closer to the time it takes to ingest the largest table than to the sum over
+        all tables. Every task then commits its transaction on `engines` separately, so
+        the schema must be visible to other connections (e.g. committed).
+
+        :param schema: Schema the tables are in
+        :param tables: Names of the tables
+        :param task: Function that gets called with the name of every table
+        :param engines: Engines that the task uses
+        """
+        threads = min(int(get_singleton(CONFIG, "SG_INGESTION_THREADS")), len(tables))
+        if threads <= 1:
+            for table in tables:
+                task(table)
+            return
+
+        sizes = self._get_table_sizes(schema, tables)
+        # Tasks are started in the order they're submitted in.
+        tables = sorted(tables, key=lambda t: sizes[t], reverse=True)
+        engines = list({id(e): e for e in engines}.values())
+
+        def _run_task(table: str) -> str:
+            try:
+                task(table)
+                for engine in engines:
+                    engine.commit()
+            except Exception:
+                for engine in engines:
+                    engine.rollback()
+                raise
+            return table
+
+        logging.info("Ingesting %d tables using %d threads", len(tables), threads)
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as tpe:
+                futures = [tpe.submit(_run_task, t) for t in tables]
+                try:
+                    with tqdm(total=len(tables), unit="tables", ascii=SG_CMD_ASCII) as pbar:
+                        for future in as_completed(futures):
+                            pbar.update()
+                            pbar.set_postfix(table=future.result())
+                except Exception:
+                    # Don't start ingesting the remaining tables.
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            for engine in engines:
+                engine.close_others()
+
     def _sync(
         self,
         schema: str,
@@ -482,18 +594,44 @@ class ForeignDataWrapperDataSource(MountableDataSource, SyncableDataSource, ABC)
 
                 self.engine.commit()
 
-                for t in self.engine.get_all_tables(staging_schema):
+                # Tables can get snapshotted on separate connections that commit every table's
+                # objects straight away. Only link the tables to the image once all of them have
+                # been stored, so that a failure doesn't leave an image with some of the tables.
+                table_meta: Dict[str, Tuple[TableSchema, List[str]]] = {}
+
+                def _snapshot(t: str) -> None:
                     logging.info("Snapshotting %s", t)
-                    repository.objects.record_table_as_base(
-                        repository,
-                        t,
-                        new_image_hash,
-                        chunk_size=None,
-                        source_schema=staging_schema,
-                        source_table=t,
-                        overwrite=False,
+                    table_schema = repository.object_engine.get_full_table_schema(staging_schema, t)
+                    table_meta[t] = (
+                        table_schema,
+                        repository.objects.record_table_as_base(
+                            repository,
+                            t,
+                            new_image_hash,
+                            chunk_size=None,
+                            source_schema=staging_schema,
+                            source_table=t,
+                            overwrite=False,
+                            table_schema=table_schema,
+                            register_table=False,
+                        ),
                     )
 
+                staging_tables = self.engine.get_all_tables(staging_schema)
+                self._run_table_tasks(
+                    staging_schema,
+                    staging_tables,
+                    _snapshot,
+                    [self.engine, repository.engine, repository.object_engine],
+                )
+                repository.objects.register_tables(
+                    repository,
+                    [
+                        (new_image_hash, t, table_meta[t][0], table_meta[t][1])
+                        for t in staging_tables
+                    ],
+                )
+
         add_timestamp_tags(repository, new_image_hash)
         make_image_latest(repository, new_image_hash)
         repository.commit_engines()
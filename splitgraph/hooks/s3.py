@@ -154,10 +154,18 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
             logging.debug("%s -> %s", url[0], object_id)
 
             try:
+                # The engine retries and resumes the download on network errors and verifies
+                # the object's checksum. If the download fails anyway, the partially downloaded
+                # files are kept so that the next attempt can resume from where this one stopped.
                 local_engine.run_api_call("download_object", object_id, url)
-                local_engine.mount_object(object_id)
             except Exception as e:
                 logging.error("Error downloading object %s: %s", object_id, str(e))
+                return None
+
+            try:
+                local_engine.mount_object(object_id)
+            except Exception as e:
+                logging.error("Error mounting object %s: %s", object_id, str(e))
 
                 # Delete the object that we just tried to download to make sure we don't have
                 # a situation where the file was downloaded but mounting failed (currently
@@ -1,5 +1,7 @@
 import contextlib
+import io
 import json
+import logging
 from copy import deepcopy
 from datetime import timedelta
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, cast
@@ -186,6 +188,13 @@ class CSVDataSource(ForeignDataWrapperDataSource):
                 "description": "Number of rows to use for schema inference",
                 "default": 100000,
             },
+            "schema_inference_reservoir": {
+                "type": "boolean",
+                "title": "Sample the whole file",
+                "description": "Use a random sample of rows from the whole file for schema "
+                "inference instead of the first rows",
+                "default": False,
+            },
             "encoding": {
                 "type": "string",
                 "title": "Encoding",
@@ -215,6 +224,28 @@ class CSVDataSource(ForeignDataWrapperDataSource):
                 "description": "Character used to quote fields",
                 "default": '"',
             },
+            "parallel_workers": {
+                "title": "Parallel workers",
+                "type": "integer",
+                "description": "Number of threads to load large S3 objects with. The objects are "
+                "split into byte ranges that are parsed concurrently and copied into the "
+                "table directly, bypassing the foreign data wrapper.",
+                "default": 1,
+            },
+            "parallel_range_size": {
+                "title": "Parallel range size",
+                "type": "integer",
+                "description": "Size, in bytes, of each byte range of a large S3 object "
+                "(when parallel_workers is greater than 1)",
+                "default": 67108864,
+            },
+            "vectorized": {
+                "title": "Vectorized parsing",
+                "type": "boolean",
+                "description": "Parse the file in batches with pandas (if installed), decoding "
+                "integer and float columns natively",
+                "default": False,
+            },
         },
     }
 
@@ -407,6 +438,83 @@ EOF
         # for us.
         return [(t, load_options(d)) for t, d in options]
 
+    def _copy_table(
+        self,
+        tmp_schema: str,
+        table: str,
+        schema: str,
+        cursor_fields: Optional[Dict[str, str]] = None,
+    ) -> None:
+        from splitgraph.ingestion.csv.common import CSVOptions, get_s3_params
+        from splitgraph.ingestion.csv.parallel import read_csv_ranges
+
+        server_options = self.get_server_options()
+        del server_options["wrapper"]
+        table_options = dict(self._get_foreign_table_options(tmp_schema)).get(table, {})
+        options = {**load_options(server_options), **table_options}
+
+        csv_options = CSVOptions.from_fdw_options(options)
+        if cursor_fields or csv_options.parallel_workers <= 1 or not options.get("s3_object"):
+            return super()._copy_table(tmp_schema, table, schema, cursor_fields)
+
+        s3_client, s3_bucket, _ = get_s3_params(options)
+        s3_object = options["s3_object"]
+        size = s3_client.stat_object(s3_bucket, s3_object).size or 0
+        if size <= csv_options.parallel_range_size:
+            return super()._copy_table(tmp_schema, table, schema, cursor_fields)
+
+        if csv_options.encoding == "" and not csv_options.autodetect_encoding:
+            csv_options = csv_options._replace(autodetect_encoding=True)
+
+        @contextlib.contextmanager
+        def _open_range(offset: int):
+            response = s3_client.get_object(s3_bucket, s3_object, offset=offset)
+            try:
+                yield io.BufferedReader(response)
+            finally:
+                response.close()
+                response.release_conn()
+
+        table_schema = self.engine.get_full_table_schema(tmp_schema, table)
+        if not self.engine.table_exists(schema, table):
+            self.engine.create_table(schema, table, schema_spec=table_schema)
+
+        # Empty strings are NULLs, like in CSVForeignDataWrapper
+        columns = SQL(",").join(Identifier(c.name) for c in table_schema)
+        copy_command = SQL("COPY {}.{} (").format(Identifier(schema), Identifier(table))
+        copy_command += columns + SQL(") FROM STDIN WITH (FORMAT CSV, FORCE_NULL (")
+        copy_command += columns + SQL("))")
+
+        rows = 0
+        for csv_range in read_csv_ranges(_open_range, size, csv_options, len(table_schema)):
+            with self.engine.copy_cursor() as cur:
+                cur.copy_expert(copy_command, io.StringIO(csv_range.data))
+            rows += csv_range.rows
+            logging.info("Loaded %d rows of %s (%.1f%%)", rows, table, 100 * csv_range.end / size)
+
+    def _get_table_sizes(self, schema: str, tables: List[str]) -> Dict[str, int]:
+        from splitgraph.ingestion.csv.common import get_s3_params
+
+        # The FDW can't estimate how large a CSV file is, so use the sizes of the S3 objects
+        # instead (and fall back to the planner's estimates for files loaded over HTTP).
+        server_options = self.get_server_options()
+        del server_options["wrapper"]
+        server_options = load_options(server_options)
+        table_options = dict(self._get_foreign_table_options(schema))
+
+        sizes: Dict[str, int] = {}
+        other_tables = []
+        for table in tables:
+            options = {**server_options, **table_options.get(table, {})}
+            if options.get("s3_object"):
+                s3_client, s3_bucket, _ = get_s3_params(options)
+                sizes[table] = s3_client.stat_object(s3_bucket, options["s3_object"]).size or 0
+            else:
+                other_tables.append(table)
+        if other_tables:
+            sizes.update(super()._get_table_sizes(schema, other_tables))
+        return sizes
+
     def get_server_options(self):
         options: Dict[str, Any] = {}
         for k in self.params_schema["properties"].keys():
@@ -35,11 +35,15 @@ class CSVOptions(NamedTuple):
     autodetect_encoding: bool = True
     autodetect_sample_size: int = 65536
     schema_inference_rows: int = 100000
+    schema_inference_reservoir: bool = False
     delimiter: str = ","
     quotechar: str = '"'
     header: bool = True
     encoding: str = "utf-8"
     ignore_decode_errors: bool = False
+    parallel_workers: int = 1
+    parallel_range_size: int = 64 * 1024 * 1024
+    vectorized: bool = False
 
     @classmethod
     def from_fdw_options(cls, fdw_options):
@@ -49,11 +53,15 @@ class CSVOptions(NamedTuple):
             autodetect_encoding=fdw_options.get("autodetect_encoding", True),
             autodetect_sample_size=int(fdw_options.get("autodetect_sample_size", 65536)),
             schema_inference_rows=int(fdw_options.get("schema_inference_rows", 100000)),
+            schema_inference_reservoir=fdw_options.get("schema_inference_reservoir", False),
             header=fdw_options.get("header", True),
             delimiter=fdw_options.get("delimiter", ","),
             quotechar=fdw_options.get("quotechar", '"'),
             encoding=fdw_options.get("encoding", "utf-8"),
             ignore_decode_errors=fdw_options.get("ignore_decode_errors", False),
+            parallel_workers=int(fdw_options.get("parallel_workers", 1)),
+            parallel_range_size=int(fdw_options.get("parallel_range_size", 64 * 1024 * 1024)),
+            vectorized=fdw_options.get("vectorized", False),
         )
 
     def to_csv_kwargs(self):
@@ -14,6 +14,7 @@ import splitgraph.config
 from splitgraph.config.config import get_singleton
 from splitgraph.exceptions import get_exception_name
 from splitgraph.ingestion.common import generate_column_names
+from splitgraph.ingestion.csv import vectorized
 from splitgraph.ingestion.csv.common import (
     CSVOptions,
     dump_options,
@@ -22,7 +23,7 @@ from splitgraph.ingestion.csv.common import (
     make_csv_reader,
     pad_csv_row,
 )
-from splitgraph.ingestion.inference import infer_sg_schema
+from splitgraph.ingestion.inference import infer_sg_schema, reservoir_sample
 
 try:
     from multicorn import ANY, ColumnDefinition, ForeignDataWrapper, TableDefinition
@@ -50,7 +51,12 @@ def _get_table_definition(response, fdw_options, table_name, table_options):
     fdw_options.update(table_options)
 
     csv_options, reader = make_csv_reader(response, CSVOptions.from_fdw_options(fdw_options))
-    sample = list(islice(reader, csv_options.schema_inference_rows))
+    if csv_options.schema_inference_reservoir:
+        # Keep the header and sample the rest of the rows from the whole file.
+        sample = list(islice(reader, 1 if csv_options.header else 0))
+        sample.extend(reservoir_sample(reader, csv_options.schema_inference_rows - len(sample)))
+    else:
+        sample = list(islice(reader, csv_options.schema_inference_rows))
 
     if not csv_options.header:
         sample = [[""] * len(sample[0])] + sample
@@ -123,6 +129,7 @@ class CSVForeignDataWrapper(ForeignDataWrapper):
         # The foreign datawrapper columns (name -> ColumnDefinition).
         self.fdw_columns = fdw_columns
         self._num_cols = len(fdw_columns)
+        self._column_types = [getattr(c, "type_name", None) for c in fdw_columns.values()]
 
         self.csv_options = CSVOptions.from_fdw_options(self.fdw_options)
 
@@ -176,6 +183,21 @@ class CSVForeignDataWrapper(ForeignDataWrapper):
 
             yield row
 
+    def _read_stream(self, stream, csv_options):
+        if csv_options.vectorized:
+            if vectorized.vectorized_csv_available():
+                _, batches = vectorized.read_csv_batches(stream, csv_options, self._column_types)
+                for batch in batches:
+                    yield from batch
+                return
+            log_to_postgres(
+                "pandas isn't installed, falling back to non-vectorized CSV parsing",
+                level=logging.WARNING,
+            )
+
+        csv_options, reader = make_csv_reader(stream, csv_options)
+        yield from self._read_csv(reader, csv_options)
+
     def execute(self, quals, columns, sortkeys=None):
         """Main Multicorn entry point."""
 
@@ -192,8 +214,7 @@ class CSVForeignDataWrapper(ForeignDataWrapper):
                 if csv_options.encoding == "" and not csv_options.autodetect_encoding:
                     csv_options = csv_options._replace(encoding=response.encoding)
 
-                csv_options, reader = make_csv_reader(stream, csv_options)
-                yield from self._read_csv(reader, csv_options)
+                yield from self._read_stream(stream, csv_options)
         else:
             minio_response: Optional[HTTPResponse] = None
             try:
@@ -204,8 +225,7 @@ class CSVForeignDataWrapper(ForeignDataWrapper):
                 csv_options = self.csv_options
                 if csv_options.encoding == "" and not csv_options.autodetect_encoding:
                     csv_options = csv_options._replace(autodetect_encoding=True)
-                csv_options, reader = make_csv_reader(minio_response, csv_options)
-                yield from self._read_csv(reader, csv_options)
+                yield from self._read_stream(minio_response, csv_options)
             finally:
                 if minio_response:
                     minio_response.close()
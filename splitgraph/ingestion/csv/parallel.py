@@ -0,0 +1,168 @@
+"""
+Parallel ingestion of large CSV files: the file is split into byte ranges that get
+parsed concurrently and turned into CSV that Postgres can COPY directly.
+"""
+import csv
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Callable, ContextManager, Iterator, List, NamedTuple, Tuple, cast
+
+from splitgraph.ingestion.csv.common import CSVOptions, autodetect_csv, pad_csv_row
+
+# Function that opens the CSV file at a given byte offset
+RangeOpener = Callable[[int], ContextManager[IO[bytes]]]
+
+
+class CSVRange(NamedTuple):
+    # Byte offsets of the first record in the range and of the first record after it
+    start: int
+    end: int
+    # Number of records in the range
+    rows: int
+    # Records in the range, serialized as CSV that COPY ... WITH (FORMAT CSV) can load
+    data: str
+
+
+def get_byte_ranges(size: int, range_size: int) -> List[Tuple[int, int]]:
+    """
+    Split a file into byte ranges of roughly equal size.
+
+    :param size: Size of the file in bytes
+    :param range_size: Maximum size of each range
+    :return: List of [start, end) byte offsets
+    """
+    no_ranges = max(-(-size // max(range_size, 1)), 1)
+    boundaries = [size * i // no_ranges for i in range(no_ranges + 1)]
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def parse_csv_range(
+    stream: IO[bytes],
+    start: int,
+    end: int,
+    csv_options: CSVOptions,
+    num_cols: int,
+    skip_partial: bool = False,
+    skip_header: bool = False,
+) -> CSVRange:
+    """
+    Parse all records in a CSV file that start in the range [start, end).
+
+    The stream is read line by line, keeping track of how many bytes the CSV parser
+    has consumed, so that the byte offset where every record starts is known exactly
+    (even if the record has quoted newlines in it). The last record can extend past
+    the end of the range.
+
+    :param stream: Stream of the CSV file positioned at `start`
+    :param start: Byte offset of the stream
+    :param end: Records that start at or after this offset are not parsed
+    :param csv_options: CSV dialect and encoding
+    :param num_cols: Number of columns in the table (rows are truncated/padded to it)
+    :param skip_partial: Skip the stream up to and including the first newline (the range
+        starts in the middle of a record)
+    :param skip_header: Skip the first record of the range
+    :return: CSVRange
+    """
+    position = start
+    lines = iter(stream)
+    if skip_partial:
+        position += len(next(lines, b""))
+    first_record = position
+
+    errors = "ignore" if csv_options.ignore_decode_errors else "strict"
+
+    def _decode_lines():
+        nonlocal position
+        for line in lines:
+            position += len(line)
+            yield line.decode(csv_options.encoding, errors=errors)
+
+    # csv.reader only pulls the lines it needs to return the next record, so after
+    # every record, `position` is the offset of the one that follows it.
+    reader = csv.reader(_decode_lines(), **csv_options.to_csv_kwargs(), skipinitialspace=True)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+
+    rows = 0
+    record_start = first_record
+    while record_start < end:
+        row = next(reader, None)
+        if row is None:
+            break
+        if skip_header:
+            skip_header = False
+        elif row:
+            # Empty strings are loaded as NULLs (see CSVForeignDataWrapper._read_csv)
+            writer.writerow(pad_csv_row(row, row_number=rows, num_cols=num_cols))
+            rows += 1
+        record_start = position
+
+    return CSVRange(start=first_record, end=record_start, rows=rows, data=output.getvalue())
+
+
+def read_csv_ranges(
+    open_range: RangeOpener, size: int, csv_options: CSVOptions, num_cols: int
+) -> Iterator[CSVRange]:
+    """
+    Parse a CSV file in parallel. The file is split into byte ranges of
+    `csv_options.parallel_range_size` that are parsed by `csv_options.parallel_workers`
+    threads. Every range (apart from the first one) starts after the first newline in it.
+
+    A newline can be inside of a quoted field, so the ranges are validated in order:
+    every range must start exactly where the records of the previous range ended, otherwise
+    it gets reparsed from the correct offset. This also means that the file's records must
+    be terminated by \n or \r\n.
+
+    :param open_range: Function that opens the file at a given byte offset
+    :param size: Size of the file in bytes
+    :param csv_options: CSV options. If any autodetection flags are set, the dialect is
+        autodetected from the beginning of the file.
+    :param num_cols: Number of columns in the table
+    :return: Iterator of parsed ranges in file order
+    """
+    with open_range(0) as stream:
+        csv_options = autodetect_csv(cast(io.RawIOBase, stream), csv_options)
+
+    def _parse(byte_range: Tuple[int, int]) -> CSVRange:
+        start, end = byte_range
+        # Open the range one byte early so that a record that starts exactly on the
+        # range boundary isn't skipped.
+        offset = max(start - 1, 0)
+        with open_range(offset) as stream:
+            return parse_csv_range(
+                stream,
+                offset,
+                end,
+                csv_options,
+                num_cols,
+                skip_partial=start > 0,
+                skip_header=start == 0 and csv_options.header,
+            )
+
+    byte_ranges = iter(get_byte_ranges(size, csv_options.parallel_range_size))
+    workers = max(csv_options.parallel_workers, 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as tpe:
+        # Limit the number of ranges that are parsed ahead, since their data is kept in memory.
+        pending = deque((r[1], tpe.submit(_parse, r)) for r in islice(byte_ranges, workers * 2))
+        position = 0
+        try:
+            while pending:
+                end, future = pending.popleft()
+                csv_range = future.result()
+                for r in islice(byte_ranges, 1):
+                    pending.append((r[1], tpe.submit(_parse, r)))
+
+                if csv_range.start != position:
+                    if position >= end:
+                        # The previous range's last record spans this whole range
+                        continue
+                    with open_range(position) as stream:
+                        csv_range = parse_csv_range(stream, position, end, csv_options, num_cols)
+                position = csv_range.end
+                yield csv_range
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,117 @@
+"""
+Vectorized CSV backend that parses CSV files into batches of rows with pandas' C parser.
+Columns that the table stores as integers or floats are decoded into native numbers
+instead of creating a string for every value.
+"""
+import io
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, cast
+
+from splitgraph.core.output import ResettableStream
+from splitgraph.ingestion.csv.common import CSVOptions, autodetect_csv
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    # The pandas extra isn't installed: CSVForeignDataWrapper falls back to csv.reader.
+    pd = None  # type: ignore
+    np = None  # type: ignore
+
+# Types that can be parsed exactly into a float64 array, even if the column has NULLs in it.
+_INTEGER_TYPES = ("integer", "smallint")
+_FLOAT_TYPES = ("double precision", "real")
+
+DEFAULT_BATCH_SIZE = 65536
+
+
+def vectorized_csv_available() -> bool:
+    """Check if the vectorized backend can be used (pandas is installed)"""
+    return pd is not None
+
+
+def _column_values(column: "pd.Series", pg_type: Optional[str]) -> Sequence[Any]:
+    values = column.to_numpy()
+    if values.dtype.kind == "f":
+        nulls = np.isnan(values)
+        result = values.astype(object)
+        if pg_type in _INTEGER_TYPES and np.array_equal(values[~nulls], np.floor(values[~nulls])):
+            # Integer column with NULLs in it that pandas parsed as floats
+            result[~nulls] = values[~nulls].astype(np.int64).tolist()
+        result[nulls] = None
+        return cast(Sequence[Any], result)
+    if values.dtype.kind == "O":
+        nulls = column.isna().to_numpy()
+        if nulls.any():
+            values = values.copy()
+            values[nulls] = None
+        return cast(Sequence[Any], values)
+    return cast(List[Any], values.tolist())
+
+
+def read_csv_batches(
+    response: io.IOBase,
+    csv_options: CSVOptions,
+    column_types: Sequence[Optional[str]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Tuple[CSVOptions, Iterator[List[Tuple[Any, ...]]]]:
+    """
+    Vectorized version of `make_csv_reader` that parses a CSV file with pandas into
+    batches of rows.
+
+    Rows are padded/truncated to the number of columns and empty values are returned
+    as None (like CSVForeignDataWrapper does). Values of integer and float columns are
+    returned as numbers, other values are returned as strings.
+
+    :param response: Stream with the CSV file
+    :param csv_options: CSV options, autodetected like in `make_csv_reader`
+    :param column_types: PostgreSQL types of the table's columns
+    :param batch_size: Number of rows in each batch
+    :return: Autodetected CSV options and an iterator of lists of row tuples
+    """
+    if pd is None:
+        raise ImportError("The vectorized CSV backend requires pandas!")
+
+    stream = ResettableStream(response)
+    csv_options = autodetect_csv(stream, csv_options)
+    stream.reset()
+    io_stream = io.TextIOWrapper(
+        io.BufferedReader(stream),
+        encoding=csv_options.encoding,
+        newline="",
+        errors="ignore" if csv_options.ignore_decode_errors else "strict",
+    )
+
+    num_cols = len(column_types)
+    # Let pandas infer the types of numeric columns: everything else stays a string.
+    dtypes = {
+        i: object
+        for i, pg_type in enumerate(column_types)
+        if pg_type not in _INTEGER_TYPES + _FLOAT_TYPES
+    }
+
+    reader = pd.read_csv(
+        io_stream,
+        sep=csv_options.delimiter,
+        quotechar=csv_options.quotechar,
+        header=0 if csv_options.header else None,
+        # Pad short rows with NULLs and drop extra fields from long ones
+        names=list(range(num_cols)),
+        index_col=False,
+        usecols=list(range(num_cols)),
+        dtype=dtypes,
+        keep_default_na=False,
+        na_values=[""],
+        skipinitialspace=True,
+        engine="c",
+        # The default float parser in the C engine can be off by one ULP: parse floats
+        # the same way Python (and PostgreSQL) do.
+        float_precision="round_trip",
+        chunksize=batch_size,
+    )
+
+    def _batches() -> Iterator[List[Tuple[Any, ...]]]:
+        for frame in reader:
+            columns = [_column_values(frame[i], t) for i, t in enumerate(column_types)]
+            yield list(zip(*columns))
+
+    return csv_options, _batches()
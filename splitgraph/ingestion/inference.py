@@ -1,10 +1,27 @@
 import json
-from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import math
+import random
+from collections import deque
+from itertools import islice
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+)
 
 from splitgraph.core.output import parse_date, parse_dt, parse_time
 from splitgraph.core.types import TableColumn, TableSchema
 from splitgraph.ingestion.csv.common import pad_csv_row
 
+T = TypeVar("T")
+_END = object()
+
 
 def parse_boolean(boolean: str):
     if boolean.lower() in ["t", "true"]:
@@ -48,27 +65,104 @@ _CONVERTERS: List[Tuple[str, Callable]] = [
 ]
 
 
+# Cheap checks that a value has to pass for the converter to be able to parse it (used to
+# avoid calling the much slower strptime on values that clearly aren't dates/times).
+_PREFILTERS: Dict[str, Callable[[str], bool]] = {
+    "timestamp": lambda v: "-" in v and ":" in v,
+    "date": lambda v: "-" in v,
+    "time": lambda v: ":" in v,
+}
+
+# Number of values that all candidate types get checked against together, eliminating
+# the types that can't parse them, before the remaining ones get checked one by one.
+_LATTICE_VALUES = 16
+
+
+def _parses_all(candidate: str, converter: Callable, values: Iterable[str]) -> bool:
+    if candidate in _PREFILTERS:
+        # strptime is expensive: only parse distinct values.
+        values = set(values)
+        if not all(map(_PREFILTERS[candidate], values)):
+            return False
+    try:
+        # Consume the converted values without building a list.
+        deque(map(converter, values), maxlen=0)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
 def _infer_column_schema(column_sample: Sequence[str], ignore_empty_strings=True) -> str:
-    for candidate, converter in _CONVERTERS:
-        try:
-            seen_value = False
-            for c in column_sample:
-                if (c == "" and ignore_empty_strings) or c is None:
-                    continue
-
-                seen_value = True
-                converter(c)
-            # Don't let empty strings or Nones break the parsers but don't accept
-            # columns that are just empty strings (they'll be a string).
-            if seen_value:
-                return candidate
-        except (ValueError, TypeError):
+    # Don't let empty strings or Nones break the parsers but don't accept
+    # columns that are just empty strings (they'll be a string).
+    def _values(start: int) -> Iterable[str]:
+        values = islice(column_sample, start, None)
+        if ignore_empty_strings:
+            return filter(None, values)
+        return (c for c in values if c is not None)
+
+    # Check all candidates against the first few values at the same time, so that e.g. a column
+    # of strings gets eliminated after one value instead of one value for each candidate.
+    candidates = list(_CONVERTERS)
+    seen_value = False
+    position = 0
+    for position, value in enumerate(column_sample[:_LATTICE_VALUES], start=1):
+        if value is None or (value == "" and ignore_empty_strings):
             continue
+        seen_value = True
+        candidates = [
+            (candidate, converter)
+            for candidate, converter in candidates
+            if _parses_all(candidate, converter, [value])
+        ]
+        if not candidates:
+            break
+
+    # The column gets the first type that can parse all of its values. The values are
+    # only looked at until the first one that the type can't parse.
+    for candidate, converter in candidates:
+        if _parses_all(candidate, converter, _values(position)):
+            if not seen_value and next(iter(_values(position)), None) is None:
+                # Column that's just empty strings
+                break
+            return candidate
 
     # No suitable conversion, fall back to varchar
     return "character varying"
 
 
+def reservoir_sample(rows: Iterable[T], size: int, seed: Optional[int] = None) -> List[T]:
+    """
+    Get a uniform random sample of rows from an iterable of unknown length in one pass
+    (reservoir sampling, Algorithm L). The rows are returned in the order they appear
+    in the iterable.
+
+    :param rows: Iterable of rows
+    :param size: Number of rows to sample
+    :param seed: Seed for the random number generator
+    :return: List of at most `size` rows
+    """
+    rng = random.Random(seed)
+    iterator = iter(rows)
+    reservoir = list(enumerate(islice(iterator, size)))
+    if len(reservoir) < size or size <= 0:
+        return [r for _, r in reservoir]
+
+    weight = math.exp(math.log(rng.random()) / size)
+    position = size - 1
+    while True:
+        # Skip the rows that don't get into the reservoir without looking at them.
+        skip = int(math.log(rng.random()) / math.log(1 - weight))
+        position += skip + 1
+        row = next(islice(iterator, skip, skip + 1), _END)
+        if row is _END:
+            break
+        reservoir[rng.randrange(size)] = (position, cast(T, row))
+        weight *= math.exp(math.log(rng.random()) / size)
+
+    return [r for _, r in sorted(reservoir, key=lambda r: r[0])]
+
+
 def infer_sg_schema(
     sample: Sequence[List[str]],
     override_types: Optional[Dict[str, str]] = None,
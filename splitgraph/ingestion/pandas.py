@@ -1,15 +1,18 @@
 """Routines that ingest/export CSV files to/from Splitgraph images using Pandas"""
 
 import csv
-from io import StringIO
-from typing import TYPE_CHECKING, Optional, Union
+import itertools
+import sys
+from io import TextIOBase
+from typing import TYPE_CHECKING, Iterable, List, Optional, Union, cast
 
 import pandas as pd
 from pandas.core.frame import DataFrame
+from pandas.core.indexes.base import Index
 from pandas.core.series import Series
 from pandas.io.sql import get_schema
 from psycopg2.sql import SQL, Identifier
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
 
 from splitgraph.core.image import Image
@@ -21,6 +24,12 @@ if TYPE_CHECKING:
     from splitgraph.engine.postgres.engine import PostgresEngine
     from splitgraph.engine.postgres.psycopg import PsycopgEngine
 
+# Number of rows of a dataframe that get serialized into CSV at a time
+WRITE_CHUNK_SIZE = 100000
+
+# Number of rows of a query result that get fetched at a time
+READ_CHUNK_SIZE = 100000
+
 
 def _get_sqlalchemy_engine(engine: "PostgresEngine") -> Engine:
     server, port, username, password, dbname = (
@@ -61,32 +70,151 @@ class PandasIngestionAdapter(IngestionAdapter):
     def query_to_data(engine, query: str, schema: Optional[str] = None, **kwargs):
         # Pandas' `read_sql_table/query` because they has type inference via SQLAlchemy
         # (from the datatypes in the query that postgres gives back).
-        if schema:
-            query = (
-                SQL("SET search_path TO {},public;")
-                .format(Identifier(schema))
-                .as_string(engine.connection)
-                + query
+        set_search_path = (
+            SQL("SET search_path TO {},public;")
+            .format(Identifier(schema))
+            .as_string(engine.connection)
+            if schema
+            else ""
+        )
+
+        if "chunksize" in kwargs:
+            # The caller wants an iterator of dataframes. The schema we're querying might get
+            # deleted after we return, so we can't stream the result.
+            return pd.read_sql_query(
+                sql=set_search_path + query, con=_get_sqlalchemy_engine(engine), **kwargs
             )
 
-        return pd.read_sql_query(sql=query, con=_get_sqlalchemy_engine(engine), **kwargs)
+        # Stream the result with a server-side cursor and turn it into dataframes chunk by
+        # chunk, so that the whole result isn't held in memory as a list of tuples as well.
+        with _get_sqlalchemy_engine(engine).connect() as connection:
+            if set_search_path:
+                connection.execute(set_search_path)
+
+            # Keep the cursor that runs the query to get the columns of an empty result from it.
+            cursors = []
+
+            @event.listens_for(connection, "after_cursor_execute")
+            def _save_cursor(_conn, cursor, *args):
+                cursors.append(cursor)
+
+            result = _concat_chunks(
+                pd.read_sql_query(
+                    sql=query,
+                    con=connection.execution_options(stream_results=True),
+                    chunksize=READ_CHUNK_SIZE,
+                    **kwargs,
+                ),
+                ignore_index=kwargs.get("index_col") is None,
+            )
+        if result is None:
+            # Empty result: build a dataframe with the query's columns.
+            result = pd.DataFrame(columns=[c[0] for c in cursors[-1].description])
+            if kwargs.get("index_col") is not None:
+                result = result.set_index(kwargs["index_col"])
+        return result
+
+
+def _concat_chunks(chunks: Iterable[DataFrame], ignore_index: bool) -> Optional[DataFrame]:
+    iterator = iter(chunks)
+    first = next(iterator, None)
+    if first is None:
+        return None
+    second = next(iterator, None)
+    if second is None:
+        return first
+
+    # Split every chunk into separate columns as it's read and concatenate the result
+    # column by column, dropping the parts of each column as soon as they've been
+    # concatenated. This way, the chunks and the result are never all in memory at once.
+    columns = first.columns
+    indexes: List[Index] = []
+    column_parts: List[List[Series]] = [[] for _ in columns]
+    for chunk in itertools.chain((first, second), iterator):
+        indexes.append(chunk.index)
+        for i, parts in enumerate(column_parts):
+            parts.append(chunk.iloc[:, i].copy())
+    del first, second, chunk
+
+    result_columns = []
+    for parts in column_parts:
+        column = pd.concat(parts, ignore_index=True)
+        # Chunks can get different dtypes for the same column (e.g. a chunk where an integer
+        # column is all NULLs is an object column): infer these again like Pandas would have
+        # done for the whole result.
+        if len({part.dtype for part in parts}) > 1:
+            column = column.infer_objects()
+        parts.clear()
+        result_columns.append(column.to_frame())
+
+    # Don't copy the columns into one block per dtype.
+    result = pd.concat(result_columns, axis=1, copy=False)
+    result.columns = columns
+    if not ignore_index:
+        result.index = indexes[0].append(indexes[1:])
+    return result
+
+
+class _DataFrameCSVStream(TextIOBase):
+    """
+    File-like object that serializes a dataframe into CSV chunk by chunk when it's read
+    (so that COPY FROM STDIN can load it without the whole CSV being in memory).
+    """
+
+    def __init__(self, df: Union[Series, DataFrame], chunk_size: int):
+        super().__init__()
+        self._df = df
+        self._chunk_size = chunk_size
+        self._next_row = 0
+        self._buffer = ""
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self) -> str:
+        chunk = self._df.iloc[self._next_row : self._next_row + self._chunk_size]
+        self._next_row += self._chunk_size
+        # Don't write the index column if it's unnamed (generated by Pandas)
+        csv_str = chunk.to_csv(
+            header=False,
+            index=self._df.index.names != [None],
+            escapechar="\\",
+            quoting=csv.QUOTE_ALL,
+        )
+        # Dirty hack
+        return cast(str, csv_str).replace('""', "")
+
+    def read(self, size: Optional[int] = -1) -> str:
+        if size is None or size < 0:
+            size = sys.maxsize
+        result = []
+        while size > 0:
+            if self._position == len(self._buffer):
+                if self._next_row >= len(self._df):
+                    break
+                self._buffer = self._next_chunk()
+                self._position = 0
+            data = self._buffer[self._position : self._position + size]
+            self._position += len(data)
+            size -= len(data)
+            result.append(data)
+        return "".join(result)
 
 
 def df_to_table_fast(
-    engine: "PsycopgEngine", df: Union[Series, DataFrame], target_schema: str, target_table: str
+    engine: "PsycopgEngine",
+    df: Union[Series, DataFrame],
+    target_schema: str,
+    target_table: str,
+    chunk_size: int = WRITE_CHUNK_SIZE,
 ):
     # Instead of using Pandas' to_sql, dump the dataframe to csv and then load it on the other
-    # end using Psycopg's copy_to.
-    # Don't write the index column if it's unnamed (generated by Pandas)
-    csv_str = df.to_csv(
-        header=False, index=df.index.names != [None], escapechar="\\", quoting=csv.QUOTE_ALL
+    # end using Psycopg's copy_to. The CSV is generated `chunk_size` rows at a time while
+    # COPY is reading it.
+    copy_csv_buffer(
+        _DataFrameCSVStream(df, chunk_size), engine, target_schema, target_table, no_header=True
     )
-    # Dirty hack
-    csv_str = csv_str.replace('""', "")
-    buffer = StringIO()
-    buffer.write(csv_str)
-    buffer.seek(0)
-    copy_csv_buffer(buffer, engine, target_schema, target_table, no_header=True)
 
 
 _pandas_adapter = PandasIngestionAdapter()
@@ -0,0 +1,66 @@
+-- Precomputed grouping of a table's fragments into groups of fragments that overlap each other
+-- (see `fragment_manager.get_chunk_groups`), so that query planning doesn't have to fetch and sort
+-- the boundaries of every fragment in the table.
+--
+-- Like object_cache_status, this lives on the engine that the objects are queried on.
+-- * table_objects_hash: sha256 of the comma-separated list of the table's object IDs. Objects are
+--     immutable, so the grouping of a given list of objects never changes and an image or a table
+--     whose object list has changed simply maps to a different entry.
+-- * group_ids: group number of every object in the table (in the same order as the table's
+--     object_ids). Groups are numbered in order of their lowest primary key.
+-- * last_used: Timestamp (UTC) this entry was last used to plan a query (only updated once it's
+--     more than a minute old, so that most lookups don't write). The cache is capped at
+--     SG_FRAGMENT_GROUP_CACHE_SIZE entries and the least recently used entries are evicted first.
+CREATE TABLE splitgraph_meta.fragment_groups (
+    table_objects_hash varchar(64) NOT NULL PRIMARY KEY CHECK (table_objects_hash ~ '^[a-f0-9]{64}$'),
+    group_ids integer[] NOT NULL,
+    last_used timestamp
+);
+
+CREATE INDEX idx_fragment_groups_last_used ON splitgraph_meta.fragment_groups (last_used);
+
+-- Query plans (fragments that have to be scanned to satisfy a query against a table, see
+-- `table.QueryPlan`) shared between all processes querying tables on this engine, so that repeated
+-- queries against the same image don't have to go through planning again.
+-- * plan_key: sha256 of the table (image, name and object list), qualifiers and columns of the query.
+-- * namespace, repository, image_hash, table_name: table this plan is for (used for invalidation).
+-- * plan: JSON with the filtered objects, their grouping and the row count/size estimates.
+-- * last_used: Timestamp (UTC) this plan was last used (only updated once it's more than a
+--     minute old, so that most lookups don't write). The cache is capped at
+--     SG_QUERY_PLAN_CACHE_SIZE plans and the least recently used plans are evicted first.
+CREATE TABLE splitgraph_meta.query_plans (
+    plan_key varchar(64) NOT NULL PRIMARY KEY CHECK (plan_key ~ '^[a-f0-9]{64}$'),
+    namespace varchar NOT NULL,
+    repository varchar NOT NULL,
+    image_hash varchar NOT NULL,
+    table_name varchar NOT NULL,
+    plan jsonb NOT NULL,
+    last_used timestamp
+);
+
+CREATE INDEX idx_query_plans_image ON splitgraph_meta.query_plans (namespace, repository, image_hash);
+CREATE INDEX idx_query_plans_last_used ON splitgraph_meta.query_plans (last_used);
+
+-- Extra state used by object cache eviction policies (see `splitgraph.core.eviction`).
+-- * access_count: Number of times the object has been used since it was downloaded
+--     (including uses before it was last evicted, if it's still in object_cache_ghosts).
+-- * clock: Value of the cache's clock (see below) when the object was last used.
+ALTER TABLE splitgraph_meta.object_cache_status
+    ADD COLUMN access_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN clock double precision NOT NULL DEFAULT 0;
+
+-- * clock: Priority of the last evicted object (used by GDSF to age objects in the cache).
+-- * arc_target: Target size (in bytes) of the part of the cache with objects that were
+--     only used once (used by ARC).
+ALTER TABLE splitgraph_meta.object_cache_occupancy
+    ADD COLUMN clock double precision NOT NULL DEFAULT 0,
+    ADD COLUMN arc_target bigint NOT NULL DEFAULT 0;
+
+-- Objects that were recently evicted from the cache, totalling up to the size of the cache,
+-- so that their access history can be restored if they're downloaded again.
+CREATE TABLE splitgraph_meta.object_cache_ghosts (
+    object_id varchar NOT NULL PRIMARY KEY,
+    size bigint NOT NULL,
+    access_count integer NOT NULL,
+    evicted timestamp NOT NULL
+);
@@ -106,6 +106,15 @@ $BODY$
 LANGUAGE plpython3u
 VOLATILE;
 
+CREATE OR REPLACE FUNCTION splitgraph_api.list_partial_objects ()
+    RETURNS varchar[]
+    AS $BODY$
+    from splitgraph.core.server import list_partial_objects
+    return list_partial_objects()
+$BODY$
+LANGUAGE plpython3u
+VOLATILE;
+
 CREATE OR REPLACE FUNCTION splitgraph_api.object_exists (
     object_id varchar
 )
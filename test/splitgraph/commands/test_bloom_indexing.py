@@ -1,3 +1,4 @@
+import json
 from datetime import datetime as dt
 from datetime import timedelta
 from test.splitgraph.commands.test_layered_querying import _prepare_fully_remote_repo
@@ -6,11 +7,13 @@ from unittest import mock
 
 import pytest
 
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.indexing.bloom import (
     _prepare_bloom_quals,
     describe,
     filter_bloom_index,
 )
+from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository, clone
 from splitgraph.engine import ResultShape
 from splitgraph.exceptions import ObjectIndexingError
@@ -91,6 +94,57 @@ def test_bloom_index_structure(local_engine_empty):
     assert len(index["bloom"]["value_2"][1]) == 40
 
 
+def test_index_single_pass(local_engine_empty):
+    # Check that new objects are hashed and indexed in one pass through them
+    # and get the same indexes as the ones generated from stored objects.
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER)")
+    for i in range(26):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s, %s)", (i + 1, chr(ord("a") + i), i * 2))
+    extra_indexes = {"bloom": {"value_1": {"size": 16}}, "range": ["value_2"]}
+
+    with mock.patch.object(
+        ObjectManager, "generate_object_index", wraps=OUTPUT.objects.generate_object_index
+    ) as goi, mock.patch.object(
+        ObjectManager, "_scan_object", wraps=OUTPUT.objects._scan_object
+    ) as so:
+        head = OUTPUT.commit(chunk_size=10, extra_indexes={"test": extra_indexes})
+        assert goi.call_count == 0
+
+    table = head.get_table("test")
+    assert so.call_count == len(table.objects) == 3
+    object_meta = OUTPUT.objects.get_object_meta(table.objects)
+    for object_id in table.objects:
+        assert object_meta[object_id].object_index == json.loads(
+            json.dumps(
+                OUTPUT.objects.generate_object_index(
+                    object_id, table.table_schema, extra_indexes=extra_indexes
+                )
+            )
+        )
+        insertion_hash, rows_inserted = OUTPUT.objects.calculate_fragment_insertion_hash_stats(
+            SPLITGRAPH_META_SCHEMA, object_id
+        )
+        assert object_meta[object_id].insertion_hash == insertion_hash.hex()
+        assert object_meta[object_id].rows_inserted == rows_inserted
+
+    # Same for patches
+    OUTPUT.run_sql("UPDATE test SET value_1 = 'updated' WHERE key = 5")
+    OUTPUT.run_sql("DELETE FROM test WHERE key = 15")
+    head = OUTPUT.commit(extra_indexes={"test": extra_indexes})
+    object_id = head.get_table("test").objects[-1]
+    object_meta = OUTPUT.objects.get_object_meta([object_id])[object_id]
+    insertion_hash, rows_inserted = OUTPUT.objects.calculate_fragment_insertion_hash_stats(
+        SPLITGRAPH_META_SCHEMA, object_id
+    )
+    assert object_meta.insertion_hash == insertion_hash.hex()
+    assert object_meta.rows_inserted == rows_inserted == 1
+    assert object_meta.rows_deleted == 2
+
+    # The index includes the old values of the changed rows
+    assert object_meta.object_index["range"] == {"key": [5, 15], "value_2": [8, 28]}
+
+
 def test_bloom_index_querying(local_engine_empty):
     # Same dataset as the previous, but this time test querying the bloom index
     # by calling it directly (not as part of an LQ).
@@ -1,4 +1,5 @@
 import operator
+import time
 from datetime import date
 from datetime import datetime as dt
 from decimal import Decimal
@@ -11,7 +12,7 @@ from unittest.mock import patch
 import pytest
 from psycopg2.sql import SQL, Identifier
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
 from splitgraph.core.fragment_manager import Digest
 from splitgraph.core.metadata_manager import OBJECT_COLS
 from splitgraph.core.object_manager import ObjectManager
@@ -20,6 +21,7 @@ from splitgraph.core.sql.queries import select
 from splitgraph.core.types import TableColumn
 from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import PostgresEngine
+from splitgraph.exceptions import SplitGraphError
 from splitgraph.hooks.s3_server import delete_objects, list_objects
 
 
@@ -184,6 +186,105 @@ def test_commit_chunking(local_engine_empty):
     assert ab.mock_calls[2][1][0] == [("splitgraph_meta", objects[2])]
 
 
+def test_commit_chunking_parallel(local_engine_empty, monkeypatch):
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key_1 INTEGER, key_2 VARCHAR, value INTEGER, PRIMARY KEY (key_1, key_2))"
+    )
+    # Insert the rows out of order and with a composite PK
+    for i in range(22, -1, -1):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s, %s)", (i // 2, chr(ord("a") + i), i))
+    head = OUTPUT.commit(chunk_size=5)
+    objects = head.get_table("test").objects
+    assert len(objects) == 5
+
+    # Commit the table again using multiple connections, recreating the objects: check that
+    # we get the same objects in the same order and that they have the same contents.
+    monkeypatch.setitem(CONFIG, "SG_COMMIT_CHUNK_THREADS", "3")
+    with mock.patch.object(
+        ObjectManager, "_chunk_table_parallel", wraps=OUTPUT.objects._chunk_table_parallel
+    ) as ctp:
+        head = OUTPUT.commit(snap_only=True, chunk_size=5, overwrite=True)
+        assert ctp.call_count == 1
+
+    assert head.get_table("test").objects == objects
+    for i, obj in enumerate(objects):
+        assert local_engine_empty.run_sql(
+            SQL("SELECT value FROM {}.{}").format(
+                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(obj)
+            ),
+            return_shape=ResultShape.MANY_ONE,
+        ) == list(range(i * 5, min(i * 5 + 5, 23)))
+
+    # Make sure we don't leave temporary objects behind.
+    assert not [
+        t for t in OUTPUT.engine.get_all_tables(SPLITGRAPH_META_SCHEMA) if t.startswith("sg_tmp_")
+    ]
+
+    # Chunks have to add up to the whole table.
+    table_schema = OUTPUT.engine.get_full_table_schema(OUTPUT.to_schema(), "test")
+    with pytest.raises(SplitGraphError, match="have 23 rows instead of 24"):
+        OUTPUT.objects._chunk_table_parallel(
+            OUTPUT, OUTPUT.to_schema(), "test", 5, table_schema, threads=3, table_length=24
+        )
+
+    # Other connections can't see uncommitted changes to the table, so it gets chunked
+    # on one connection.
+    OUTPUT.run_sql("INSERT INTO test VALUES (100, 'z', 100)")
+    with mock.patch.object(ObjectManager, "_chunk_table_parallel") as ctp:
+        object_ids = OUTPUT.objects._chunk_table(
+            OUTPUT, OUTPUT.to_schema(), "test", 5, threads=3, overwrite=True
+        )
+        assert ctp.call_count == 0
+    assert object_ids[:4] == objects[:4]
+    assert len(object_ids) == 5
+    OUTPUT.engine.rollback()
+
+
+@pytest.mark.parametrize("strategy", ["sequential", "bulk"])
+def test_checkout_parallel_fragment_groups(local_engine_empty, strategy, monkeypatch):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER)")
+    for i in range(11):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s, %s)", (i + 1, chr(ord("z") - i), i * 2))
+    OUTPUT.commit(chunk_size=5)
+
+    # Change rows in the first two chunks: the patches will overlap their chunks, producing
+    # two groups of fragments that can be applied independently.
+    OUTPUT.run_sql("UPDATE test SET value_2 = 100 WHERE key = 2")
+    OUTPUT.run_sql("UPDATE test SET value_2 = 0 WHERE key = 4")
+    OUTPUT.run_sql("DELETE FROM test WHERE key = 7")
+    OUTPUT.run_sql("UPDATE test SET value_1 = 'updated' WHERE key = 8")
+    head = OUTPUT.commit(chunk_size=5)
+    expected = OUTPUT.run_sql("SELECT * FROM test ORDER BY key")
+    table = head.get_table("test")
+
+    OUTPUT.objects.fragment_apply_threads = 4
+    monkeypatch.setitem(CONFIG, "SG_FRAGMENT_APPLY_STRATEGY", strategy)
+    assert len(set(OUTPUT.objects.get_fragment_groups(table).values())) >= 2
+
+    with mock.patch.object(
+        PostgresEngine, "_apply_groups", wraps=OUTPUT.engine._apply_groups
+    ) as apply_groups:
+        head.checkout(force=True)
+        assert apply_groups.call_count == 1
+    assert OUTPUT.run_sql("SELECT * FROM test ORDER BY key") == expected
+
+    # Same with layered querying, where only the rows that match the qualifiers
+    # get written out.
+    with mock.patch.object(
+        PostgresEngine, "_apply_groups", wraps=OUTPUT.engine._apply_groups
+    ) as apply_groups:
+        result = table.query(columns=["key", "value_2"], quals=[[("value_2", ">", 5)]])
+        assert apply_groups.call_count == 1
+    assert sorted(r["key"] for r in result) == [r[0] for r in expected if r[2] > 5]
+
+    # Make sure we've cleaned up all staging tables.
+    assert not [
+        t for t in OUTPUT.engine.get_all_tables(SPLITGRAPH_META_SCHEMA) if t.startswith("sg_tmp_")
+    ]
+
+
 def test_commit_chunking_order(local_engine_empty):
     # Same but make sure the chunks order by PK for more efficient indexing
     # Also test in-chunk ordering (order by value_1 which will make the actual
@@ -489,6 +590,142 @@ def test_commit_diff_splitting_composite(local_engine_empty):
     )
 
 
+_ENGINE_PATCH_CHANGES = """UPDATE test SET value = 'updated' WHERE key < 3;
+UPDATE test SET flag = NOT flag, data = '{"b": 1}' WHERE key = 3;
+DELETE FROM test WHERE key = 4;
+INSERT INTO test VALUES (10, 'new', '2021-01-01 12:00:00', true, '{}');
+DELETE FROM test WHERE key = 6;
+INSERT INTO test VALUES (6, 'val_6', '2020-01-01 06:00:00', true, '{"a": 6}');
+INSERT INTO test VALUES (11, 'gone', NULL, NULL, NULL);
+DELETE FROM test WHERE key = 11;
+UPDATE test SET key = 12 WHERE key = 7"""
+
+# Without a PK, the intermediate row makes the Python conflation store
+# a deletion of a row that never existed.
+_ENGINE_PATCH_PK_CHANGES = """;
+UPDATE test SET value = 'temp' WHERE key = 5;
+UPDATE test SET value = 'val_5' WHERE key = 5"""
+
+
+@pytest.mark.parametrize("with_pk", [True, False])
+def test_commit_diff_on_engine(local_engine_empty, monkeypatch, with_pk):
+    # Check that conflating the changes on the engine produces the same fragment
+    # as conflating them in Python.
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key INTEGER %s, value VARCHAR, created TIMESTAMP, "
+        "flag BOOLEAN, data JSONB)" % ("PRIMARY KEY" if with_pk else "")
+    )
+    OUTPUT.run_sql(
+        "INSERT INTO test SELECT i, 'val_' || i, '2020-01-01'::timestamp + i * interval '1 hour', "
+        "i % 2 = 0, jsonb_build_object('a', i) FROM generate_series(0, 9) i"
+    )
+    base = OUTPUT.commit()
+    extra_indexes = {"test": {"bloom": {"value": {"probability": 0.01}}}}
+
+    def _commit_changes(threshold):
+        monkeypatch.setitem(CONFIG, "SG_COMMIT_ENGINE_PATCH_THRESHOLD", threshold)
+        base.checkout(force=True)
+        OUTPUT.run_sql(_ENGINE_PATCH_CHANGES + (_ENGINE_PATCH_PK_CHANGES if with_pk else ""))
+        OUTPUT.commit_engines()
+        engine = OUTPUT.objects.object_engine
+        with mock.patch.object(
+            engine, "store_pending_changes", wraps=engine.store_pending_changes
+        ) as spc, mock.patch.object(
+            OUTPUT.objects, "_register_object", wraps=OUTPUT.objects._register_object
+        ) as ro:
+            head = OUTPUT.commit(extra_indexes=extra_indexes, overwrite=True)
+        objects = head.get_table("test").objects
+        contents = [
+            OUTPUT.engine.run_sql(
+                SQL("SELECT * FROM {}.{} o ORDER BY o::text").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(o)
+                )
+            )
+            for o in objects
+        ]
+        # The changeset is only passed to _register_object when conflating changes in Python.
+        registered = [
+            (c[0], {k: v for k, v in c[1].items() if k != "changeset"}) for c in ro.call_args_list
+        ]
+        return spc.call_count, objects, contents, registered
+
+    calls, objects, contents, registered = _commit_changes("100000")
+    assert calls == 0
+    assert len(objects) == 2
+
+    engine_calls, engine_objects, engine_contents, engine_registered = _commit_changes("0")
+    assert engine_calls == 1
+    assert engine_objects == objects
+    assert engine_contents == contents
+    assert engine_registered == registered
+    assert OUTPUT.run_sql("SELECT key, value FROM test ORDER BY key") == [
+        (0, "updated"),
+        (1, "updated"),
+        (2, "updated"),
+        (3, "val_3"),
+        (5, "val_5"),
+        (6, "val_6"),
+        (8, "val_8"),
+        (9, "val_9"),
+        (10, "new"),
+        (12, "val_7"),
+    ]
+
+    # Changes that cancel each other out don't produce a new fragment.
+    base.checkout(force=True)
+    OUTPUT.run_sql(
+        "UPDATE test SET value = 'temp' WHERE key = 5; UPDATE test SET value = 'val_5' WHERE key = 5"
+    )
+    head = OUTPUT.commit()
+    assert head.get_table("test").objects == base.get_table("test").objects
+
+    # Make sure we don't leave temporary tables behind.
+    assert not OUTPUT.engine.run_sql(
+        "SELECT 1 FROM pg_tables WHERE schemaname LIKE 'pg_temp%%' AND tablename LIKE 'sg_tmp_%%'"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("rows", [10000, 100000, 1000000, 10000000])
+def test_commit_diff_on_engine_benchmark(local_engine_empty, monkeypatch, rows):
+    # Time committing patches of different sizes in Python and on the engine to check where
+    # SG_COMMIT_ENGINE_PATCH_THRESHOLD should be (the patch has about 2/3 as many changes as
+    # the table has rows).
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value VARCHAR)")
+    OUTPUT.run_sql(
+        "INSERT INTO test SELECT i, 'value_' || i FROM generate_series(1, %s) i", (rows,)
+    )
+    base = OUTPUT.commit(chunk_size=rows)
+
+    # Conflating 10M changes in Python takes too much memory, so only time the engine there.
+    thresholds = {"python": "1000000000", "engine": "0"} if rows <= 1000000 else {"engine": "0"}
+    times = {}
+    objects = {}
+    for path, threshold in thresholds.items():
+        monkeypatch.setitem(CONFIG, "SG_COMMIT_ENGINE_PATCH_THRESHOLD", threshold)
+        base.checkout(force=True)
+        OUTPUT.run_sql("UPDATE test SET value = value || '_updated' WHERE key % 2 = 0")
+        OUTPUT.run_sql("DELETE FROM test WHERE key % 3 = 0")
+        OUTPUT.commit_engines()
+
+        start = time.perf_counter()
+        head = OUTPUT.commit(overwrite=True)
+        times[path] = time.perf_counter() - start
+        objects[path] = head.get_table("test").objects
+
+    if "python" in times:
+        print(
+            "Committing a patch to a table with %d rows: python %.3fs, engine %.3fs (%.1fx)"
+            % (rows, times["python"], times["engine"], times["python"] / times["engine"])
+        )
+        assert objects["python"] == objects["engine"]
+    else:
+        print("Committing a patch to a table with %d rows: engine %.3fs" % (rows, times["engine"]))
+    assert len(objects["engine"]) == 2
+
+
 def test_commit_mode_change(pg_repo_local):
     # Test committing with splitting by fragment group boundaries after not doing so.
     OUTPUT.init()
@@ -1,5 +1,6 @@
 import json
 import logging
+import random
 import time
 from datetime import datetime as dt
 from test.splitgraph.conftest import OUTPUT, _assert_cache_occupancy, prepare_lq_repo
@@ -7,9 +8,15 @@ from unittest import mock
 from unittest.mock import call
 
 import pytest
+from click.testing import CliRunner
 
+from splitgraph.commandline import backfill_index_c
 from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
-from splitgraph.core.fragment_manager import get_chunk_groups
+from splitgraph.core.fragment_manager import (
+    _pk_overlap,
+    get_chunk_groups,
+    get_overlapping_chunks,
+)
 from splitgraph.core.indexing.range import extract_min_max_pks
 from splitgraph.core.migration import META_TABLES
 from splitgraph.core.object_manager import ObjectManager
@@ -149,6 +156,9 @@ class TestLayeredQuerying:
 
         quals, _ = ([[("fruit_id", "=", "2")]], [{"name": "guitar", "timestamp": _DT}])
 
+        # Drop the plans cached on the engine by other tests
+        lq_test_repo.objects.invalidate_query_plans(lq_test_repo.namespace, lq_test_repo.repository)
+
         # Check "query plan" is reused and the table doesn't run qual filtering again
         with mock.patch.object(
             ObjectManager, "filter_fragments", wraps=table.repository.objects.filter_fragments
@@ -163,6 +173,98 @@ class TestLayeredQuerying:
         assert len(query_plan.required_objects) == 4
         assert len(query_plan.filtered_objects) == 3
 
+    def test_direct_table_lq_query_plan_cache_persistent(self, lq_test_repo, monkeypatch):
+        # The query plan cache on the engine is disabled by default
+        monkeypatch.setattr(lq_test_repo.objects, "query_plan_cache_size", 1024)
+        quals = [[("fruit_id", "=", "3")]]
+        lq_test_repo.objects.invalidate_query_plans(lq_test_repo.namespace, lq_test_repo.repository)
+        plan = lq_test_repo.head.get_table("fruits").get_query_plan(
+            quals=quals, columns=["name", "timestamp"]
+        )
+
+        # A different Table instance (e.g. in a different LQ process) reuses the plan
+        # cached on the engine instead of planning the query again.
+        with mock.patch.object(
+            ObjectManager, "filter_fragments", wraps=lq_test_repo.objects.filter_fragments
+        ) as fo, mock.patch(
+            "splitgraph.core.object_manager.update_engine_cache"
+        ) as update_engine_cache:
+            cached_plan = lq_test_repo.head.get_table("fruits").get_query_plan(
+                quals=quals, columns=["name", "timestamp"]
+            )
+            assert fo.call_count == 0
+            # The plan was just used, so the lookup doesn't write to the engine.
+            assert update_engine_cache.call_count == 0
+
+            # Different columns need a new plan
+            lq_test_repo.head.get_table("fruits").get_query_plan(
+                quals=quals, columns=["name", "fruit_id"]
+            )
+            assert fo.call_count == 1
+
+        assert cached_plan.filtered_objects == plan.filtered_objects
+        assert cached_plan.singletons == plan.singletons
+        assert cached_plan.non_singletons == plan.non_singletons
+        assert cached_plan.estimated_rows == plan.estimated_rows
+        assert cached_plan.size_per_row == plan.size_per_row
+        assert cached_plan.singleton_queries == plan.singleton_queries
+
+    def test_direct_table_lq_query_plan_cache_transactions(self, lq_test_repo, monkeypatch):
+        # The query plan cache on the engine is disabled by default
+        monkeypatch.setattr(lq_test_repo.objects, "query_plan_cache_size", 1024)
+        quals = [[("fruit_id", "=", "2")]]
+        lq_test_repo.objects.invalidate_query_plans(lq_test_repo.namespace, lq_test_repo.repository)
+        lq_test_repo.commit_engines()
+
+        # Looking up and caching plans doesn't commit the caller's transaction, but the
+        # plans are still cached after it's rolled back.
+        lq_test_repo.run_sql("CREATE TABLE uncommitted (key INTEGER)")
+        for _ in range(2):
+            lq_test_repo.head.get_table("fruits").get_query_plan(
+                quals=quals, columns=["name", "timestamp"]
+            )
+        lq_test_repo.engine.rollback()
+        assert not lq_test_repo.engine.table_exists(lq_test_repo.to_schema(), "uncommitted")
+        assert (
+            lq_test_repo.engine.run_sql(
+                "SELECT COUNT(1) FROM splitgraph_meta.query_plans",
+                return_shape=ResultShape.ONE_ONE,
+            )
+            == 1
+        )
+
+    def test_direct_table_lq_query_plan_cache_eviction(self, lq_test_repo):
+        table = lq_test_repo.head.get_table("fruits")
+        object_manager = lq_test_repo.objects
+        object_manager.invalidate_query_plans(lq_test_repo.namespace, lq_test_repo.repository)
+
+        with mock.patch.object(object_manager, "query_plan_cache_size", 2):
+            for fruit_id in range(1, 4):
+                table.get_query_plan(
+                    quals=[[("fruit_id", "=", str(fruit_id))]], columns=["name"], use_cache=False
+                )
+
+            # Only the two most recently used plans are kept
+            assert (
+                lq_test_repo.engine.run_sql(
+                    "SELECT COUNT(1) FROM splitgraph_meta.query_plans",
+                    return_shape=ResultShape.ONE_ONE,
+                )
+                == 2
+            )
+
+        # Deleting the image drops its plans
+        object_manager.invalidate_query_plans(
+            lq_test_repo.namespace, lq_test_repo.repository, image_hashes=[table.image.image_hash]
+        )
+        assert (
+            lq_test_repo.engine.run_sql(
+                "SELECT COUNT(1) FROM splitgraph_meta.query_plans",
+                return_shape=ResultShape.ONE_ONE,
+            )
+            == 0
+        )
+
 
 def test_layered_querying_against_single_fragment(pg_repo_local):
     # Test the case where the query is satisfied by a single fragment.
@@ -417,7 +519,14 @@ def test_multiengine_flow(
 
     # Test the local engine doesn't actually have any metadata stored on it.
     for table in META_TABLES:
-        if table not in ("object_cache_status", "object_cache_occupancy", "version"):
+        if table not in (
+            "object_cache_status",
+            "object_cache_occupancy",
+            "object_cache_ghosts",
+            "fragment_groups",
+            "query_plans",
+            "version",
+        ):
             assert (
                 local_engine_empty.run_sql(
                     "SELECT COUNT(1) FROM splitgraph_meta." + table,
@@ -589,6 +698,118 @@ def test_disjoint_table_lq_two_singletons_one_overwritten(pg_repo_local):
             _assert_fragments_applied(_gsc, apply_fragments, pg_repo_local)
 
 
+def test_query_plan_fragment_groups_cached(pg_repo_local):
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'fruit_5_updated' WHERE fruit_id = 5")
+    fruits = pg_repo_local.commit().get_table("fruits")
+    object_manager = pg_repo_local.objects
+    # The cache is disabled by default
+    object_manager.fragment_group_cache_size = 1024
+
+    with mock.patch.object(
+        object_manager, "get_min_max_pks", wraps=object_manager.get_min_max_pks
+    ) as get_min_max_pks:
+        # Groups are numbered in the same order as get_chunk_groups returns them
+        assert object_manager.get_fragment_groups(fruits) == {
+            "of22f20503d3bf17c7449b545d68ebcee887ed70089f0342c4bff38862c0dc5": 0,
+            "o23fe42d48d7545596d0fea1c48bcf7d64bde574d437c77cc5bb611e5f8849d": 0,
+            "o3f81f6c40ecc3366d691a2ce45f41f6f180053020607cbd0873baf0c4447dc": 0,
+            "of0fb43e477311f82aa30055be303ff00599dfe155d737def0d00f06e07228b": 1,
+            "oaa6d009e485bfa91aec4ab6b0ed1ebcd67055f6a3420d29f26446b034f41cc": 2,
+            "o15a420721b04e9749761b5368628cb15593cb8cfdcc547107b98eddda5031d": 2,
+        }
+        assert get_min_max_pks.call_count == 1
+
+        # Second call uses the cached grouping and doesn't write to the engine.
+        with mock.patch(
+            "splitgraph.core.fragment_manager.update_engine_cache"
+        ) as update_engine_cache:
+            object_manager.get_fragment_groups(fruits)
+            assert update_engine_cache.call_count == 0
+        assert get_min_max_pks.call_count == 1
+
+    assert (
+        pg_repo_local.engine.run_sql(
+            "SELECT COUNT(1) FROM splitgraph_meta.fragment_groups",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 1
+    )
+
+    # Only the fragments in the non-singleton groups need boundaries to plan the query.
+    with mock.patch.object(
+        object_manager, "get_fragment_boundaries", wraps=object_manager.get_fragment_boundaries
+    ) as get_fragment_boundaries:
+        plan = fruits.get_query_plan(
+            quals=[[("fruit_id", ">=", "3")]], columns=["fruit_id", "name"], use_cache=False
+        )
+        assert plan.singletons == [
+            "of0fb43e477311f82aa30055be303ff00599dfe155d737def0d00f06e07228b"
+        ]
+        assert plan.non_singletons == [
+            "oaa6d009e485bfa91aec4ab6b0ed1ebcd67055f6a3420d29f26446b034f41cc",
+            "o15a420721b04e9749761b5368628cb15593cb8cfdcc547107b98eddda5031d",
+        ]
+        assert sorted(get_fragment_boundaries.call_args_list[-1][0][1]) == sorted(
+            plan.non_singletons
+        )
+
+    # Cleanup drops the cached groupings
+    object_manager.cleanup()
+    assert (
+        pg_repo_local.engine.run_sql(
+            "SELECT COUNT(1) FROM splitgraph_meta.fragment_groups",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 0
+    )
+
+
+def test_query_plan_fragment_groups_transactions(pg_repo_local):
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    fruits = pg_repo_local.head.get_table("fruits")
+    vegetables = pg_repo_local.head.get_table("vegetables")
+    object_manager = pg_repo_local.objects
+    object_manager.fragment_group_cache_size = 1024
+    pg_repo_local.commit_engines()
+
+    # Looking up the groups doesn't commit the caller's transaction.
+    pg_repo_local.run_sql("CREATE TABLE uncommitted (key INTEGER)")
+    object_manager.get_fragment_groups(fruits)
+    object_manager.get_fragment_groups(fruits)
+    pg_repo_local.engine.rollback()
+    assert not pg_repo_local.engine.table_exists(pg_repo_local.to_schema(), "uncommitted")
+
+    # The grouping is still in the cache, since it's stored in a separate transaction.
+    def _cached_groups():
+        return pg_repo_local.engine.run_sql(
+            "SELECT COUNT(1) FROM splitgraph_meta.fragment_groups",
+            return_shape=ResultShape.ONE_ONE,
+        )
+
+    assert _cached_groups() == 1
+
+    # Least recently used groupings get evicted.
+    object_manager.fragment_group_cache_size = 1
+    object_manager.get_fragment_groups(vegetables)
+    assert _cached_groups() == 1
+    with mock.patch.object(
+        object_manager, "get_fragment_boundaries", wraps=object_manager.get_fragment_boundaries
+    ) as get_fragment_boundaries:
+        object_manager.get_fragment_groups(vegetables)
+        assert get_fragment_boundaries.call_count == 0
+        object_manager.get_fragment_groups(fruits)
+        assert get_fragment_boundaries.call_count == 1
+
+    # The cache can be disabled.
+    object_manager.fragment_group_cache_size = 0
+    object_manager.cleanup()
+    object_manager.get_fragment_groups(fruits)
+    assert _cached_groups() == 0
+
+
 def test_query_plan_surrogate_pk_grouping(local_engine_empty):
     # If a table doesn't have a PK, we use whole_row::text to chunk it.
     OUTPUT.init()
@@ -620,6 +841,55 @@ def test_query_plan_surrogate_pk_grouping(local_engine_empty):
     assert sorted(plan.filtered_objects) == sorted(table.objects)
     assert plan.non_singletons == []
 
+    # Surrogate PK boundaries are cached after the first use
+    object_manager = table.repository.objects
+    boundaries = object_manager.get_fragment_boundaries(table, table.objects)
+    with mock.patch.object(
+        object_manager, "generate_surrogate_pk", wraps=object_manager.generate_surrogate_pk
+    ) as generate_surrogate_pk:
+        assert object_manager.get_fragment_boundaries(table, table.objects) == boundaries
+        assert generate_surrogate_pk.call_count == 0
+
+
+def test_query_plan_surrogate_pk_precomputed(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER, value_1 VARCHAR)")
+    OUTPUT.run_sql("INSERT INTO test VALUES (1, 'apple')")
+    OUTPUT.run_sql("INSERT INTO test VALUES (10, 'banana')")
+    OUTPUT.run_sql("INSERT INTO test VALUES (2, 'orange')")
+
+    table = OUTPUT.commit(chunk_size=2).get_table("test")
+    object_manager = OUTPUT.objects
+    expected = object_manager.generate_surrogate_pk(
+        table, object_manager.get_min_max_pks(table.objects, get_change_key(table.table_schema))
+    )
+
+    # Surrogate PK boundaries are stored in the index on commit
+    object_meta = object_manager.get_object_meta(table.objects)
+    assert [
+        tuple(object_meta[o].object_index["range"]["$surrogate_pk"]) for o in table.objects
+    ] == expected
+
+    # Planning doesn't need to cast the boundaries to text on the engine
+    new_object_manager = ObjectManager(OUTPUT.engine)
+    with mock.patch.object(new_object_manager, "generate_surrogate_pk") as generate_surrogate_pk:
+        assert new_object_manager.get_fragment_boundaries(table, table.objects) == expected
+    assert generate_surrogate_pk.call_count == 0
+
+    # Objects indexed before the boundaries were stored get them backfilled
+    for object_id in table.objects:
+        del object_meta[object_id].object_index["range"]["$surrogate_pk"]
+    object_manager.register_objects(list(object_meta.values()))
+    assert object_manager.get_stored_surrogate_pks(table.objects) == {}
+
+    result = CliRunner().invoke(backfill_index_c, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Updated the index of 2 objects" in result.output
+    assert object_manager.get_stored_surrogate_pks(table.objects) == dict(
+        zip(table.objects, expected)
+    )
+    assert object_manager.backfill_surrogate_pks() == []
+
 
 def _assert_fragments_applied(_gsc, apply_fragments, pg_repo_local):
     apply_fragments.assert_called_once_with(
@@ -795,3 +1065,125 @@ def test_get_chunk_groups():
     assert get_chunk_groups([("one", 1, 3), ("two", 6, 8), ("three", 3, 6), ("four", 8, 10)]) == [
         [("one", 1, 3), ("two", 6, 8), ("three", 3, 6), ("four", 8, 10)]
     ]
+
+
+def _overlapping_chunks_reference(boundaries, selected):
+    # Check every chunk against every selected chunk
+    return {
+        i
+        for i, chunk in enumerate(boundaries)
+        if i not in selected and any(j < i and _pk_overlap(boundaries[j], chunk) for j in selected)
+    }
+
+
+def test_get_overlapping_chunks():
+    # Only chunks that come after a selected chunk can overwrite it
+    assert get_overlapping_chunks([(1, 3), (2, 4), (0, 1), (5, 6)], [1]) == set()
+    assert get_overlapping_chunks([(1, 3), (2, 4), (0, 1), (5, 6)], [0]) == {1, 2}
+    assert get_overlapping_chunks([(1, 3), (2, 4), (0, 1), (5, 6)], [0, 1]) == {2}
+    assert get_overlapping_chunks([(1, 3), (2, 4), (4, 5), (5, 6)], [0]) == {1}
+    assert get_overlapping_chunks([(1, 3), (2, 4)], []) == set()
+
+    # Composite PKs with NULLs (that sort after all other values)
+    assert get_overlapping_chunks(
+        [((1, "a"), (1, None)), ((1, "b"), (2, "a")), ((2, "b"), (2, "c")), ((1, "d"), (1, "e"))],
+        [0],
+    ) == {1, 3}
+
+    random.seed(0)
+    for _ in range(100):
+        boundaries = [
+            tuple(sorted((random.randint(0, 100), random.randint(0, 100))))
+            for _ in range(random.randint(1, 50))
+        ]
+        selected = random.sample(range(len(boundaries)), random.randint(0, len(boundaries)))
+        assert get_overlapping_chunks(boundaries, selected) == _overlapping_chunks_reference(
+            boundaries, selected
+        )
+
+
+@pytest.mark.benchmark
+def test_get_overlapping_chunks_benchmark():
+    random.seed(0)
+    boundaries = []
+    for _ in range(20000):
+        start = random.randint(0, 10000000)
+        boundaries.append((start, start + random.randint(0, 1000)))
+    selected = random.sample(range(len(boundaries)), 2000)
+
+    start = time.perf_counter()
+    expected = _overlapping_chunks_reference(boundaries, selected)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = get_overlapping_chunks(boundaries, selected)
+    sweep_time = time.perf_counter() - start
+
+    print(
+        "Finding overlapping chunks for %d/%d chunks: pairwise %.3fs, sweep %.3fs (%.1fx)"
+        % (len(selected), len(boundaries), reference_time, sweep_time, reference_time / sweep_time)
+    )
+    assert actual == expected
+
+
+def _make_composite_pk_table(rows, chunk_size):
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key_1 INTEGER, key_2 VARCHAR, value INTEGER, PRIMARY KEY (key_1, key_2))"
+    )
+    OUTPUT.run_sql(
+        "INSERT INTO test SELECT i / 10, 'key_' || (i % 10), i FROM generate_series(0, %s) i",
+        (rows - 1,),
+    )
+    return OUTPUT.commit(chunk_size=chunk_size).get_table("test")
+
+
+def test_extract_min_max_pks_batched(local_engine_empty):
+    table = _make_composite_pk_table(rows=100, chunk_size=25)
+    assert len(table.objects) == 4
+
+    expected = [
+        (
+            (i * 25 // 10, "key_%d" % (i * 25 % 10)),
+            ((i * 25 + 24) // 10, "key_%d" % ((i * 25 + 24) % 10)),
+        )
+        for i in range(4)
+    ]
+    for batch_size in [1, 3, 500]:
+        assert (
+            extract_min_max_pks(
+                local_engine_empty,
+                table.objects,
+                ["key_1", "key_2"],
+                ["integer", "character varying"],
+                batch_size=batch_size,
+            )
+            == expected
+        )
+
+    # Check the composite PK range index is the same
+    object_meta = OUTPUT.objects.get_object_meta(table.objects)
+    assert [
+        tuple(tuple(pk) for pk in object_meta[o].object_index["range"]["$pk"])
+        for o in table.objects
+    ] == expected
+
+
+@pytest.mark.benchmark
+def test_extract_min_max_pks_benchmark(local_engine_empty):
+    table = _make_composite_pk_table(rows=1000000, chunk_size=1000)
+    args = (local_engine_empty, table.objects, ["key_1", "key_2"], ["integer", "character varying"])
+
+    start = time.perf_counter()
+    expected = extract_min_max_pks(*args, batch_size=1)
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = extract_min_max_pks(*args)
+    batch_time = time.perf_counter() - start
+
+    print(
+        "Extracting min/max PKs of %d fragments: one at a time %.3fs, batched %.3fs (%.1fx)"
+        % (len(table.objects), single_time, batch_time, single_time / batch_time)
+    )
+    assert actual == expected
@@ -1,4 +1,10 @@
+import base64
 from test.splitgraph.conftest import OUTPUT
+from unittest import mock
+
+import pytest
+
+from splitgraph.core.indexing.stats import estimate_distinct
 
 
 def test_range_index_ordering_collation(local_engine_empty):
@@ -35,3 +41,45 @@ def test_range_index_ordering_collation(local_engine_empty):
             "value_2": [1, 4],
         }
     }
+
+
+def test_column_stats(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 JSONB)")
+    OUTPUT.engine.run_sql_batch(
+        "INSERT INTO test VALUES (%s, %s, %s)",
+        [(i, "val_%d" % (i % 10) if i % 4 else None, '{"a": 1}') for i in range(1000)],
+        schema=OUTPUT.to_schema(),
+    )
+
+    head = OUTPUT.commit(
+        chunk_size=500, extra_indexes={"test": {"stats": ["key", "value_1", "value_2"]}}
+    )
+    table = head.get_table("test")
+    object_meta = OUTPUT.objects.get_object_meta(table.objects)
+
+    stats = object_meta[table.objects[0]].object_index["stats"]
+    assert stats["key"]["nulls"] == 0
+    assert stats["key"]["histogram"] == [0, 62, 124, 187, 249, 312, 374, 437, 499]
+    assert stats["value_1"]["nulls"] == 125
+    assert stats["value_1"]["histogram"][0] == "val_0"
+    assert stats["value_1"]["histogram"][-1] == "val_9"
+    assert stats["value_2"] == {"nulls": 0, "hll": mock.ANY}
+    assert estimate_distinct(base64.b64decode(stats["value_1"]["hll"])) == pytest.approx(10, abs=2)
+
+    # The statistics are used to estimate the number of rows that a query will return
+    # (the range index doesn't discard any objects here).
+    plan = table.get_query_plan(quals=None, columns=["key"], use_cache=False)
+    assert plan.estimated_rows == 1000
+    plan = table.get_query_plan(
+        quals=[[("value_1", "=", "val_5")]], columns=["key"], use_cache=False
+    )
+    assert len(plan.filtered_objects) == 2
+    assert plan.estimated_rows == pytest.approx(75, rel=0.3)
+    plan = table.get_query_plan(quals=[[("key", "<", 100)]], columns=["key"], use_cache=False)
+    assert plan.filtered_objects == [table.objects[0]]
+    assert plan.estimated_rows < 200
+
+    # Check stats are the same when computed from stored objects.
+    table.reindex(extra_indexes={"stats": ["key", "value_1", "value_2"]})
+    assert OUTPUT.objects.get_object_meta(table.objects) == object_meta
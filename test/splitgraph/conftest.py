@@ -28,6 +28,18 @@ logging.basicConfig(
     format="%(asctime)s [%(process)d] %(levelname)s %(message)s", level=logging.DEBUG
 )
 
+
+def pytest_collection_modifyitems(config, items):
+    # Benchmarks are slow and only report timings: skip them unless they're
+    # selected explicitly (pytest -m benchmark -s).
+    if "benchmark" in (config.getoption("markexpr") or ""):
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmark, run with -m benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 R = Repository.from_schema
 
 PG_MNT = R("test/pg_mount")
@@ -1,8 +1,12 @@
+import threading
 from typing import Any, Dict, Optional, Tuple, cast
+from unittest import mock
 
+import pytest
 from psycopg2.sql import SQL, Identifier
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
+from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository
 from splitgraph.core.types import (
     IntrospectionResult,
@@ -13,6 +17,7 @@ from splitgraph.core.types import (
     TableSchema,
 )
 from splitgraph.engine import ResultShape
+from splitgraph.exceptions import DataSourceError
 from splitgraph.hooks.data_source import PostgreSQLDataSource
 from splitgraph.hooks.data_source.base import SyncableDataSource
 
@@ -308,3 +313,151 @@ def test_fdw_data_source_with_composite_cursors(pg_repo_local):
             },
         }
     }
+
+
+def _make_pg_data_source(engine, remote_schema, tables=None):
+    return PostgreSQLDataSource(
+        engine=engine,
+        credentials={"username": "user", "password": "password"},
+        params={"host": "localhost", "port": 5432, "dbname": "db", "remote_schema": remote_schema},
+        tables=tables,
+    )
+
+
+def test_fdw_data_source_table_tasks(monkeypatch):
+    engine = mock.MagicMock()
+    handler = _make_pg_data_source(engine, "public")
+    sizes = {"small": 10, "big": 1000, "medium": 100}
+
+    # One connection: tables are processed in order without estimating their sizes
+    processed = []
+    with mock.patch.object(handler, "_get_table_sizes") as get_table_sizes:
+        handler._run_table_tasks("schema", list(sizes), processed.append, [engine])
+    assert processed == ["small", "big", "medium"]
+    get_table_sizes.assert_not_called()
+    engine.commit.assert_not_called()
+
+    # Two connections: the two largest tables are started first and every task commits.
+    monkeypatch.setitem(CONFIG, "SG_INGESTION_THREADS", "2")
+    started = []
+    lock = threading.Lock()
+
+    def _task(table):
+        with lock:
+            started.append(table)
+
+    with mock.patch.object(handler, "_get_table_sizes", return_value=sizes) as get_table_sizes:
+        handler._run_table_tasks("schema", list(sizes), _task, [engine, engine])
+    get_table_sizes.assert_called_once_with("schema", ["small", "big", "medium"])
+    assert sorted(started[:2]) == ["big", "medium"]
+    assert started[2] == "small"
+    assert engine.commit.call_count == 3
+    engine.close_others.assert_called_once_with()
+
+
+def test_fdw_data_source_table_tasks_error(monkeypatch):
+    monkeypatch.setitem(CONFIG, "SG_INGESTION_THREADS", "2")
+    engine = mock.MagicMock()
+    handler = _make_pg_data_source(engine, "public")
+
+    def _task(table):
+        if table == "t_1":
+            raise DataSourceError("Error ingesting table %s" % table)
+
+    tables = ["t_%d" % i for i in range(10)]
+    with mock.patch.object(handler, "_get_table_sizes", return_value={t: 0 for t in tables}):
+        with pytest.raises(DataSourceError, match="t_1"):
+            handler._run_table_tasks("schema", tables, _task, [engine])
+    engine.rollback.assert_called_once_with()
+    engine.close_others.assert_called_once_with()
+
+
+def test_fdw_data_source_parallel(pg_repo_local, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SG_INGESTION_THREADS", "2")
+    pg_repo_local.run_sql(
+        "CREATE TABLE numbers AS SELECT i AS number_id, 'number_' || i AS name "
+        "FROM generate_series(1, 1000) i"
+    )
+    pg_repo_local.commit_engines()
+
+    engine = pg_repo_local.object_engine
+    handler = PostgreSQLDataSource(
+        engine=engine,
+        credentials={
+            "username": engine.conn_params["SG_ENGINE_USER"],
+            "password": engine.conn_params["SG_ENGINE_PWD"],
+        },
+        params={
+            "host": engine.conn_params["SG_ENGINE_HOST"],
+            "port": int(engine.conn_params["SG_ENGINE_PORT"]),
+            "dbname": engine.conn_params["SG_ENGINE_DB_NAME"],
+            "remote_schema": pg_repo_local.to_schema(),
+        },
+        tables={
+            table: (
+                [
+                    TableColumn(ordinal=1, name=key, pg_type="integer", is_pk=False),
+                    TableColumn(ordinal=2, name="name", pg_type="character varying", is_pk=False),
+                ],
+                {"table_name": table, "cursor_fields": [key]},
+            )
+            for table, key in [
+                ("fruits", "fruit_id"),
+                ("vegetables", "vegetable_id"),
+                ("numbers", "number_id"),
+            ]
+        },
+    )
+
+    sizes = {}
+    get_table_sizes = handler._get_table_sizes
+
+    def _get_table_sizes(schema, tables):
+        sizes.update(get_table_sizes(schema, tables))
+        return sizes
+
+    output = Repository("test", "fdw_parallel")
+
+    # If one of the tables fails to get stored, none of them get added to the image.
+    record_table_as_base = ObjectManager.record_table_as_base
+
+    def _fail_numbers(self, repository, table_name, *args, **kwargs):
+        if table_name == "numbers":
+            raise DataSourceError("Error storing table %s" % table_name)
+        return record_table_as_base(self, repository, table_name, *args, **kwargs)
+
+    with mock.patch.object(ObjectManager, "record_table_as_base", _fail_numbers):
+        with pytest.raises(DataSourceError, match="numbers"):
+            handler.load(output)
+    output.rollback_engines()
+    assert (
+        output.engine.run_sql(
+            "SELECT COUNT(1) FROM splitgraph_meta.tables WHERE namespace = %s AND repository = %s",
+            (output.namespace, output.repository),
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 0
+    )
+
+    with mock.patch.object(handler, "_get_table_sizes", side_effect=_get_table_sizes):
+        image_hash_1 = handler.load(output)
+    # Sizes are estimated from the planner's stats for every mounted table
+    assert sorted(sizes) == ["fruits", "numbers", "vegetables"]
+
+    image = output.images[image_hash_1]
+    assert sorted(image.get_tables()) == ["fruits", "numbers", "vegetables"]
+    image.checkout()
+    assert output.run_sql("SELECT COUNT(*) FROM numbers") == [(1000,)]
+    assert output.run_sql("SELECT COUNT(*) FROM fruits") == [(2,)]
+
+    # Sync: tables get copied into the staging schema in parallel
+    pg_repo_local.run_sql("INSERT INTO fruits (name) VALUES ('banana')")
+    pg_repo_local.run_sql("INSERT INTO numbers VALUES (1001, 'number_1001')")
+    pg_repo_local.commit_engines()
+
+    image_hash_2 = handler.sync(output, image_hash=image_hash_1)
+    image = output.images[image_hash_2]
+    image.checkout()
+    assert output.run_sql("SELECT COUNT(*) FROM numbers") == [(1001,)]
+    assert output.run_sql("SELECT COUNT(*) FROM fruits") == [(3,)]
+    assert output.run_sql("SELECT COUNT(*) FROM vegetables") == [(2,)]
@@ -1,23 +1,29 @@
+import contextlib
+import csv
 import json
 import os
-from io import BytesIO
+import time
+from io import BytesIO, StringIO
 from test.splitgraph.conftest import INGESTION_RESOURCES_CSV
 from unittest import mock
 
 import pytest
 
+from splitgraph.core.repository import Repository
 from splitgraph.core.types import MountError, Params, TableColumn, unwrap
 from splitgraph.engine import ResultShape
+from splitgraph.hooks.data_source.fdw import ForeignDataWrapperDataSource
 from splitgraph.hooks.s3_server import MINIO
 from splitgraph.ingestion.common import generate_column_names
-from splitgraph.ingestion.csv import CSVDataSource
+from splitgraph.ingestion.csv import CSVDataSource, vectorized
 from splitgraph.ingestion.csv.common import (
     CSVOptions,
     dump_options,
     load_options,
     make_csv_reader,
 )
-from splitgraph.ingestion.csv.fdw import CSVForeignDataWrapper
+from splitgraph.ingestion.csv.fdw import CSVForeignDataWrapper, _get_table_definition
+from splitgraph.ingestion.csv.parallel import get_byte_ranges, read_csv_ranges
 from splitgraph.ingestion.inference import infer_sg_schema
 
 _s3_win_1252_opts = {
@@ -824,3 +830,372 @@ def test_csv_grades():
                 ordinal=9, name="Grade", pg_type="character varying", is_pk=False, comment=None
             ),
         ]
+
+
+def _make_parallel_csv(rows):
+    # CSV file with quoted newlines, multibyte characters, Windows line endings, empty lines
+    # and rows that have to be truncated or padded.
+    lines = ["id,name,notes\r\n"]
+    for i in range(rows):
+        if i % 7 == 0:
+            lines.append('%d,"multi\nline\r\nname %d","Pañamao, ""quoted"""\r\n' % (i, i))
+        elif i % 11 == 0:
+            lines.append("%d,short\r\n\r\n" % i)
+        elif i % 13 == 0:
+            lines.append("%d,long,row,with,extra,fields\r\n" % i)
+        else:
+            lines.append("%d,name %d,\r\n" % (i, i))
+    return "".join(lines).encode("utf-8")
+
+
+def _read_parallel_csv(data, num_cols=3, **options):
+    csv_options = CSVOptions(
+        autodetect_header=False,
+        autodetect_dialect=False,
+        autodetect_encoding=False,
+        parallel_workers=4,
+        **options,
+    )
+
+    def _open_range(offset):
+        return contextlib.nullcontext(BytesIO(data[offset:]))
+
+    ranges = list(read_csv_ranges(_open_range, len(data), csv_options, num_cols))
+    rows = [r for csv_range in ranges for r in csv.reader(StringIO(csv_range.data))]
+    assert sum(r.rows for r in ranges) == len(rows)
+    return ranges, rows
+
+
+def test_csv_parallel_ranges():
+    data = _make_parallel_csv(200)
+
+    # Reference: rows the FDW returns
+    fdw = CSVForeignDataWrapper.__new__(CSVForeignDataWrapper)
+    fdw._num_cols = 3
+    csv_options, reader = make_csv_reader(
+        BytesIO(data),
+        CSVOptions(autodetect_header=False, autodetect_dialect=False, autodetect_encoding=False),
+    )
+    expected = [[v or "" for v in row] for row in fdw._read_csv(reader, csv_options)]
+    assert len(expected) == 200
+    assert expected[7] == ["7", "multi\nline\r\nname 7", 'Pañamao, "quoted"']
+    assert expected[11] == ["11", "short", ""]
+    assert expected[13] == ["13", "long", "row"]
+
+    # Range boundaries fall into the middle of quoted fields, multibyte characters,
+    # \r\n sequences, empty lines etc.
+    for range_size in [1, 2, 3, 5, 17, 64, 100, 1000, len(data) - 1, len(data), 10 * len(data)]:
+        ranges, rows = _read_parallel_csv(data, parallel_range_size=range_size)
+        assert rows == expected, range_size
+        assert ranges[0].start == 0
+        assert ranges[-1].end == len(data)
+        assert all(r1.end == r2.start for r1, r2 in zip(ranges, ranges[1:]))
+
+
+def test_csv_parallel_ranges_dialect():
+    data = "a;b\n1;x\n2;\n3;'quoted;\nvalue'\n".encode("utf-8")
+    for range_size in [1, 4, 100]:
+        _, rows = _read_parallel_csv(
+            data, num_cols=2, parallel_range_size=range_size, delimiter=";", quotechar="'"
+        )
+        assert rows == [["1", "x"], ["2", ""], ["3", "quoted;\nvalue"]]
+
+    # No header, no trailing newline
+    _, rows = _read_parallel_csv(b"1,2,3\n4,5,6", parallel_range_size=4, header=False)
+    assert rows == [["1", "2", "3"], ["4", "5", "6"]]
+
+    # Empty file
+    assert _read_parallel_csv(b"", parallel_range_size=4) == ([mock.ANY], [])
+
+
+def test_csv_byte_ranges():
+    assert get_byte_ranges(0, 10) == [(0, 0)]
+    assert get_byte_ranges(10, 10) == [(0, 10)]
+    assert get_byte_ranges(11, 10) == [(0, 5), (5, 11)]
+    assert get_byte_ranges(100, 30) == [(0, 25), (25, 50), (50, 75), (75, 100)]
+
+
+def test_csv_parallel_options():
+    assert CSVOptions.from_fdw_options({}).parallel_workers == 1
+    options = CSVOptions.from_fdw_options({"parallel_workers": 8, "parallel_range_size": "1048576"})
+    assert options.parallel_workers == 8
+    assert options.parallel_range_size == 1048576
+    # These aren't inferred, so they don't get frozen into the table options.
+    assert "parallel_workers" not in options.to_table_options()
+
+
+def test_csv_table_sizes():
+    source = CSVDataSource(
+        mock.Mock(),
+        credentials={"s3_access_key": "minioclient", "s3_secret_key": "supersecure"},
+        params={"s3_endpoint": "objectstorage:9000", "s3_secure": False, "s3_bucket": "test_csv"},
+    )
+    s3_client = mock.Mock()
+    s3_client.stat_object.return_value.size = 1000
+
+    with mock.patch.object(
+        source,
+        "_get_foreign_table_options",
+        return_value=[
+            ("s3_table", {"s3_object": "some/file.csv"}),
+            ("http_table", {"url": "http://example.com/file.csv"}),
+        ],
+    ), mock.patch(
+        "splitgraph.ingestion.csv.common.get_s3_params",
+        return_value=(s3_client, "test_csv", None),
+    ), mock.patch.object(
+        ForeignDataWrapperDataSource, "_get_table_sizes", return_value={"http_table": 42}
+    ) as get_planner_sizes:
+        sizes = source._get_table_sizes("schema", ["s3_table", "http_table"])
+
+    # S3 objects use their actual size, other files fall back to the planner's estimates.
+    assert sizes == {"s3_table": 1000, "http_table": 42}
+    s3_client.stat_object.assert_called_once_with("test_csv", "some/file.csv")
+    get_planner_sizes.assert_called_once_with("schema", ["http_table"])
+
+
+def _load_parallel_csv(engine, repository, s3_object, **params):
+    source = CSVDataSource(
+        engine,
+        credentials={
+            "s3_access_key": "minioclient",
+            "s3_secret_key": "supersecure",
+        },
+        params={
+            "s3_endpoint": "objectstorage:9000",
+            "s3_secure": False,
+            "s3_bucket": "test_csv",
+            **params,
+        },
+        tables={"data": ([], {"s3_object": s3_object})},
+    )
+    source.load(repository)
+    image = repository.images["latest"]
+    with image.query_schema() as s:
+        return engine.run_sql_in(s, "SELECT * FROM data ORDER BY id")
+
+
+def test_csv_data_source_parallel(local_engine_empty):
+    s3_object = "parallel/data.csv"
+    data = _make_parallel_csv(10000)
+    MINIO.put_object("test_csv", s3_object, BytesIO(data), len(data))
+
+    try:
+        expected = _load_parallel_csv(
+            local_engine_empty, Repository("test", "csv_sequential"), s3_object
+        )
+        assert len(expected) == 10000
+        assert expected[7] == (7, "multi\nline\r\nname 7", 'Pañamao, "quoted"')
+        assert expected[11] == (11, "short", None)
+        assert expected[12] == (12, "name 12", None)
+
+        with mock.patch(
+            "splitgraph.ingestion.csv.parallel.read_csv_ranges", wraps=read_csv_ranges
+        ) as read_ranges:
+            actual = _load_parallel_csv(
+                local_engine_empty,
+                Repository("test", "csv_parallel"),
+                s3_object,
+                parallel_workers=4,
+                parallel_range_size=10000,
+            )
+        assert read_ranges.call_count == 1
+        assert actual == expected
+    finally:
+        MINIO.remove_object("test_csv", s3_object)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", [1024**3, 10 * 1024**3])
+def test_csv_data_source_parallel_benchmark(local_engine_empty, tmp_path, size):
+    s3_object = "parallel/benchmark.csv"
+    block = _make_parallel_csv(100000)
+    path = tmp_path / "benchmark.csv"
+    with open(path, "wb") as f:
+        f.write(block)
+        # Repeat the block without the header
+        body = block[block.index(b"\n") + 1 :]
+        for _ in range(size // len(body)):
+            f.write(body)
+    MINIO.fput_object("test_csv", s3_object, str(path))
+    path.unlink()
+
+    try:
+        times = {}
+        counts = {}
+        for mode, workers in [("sequential", 1), ("parallel", 8)]:
+            repository = Repository("test", "csv_" + mode)
+            start = time.perf_counter()
+            _load_parallel_csv(local_engine_empty, repository, s3_object, parallel_workers=workers)
+            times[mode] = time.perf_counter() - start
+            with repository.images["latest"].query_schema() as s:
+                counts[mode] = local_engine_empty.run_sql_in(
+                    s, "SELECT COUNT(1) FROM data", return_shape=ResultShape.ONE_ONE
+                )
+        print(
+            "Loading a %.1fGB CSV file: sequential %.3fs, parallel %.3fs (%.1fx)"
+            % (
+                size / 1024**3,
+                times["sequential"],
+                times["parallel"],
+                times["sequential"] / times["parallel"],
+            )
+        )
+        assert counts["sequential"] == counts["parallel"]
+    finally:
+        MINIO.remove_object("test_csv", s3_object)
+
+
+def _read_fdw_rows(data, column_types, csv_options):
+    fdw = CSVForeignDataWrapper.__new__(CSVForeignDataWrapper)
+    fdw._num_cols = len(column_types)
+    fdw._column_types = column_types
+    return list(fdw._read_stream(BytesIO(data), csv_options))
+
+
+@pytest.fixture
+def use_pandas():
+    if not vectorized.vectorized_csv_available():
+        pytest.skip("pandas not installed")
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "base_df.csv",
+        "encoding-win-1252.csv",
+        "evil_df.csv",
+        "grades.csv",
+        "mac_newlines.csv",
+        "separator_df.csv",
+    ],
+)
+def test_csv_vectorized(use_pandas, filename):
+    with open(os.path.join(INGESTION_RESOURCES_CSV, filename), "rb") as f:
+        data = f.read()
+
+    csv_options, reader = make_csv_reader(BytesIO(data), CSVOptions())
+    sample = list(reader)
+    if not csv_options.header:
+        sample = [[""] * len(sample[0])] + sample
+    column_types = [c.pg_type for c in infer_sg_schema(sample)]
+
+    expected = _read_fdw_rows(data, column_types, CSVOptions())
+    actual = _read_fdw_rows(data, column_types, CSVOptions(vectorized=True))
+
+    # Integer columns get returned as numbers, everything else as strings
+    assert [[v if v is None else str(v) for v in row] for row in actual] == expected
+    for row in actual:
+        for value, pg_type in zip(row, column_types):
+            assert value is None or isinstance(value, int if pg_type == "integer" else str)
+
+
+def test_csv_vectorized_types(use_pandas):
+    data = b"a,b,c,d\n1,1.5,x,01\n,,,\n3,2e3,  z\n4,5,y,4,extra\n\n5,-1,,5\n"
+    column_types = ["integer", "double precision", "character varying", "bigint"]
+    csv_options = CSVOptions(autodetect_header=False, autodetect_dialect=False, vectorized=True)
+
+    assert _read_fdw_rows(data, column_types, csv_options) == [
+        (1, 1.5, "x", "01"),
+        (None, None, None, None),
+        (3, 2000.0, "z", None),
+        (4, 5.0, "y", "4"),
+        (5, -1.0, None, "5"),
+    ]
+
+    # Integer column with values that aren't integers: PostgreSQL will raise an error.
+    assert _read_fdw_rows(b"a\n1\n\n1.5\n", ["integer"], csv_options) == [(1.0,), (1.5,)]
+
+    # Non-numeric values in numeric columns get passed through as strings
+    assert _read_fdw_rows(b"a,b\n1,1\nabc,\n", ["integer", "integer"], csv_options) == [
+        ("1", 1),
+        ("abc", None),
+    ]
+
+
+def test_csv_vectorized_float_precision(use_pandas):
+    values = ["1.0000000000000002", "0.1", "2.2250738585072014e-308", "123456789.12345679"]
+    data = ("a\n" + "\n".join(values) + "\n").encode()
+    csv_options = CSVOptions(autodetect_header=False, autodetect_dialect=False, vectorized=True)
+
+    # Floats are parsed exactly, without losing precision.
+    assert _read_fdw_rows(data, ["double precision"], csv_options) == [(float(v),) for v in values]
+
+
+def test_csv_vectorized_no_pandas(monkeypatch):
+    monkeypatch.setattr(vectorized, "pd", None)
+    assert _read_fdw_rows(b"a,b\n1,\n", ["integer", "integer"], CSVOptions(vectorized=True)) == [
+        ["1", None]
+    ]
+
+
+def test_csv_vectorized_batches(use_pandas):
+    rows = 1000
+    data = "id,value,count,price\n" + "".join(
+        "%d,%d,%d,%d.%d\n" % (i, i * 7 % 1000, i % 13, i % 100, i % 10) for i in range(rows)
+    )
+    column_types = ["integer", "integer", "integer", "double precision"]
+    csv_options = CSVOptions(autodetect_header=False, autodetect_dialect=False)
+
+    _, batches = vectorized.read_csv_batches(
+        BytesIO(data.encode()), csv_options._replace(vectorized=True), column_types, batch_size=300
+    )
+    batches = list(batches)
+    assert [len(b) for b in batches] == [300, 300, 300, 100]
+
+    actual = [row for batch in batches for row in batch]
+    expected = _read_fdw_rows(data.encode(), column_types, csv_options)
+    assert [[str(v) for v in row] for row in actual] == expected
+    assert actual[-1] == (rows - 1, (rows - 1) * 7 % 1000, (rows - 1) % 13, 99.9)
+
+
+@pytest.mark.benchmark
+def test_csv_vectorized_benchmark(use_pandas):
+    rows = 1000000
+    data = "id,value,count,price\n" + "".join(
+        "%d,%d,%d,%d.%d\n" % (i, i * 7 % 1000, i % 13, i % 100, i % 10) for i in range(rows)
+    )
+    column_types = ["integer", "integer", "integer", "double precision"]
+    csv_options = CSVOptions(autodetect_header=False, autodetect_dialect=False)
+
+    times = {}
+    results = {}
+    for mode, options in [
+        ("python", csv_options),
+        ("vectorized", csv_options._replace(vectorized=True)),
+    ]:
+        start = time.perf_counter()
+        results[mode] = _read_fdw_rows(data.encode(), column_types, options)
+        times[mode] = time.perf_counter() - start
+
+    print(
+        "Parsing a %d row CSV file: python %.3fs, vectorized %.3fs (%.1fx)"
+        % (rows, times["python"], times["vectorized"], times["python"] / times["vectorized"])
+    )
+    assert len(results["python"]) == len(results["vectorized"]) == rows
+    assert results["vectorized"][-1] == (rows - 1, (rows - 1) * 7 % 1000, (rows - 1) % 13, 99.9)
+
+
+def test_csv_schema_inference_reservoir():
+    # The first rows of the file look like integers, but the rest don't.
+    data = ("key,value\n" + "".join("%d,%d\n" % (i, i) for i in range(1000))).encode()
+    data += "".join("%d,value_%d\n" % (i, i) for i in range(1000, 10000)).encode()
+    options = {
+        "autodetect_dialect": False,
+        "autodetect_header": False,
+        "schema_inference_rows": 100,
+    }
+
+    table = _get_table_definition(BytesIO(data), options, "data", {})
+    assert [(c["column_name"], c["type_name"]) for c in table["columns"]] == [
+        ("key", "integer"),
+        ("value", "integer"),
+    ]
+
+    table = _get_table_definition(
+        BytesIO(data), {**options, "schema_inference_reservoir": True}, "data", {}
+    )
+    assert [(c["column_name"], c["type_name"]) for c in table["columns"]] == [
+        ("key", "integer"),
+        ("value", "character varying"),
+    ]
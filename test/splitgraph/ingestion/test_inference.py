@@ -1,4 +1,15 @@
-from splitgraph.ingestion.inference import _infer_column_schema
+import random
+import time
+from collections import Counter
+
+import pytest
+
+from splitgraph.ingestion.inference import (
+    _CONVERTERS,
+    _infer_column_schema,
+    infer_sg_schema,
+    reservoir_sample,
+)
 
 
 def test_inference():
@@ -11,3 +22,135 @@ def test_inference():
         _infer_column_schema(["2020-01-01 12:34:56", "2020-01-02 00:00:00.123", ""]) == "timestamp"
     )
     assert _infer_column_schema([""]) == "character varying"
+
+
+def _reference_infer_column_schema(column_sample, ignore_empty_strings=True):
+    # Original implementation that tries every type against the whole column
+    for candidate, converter in _CONVERTERS:
+        try:
+            seen_value = False
+            for c in column_sample:
+                if (c == "" and ignore_empty_strings) or c is None:
+                    continue
+                seen_value = True
+                converter(c)
+            if seen_value:
+                return candidate
+        except (ValueError, TypeError):
+            continue
+    return "character varying"
+
+
+_VALUES = [
+    "",
+    None,
+    "1",
+    "-42",
+    " 7 ",
+    "1_000",
+    "3000000000",
+    "99999999999999999999",
+    "1.5",
+    "1e5",
+    "nan",
+    "inf",
+    "true",
+    "F",
+    "2020-01-01",
+    "2020-01-01 12:34:56",
+    "2020-01-01T12:34:56.123",
+    "12:34:56",
+    "12:34:56.5",
+    "2020-13-01",
+    '{"a": 1}',
+    "{broken",
+    "text",
+]
+
+
+def test_inference_matches_reference():
+    random.seed(0)
+    for _ in range(2000):
+        sample = random.choices(_VALUES, k=random.randint(0, 6))
+        for ignore_empty_strings in [True, False]:
+            assert _infer_column_schema(
+                sample, ignore_empty_strings=ignore_empty_strings
+            ) == _reference_infer_column_schema(
+                sample, ignore_empty_strings=ignore_empty_strings
+            ), sample
+
+
+def test_reservoir_sample():
+    assert reservoir_sample(range(5), 10) == [0, 1, 2, 3, 4]
+    assert reservoir_sample(range(5), 0) == []
+    assert reservoir_sample([], 5) == []
+
+    sample = reservoir_sample(range(100000), 1000, seed=0)
+    assert len(sample) == 1000
+    assert sample == sorted(set(sample))
+    # The sample is spread over the whole range
+    assert sum(1 for s in sample if s >= 50000) == pytest.approx(500, abs=100)
+
+    # Every row has the same chance of getting sampled
+    counts = Counter(r for seed in range(2000) for r in reservoir_sample(range(10), 3, seed=seed))
+    assert all(c == pytest.approx(600, rel=0.2) for c in counts.values())
+    assert len(counts) == 10
+
+
+def test_infer_sg_schema_matches_reference():
+    random.seed(0)
+    columns = 21
+    rows = 1000
+    generators = [
+        lambda: "%d" % random.randint(0, 100000),
+        lambda: "%.2f" % (random.random() * 1000),
+        lambda: "2020-%02d-%02d" % (random.randint(1, 12), random.randint(1, 28)),
+        lambda: "2020-01-01 %02d:%02d:00" % (random.randint(0, 23), random.randint(0, 59)),
+        lambda: random.choice(["true", "false"]),
+        lambda: "value %d" % random.randint(0, 10),
+        # Integers with a few decimals in the middle of the column
+        lambda: "%d" % random.randint(0, 100) if random.random() < 0.99 else "1.5",
+    ]
+    column_samples = [
+        [generators[c % len(generators)]() for _ in range(rows)] for c in range(columns)
+    ]
+    sample = [["col_%d" % i for i in range(columns)]] + [list(r) for r in zip(*column_samples)]
+
+    assert [c.pg_type for c in infer_sg_schema(sample)] == [
+        _reference_infer_column_schema(c) for c in column_samples
+    ]
+
+
+@pytest.mark.benchmark
+def test_inference_benchmark():
+    random.seed(0)
+    columns = 500
+    rows = 10000
+    generators = [
+        lambda: "%d" % random.randint(0, 100000),
+        lambda: "%.2f" % (random.random() * 1000),
+        lambda: "2020-%02d-%02d" % (random.randint(1, 12), random.randint(1, 28)),
+        lambda: "2020-01-01 %02d:%02d:00" % (random.randint(0, 23), random.randint(0, 59)),
+        lambda: random.choice(["true", "false"]),
+        lambda: "value %d" % random.randint(0, 10),
+        # Integers with a few decimals in the middle of the column
+        lambda: "%d" % random.randint(0, 100) if random.random() < 0.999 else "1.5",
+    ]
+    column_samples = [
+        [generators[c % len(generators)]() for _ in range(rows)] for c in range(columns)
+    ]
+    sample = [["col_%d" % i for i in range(columns)]] + [list(r) for r in zip(*column_samples)]
+
+    start = time.perf_counter()
+    expected = [_reference_infer_column_schema(c) for c in column_samples]
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [c.pg_type for c in infer_sg_schema(sample)]
+    inference_time = time.perf_counter() - start
+
+    print(
+        "Inferring the schema of %d columns, %d rows: reference %.3fs, current %.3fs (%.1fx)"
+        % (columns, rows, reference_time, inference_time, reference_time / inference_time)
+    )
+    assert actual == expected
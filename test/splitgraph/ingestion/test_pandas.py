@@ -1,5 +1,9 @@
 import contextlib
+import csv
+import decimal
 import os
+import time
+import tracemalloc
 from datetime import datetime as dt
 from io import StringIO
 
@@ -8,7 +12,13 @@ import pytest
 from splitgraph.core.types import TableColumn
 
 with contextlib.suppress(ImportError):
-    from splitgraph.ingestion.pandas import df_to_table, sql_to_df
+    from splitgraph.ingestion import pandas as pandas_module
+    from splitgraph.ingestion.pandas import (
+        _concat_chunks,
+        _DataFrameCSVStream,
+        df_to_table,
+        sql_to_df,
+    )
 
     # If Pandas isn't installed, pytest will skip these tests
     # (see pytest.importorskip).
@@ -291,3 +301,135 @@ def test_pandas_kv(ingestion_test_repo):
             data=[(1, "banana"), (2, "kumquat"), (3, "pendulum")], columns=["key", "value"]
         ),
     )
+
+
+def _reference_df_to_csv(df):
+    # Original implementation of df_to_table_fast that serializes the whole dataframe at once.
+    csv_str = df.to_csv(
+        header=False, index=df.index.names != [None], escapechar="\\", quoting=csv.QUOTE_ALL
+    )
+    return csv_str.replace('""', "")
+
+
+def _read_stream(stream, size):
+    result = []
+    while True:
+        data = stream.read(size)
+        if not data:
+            return "".join(result)
+        result.append(data)
+
+
+def test_pandas_csv_stream():
+    evil_df = _str_to_df(load_csv("evil_df.csv"), has_ts=False)
+    kv_df = pd.read_csv(os.path.join(INGESTION_RESOURCES_CSV, "base_df_kv.csv"))
+    for df in [base_df, upd_df_1, evil_df, kv_df, base_df.iloc[:0]]:
+        for chunk_size in [1, 2, 100]:
+            # Timestamps are formatted per chunk: pandas drops the time if all timestamps
+            # in the chunk are at midnight (PG parses them back into the same values).
+            expected = "".join(
+                _reference_df_to_csv(df.iloc[i : i + chunk_size])
+                for i in range(0, len(df), chunk_size)
+            )
+            if chunk_size >= len(df) or "timestamp" not in df.columns:
+                assert expected == _reference_df_to_csv(df)
+            for read_size in [1, 7, 8192]:
+                stream = _DataFrameCSVStream(df, chunk_size)
+                assert _read_stream(stream, read_size) == expected
+            assert _DataFrameCSVStream(df, chunk_size).read() == expected
+
+
+def test_pandas_concat_chunks():
+    rows = [
+        (None, None, None, None, None),
+        (None, None, None, None, None),
+        (1, 1.5, "a", dt(2020, 1, 1), decimal.Decimal("1.5")),
+        (2, None, "b", None, None),
+        (3, 2.5, None, dt(2020, 1, 2), decimal.Decimal("2.5")),
+    ]
+    columns = ["a", "b", "c", "d", "e"]
+    expected = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    for chunk_size in [1, 2, 3, 5]:
+        chunks = [
+            pd.DataFrame.from_records(rows[i : i + chunk_size], columns=columns, coerce_float=True)
+            for i in range(0, len(rows), chunk_size)
+        ]
+        assert_frame_equal(_concat_chunks(iter(chunks), ignore_index=True), expected)
+
+        # Chunks with an index (when the query is read with index_col)
+        index = ["row_%d" % i for i in range(len(rows))]
+        chunks = [
+            chunk.set_axis(index[i : i + chunk_size], axis=0)
+            for i, chunk in zip(range(0, len(rows), chunk_size), chunks)
+        ]
+        assert_frame_equal(
+            _concat_chunks(chunks, ignore_index=False), expected.set_axis(index, axis=0)
+        )
+
+    assert _concat_chunks([], ignore_index=True) is None
+
+
+def test_pandas_read_chunked(ingestion_test_repo, monkeypatch):
+    df_to_table(base_df, ingestion_test_repo, "test_table", if_exists="patch")
+    ingestion_test_repo.commit()
+    monkeypatch.setattr(pandas_module, "READ_CHUNK_SIZE", 3)
+
+    for query in [
+        "SELECT * FROM test_table",
+        # Integer column with NULLs in some chunks
+        "SELECT *, CASE WHEN fruit_id > 3 THEN fruit_id END AS maybe_id FROM test_table",
+        # No rows
+        "SELECT * FROM test_table WHERE fruit_id > 100",
+    ]:
+        output = sql_to_df(query, repository=ingestion_test_repo, index_col="fruit_id")
+        expected = sql_to_df(
+            query, repository=ingestion_test_repo, index_col="fruit_id", chunksize=100
+        )
+        assert_frame_equal(pd.concat(list(expected)), output)
+    assert_frame_equal(
+        base_df,
+        sql_to_df("SELECT * FROM test_table", repository=ingestion_test_repo, index_col="fruit_id"),
+    )
+
+
+@pytest.mark.benchmark
+def test_pandas_csv_stream_benchmark():
+    rows = 200000
+    df = pd.DataFrame(
+        {
+            "key": range(rows),
+            "value": ["value_%d" % i for i in range(rows)],
+            "number": [i / 7 for i in range(rows)],
+        }
+    )
+
+    def _consume(stream):
+        # Mimic copy_expert reading the buffer in 8KB chunks
+        while stream.read(8192):
+            pass
+
+    results = {}
+    for mode, make_stream in [
+        ("reference", lambda: StringIO(_reference_df_to_csv(df))),
+        ("streaming", lambda: _DataFrameCSVStream(df, pandas_module.WRITE_CHUNK_SIZE)),
+    ]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        _consume(make_stream())
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[mode] = (elapsed, peak)
+
+    print(
+        "Serializing a %d row dataframe: reference %.3fs, %.1fMB peak, "
+        "streaming %.3fs, %.1fMB peak (%.1fx less memory)"
+        % (
+            rows,
+            results["reference"][0],
+            results["reference"][1] / 1024**2,
+            results["streaming"][0],
+            results["streaming"][1] / 1024**2,
+            results["reference"][1] / results["streaming"][1],
+        )
+    )
@@ -0,0 +1,159 @@
+import random
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from splitgraph.core.indexing.stats import (
+    HISTOGRAM_BUCKETS,
+    _hll_registers,
+    build_column_stats,
+    estimate_distinct,
+    estimate_selectivity,
+    get_column_stats_columns,
+)
+from splitgraph.core.types import TableColumn
+
+
+def _hll_values(hashes):
+    # Mimic the values that the HyperLogLog aggregate returns for 64-bit hashes
+    result = set()
+    for value_hash in hashes:
+        bits = (value_hash >> 6) & ((1 << 58) - 1)
+        result.add((value_hash & 63) * 64 + (59 - bits.bit_length()))
+    return sorted(result)
+
+
+@pytest.mark.parametrize("distinct", [0, 1, 10, 100, 1000, 100000])
+def test_hll_estimate(distinct):
+    random.seed(0)
+    hashes = [random.getrandbits(64) for _ in range(distinct)]
+    # Duplicate values don't change the estimate
+    registers = _hll_registers(_hll_values(hashes + hashes[: distinct // 2]))
+    assert estimate_distinct(registers) == pytest.approx(distinct, rel=0.3, abs=1)
+
+
+def test_build_column_stats():
+    stats = build_column_stats(
+        ["key", "value", "data"],
+        [
+            0,
+            _hll_values([1, 2, 3]),
+            [1, 2, 3, 4, 5, 6, 7, 8, 9],
+            5,
+            None,
+            None,
+            2,
+            _hll_values([4]),
+            None,
+        ],
+    )
+    assert stats["key"]["nulls"] == 0
+    assert stats["key"]["histogram"] == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert estimate_distinct(_hll_registers(_hll_values([1, 2, 3]))) == pytest.approx(3, abs=1)
+
+    # Column that only has NULLs
+    assert stats["value"]["nulls"] == 5
+    assert "histogram" not in stats["value"]
+
+    # Column whose values can't be compared
+    assert stats["data"]["nulls"] == 2
+    assert "histogram" not in stats["data"]
+
+
+def _make_stats(nulls, distinct, histogram):
+    random.seed(0)
+    hll = _hll_values(random.getrandbits(64) for _ in range(distinct))
+    return build_column_stats(["col"], [nulls, hll, histogram])
+
+
+_COLUMN_TYPES = {"col": "integer", "other": "integer"}
+
+
+def test_estimate_selectivity_equality():
+    # 1000 rows, 100 distinct values, no NULLs
+    stats = _make_stats(0, 100, list(range(0, 1001, 1000 // HISTOGRAM_BUCKETS)))
+
+    assert estimate_selectivity(stats, 1000, [[("col", "=", 500)]], _COLUMN_TYPES) == pytest.approx(
+        0.01, rel=0.3
+    )
+    assert estimate_selectivity(
+        stats, 1000, [[("col", "<>", 500)]], _COLUMN_TYPES
+    ) == pytest.approx(0.99, rel=0.05)
+    # Values outside of the histogram don't match
+    assert estimate_selectivity(stats, 1000, [[("col", "=", 5000)]], _COLUMN_TYPES) == 0
+    assert estimate_selectivity(stats, 1000, [[("col", "=", -1)]], _COLUMN_TYPES) == 0
+
+    # Two equalities OR'd together
+    assert estimate_selectivity(
+        stats, 1000, [[("col", "=", 500), ("col", "=", 501)]], _COLUMN_TYPES
+    ) == pytest.approx(0.02, rel=0.3)
+
+
+def test_estimate_selectivity_range():
+    stats = _make_stats(200, 100, [0, 10, 20, 30, 40, 50, 60, 70, 80])
+
+    # 20% of the rows are NULLs, so at most 80% rows can match the range.
+    assert estimate_selectivity(stats, 1000, [[("col", ">=", 0)]], _COLUMN_TYPES) == 0.8
+    assert estimate_selectivity(stats, 1000, [[("col", "<", 0)]], _COLUMN_TYPES) == 0
+    assert estimate_selectivity(stats, 1000, [[("col", ">", 100)]], _COLUMN_TYPES) == 0
+    assert estimate_selectivity(stats, 1000, [[("col", "<", 25)]], _COLUMN_TYPES) == 0.25
+    assert estimate_selectivity(stats, 1000, [[("col", ">", 25)]], _COLUMN_TYPES) == 0.55
+
+    # Independent clauses are multiplied together
+    assert estimate_selectivity(
+        stats, 1000, [[("col", ">", 25)], [("col", "<", 25)]], _COLUMN_TYPES
+    ) == pytest.approx(0.55 * 0.25)
+
+
+def test_estimate_selectivity_types():
+    stats = build_column_stats(
+        ["d", "n"],
+        [
+            0,
+            [],
+            [date(2020, 1, i + 1) for i in range(9)],
+            0,
+            [],
+            [Decimal("%d.5" % i) for i in range(9)],
+        ],
+    )
+    column_types = {"d": "date", "n": "numeric(10,2)"}
+    assert stats["d"]["histogram"][0] == "2020-01-01"
+    assert estimate_selectivity(stats, 100, [[("d", "<", "2020-01-03")]], column_types) == 0.1875
+    assert (
+        estimate_selectivity(stats, 100, [[("d", "<", date(2020, 1, 3))]], column_types) == 0.1875
+    )
+    assert estimate_selectivity(stats, 100, [[("n", ">", 9)]], column_types) == 0
+
+    # Values that can't be compared to the histogram: can't make a judgement
+    assert estimate_selectivity(stats, 100, [[("d", "<", "yesterday")]], column_types) == 1
+
+
+def test_estimate_selectivity_unknown():
+    stats = _make_stats(0, 100, list(range(9)))
+
+    # No statistics
+    assert estimate_selectivity(None, 1000, [[("col", "=", 5)]], _COLUMN_TYPES) == 1
+    assert estimate_selectivity({}, 1000, [[("col", "=", 5)]], _COLUMN_TYPES) == 1
+    assert estimate_selectivity(stats, 0, [[("col", "=", 5)]], _COLUMN_TYPES) == 1
+    # No quals
+    assert estimate_selectivity(stats, 1000, [], _COLUMN_TYPES) == 1
+    # Column without statistics
+    assert estimate_selectivity(stats, 1000, [[("other", "=", 5)]], _COLUMN_TYPES) == 1
+    # Operators that we can't estimate
+    assert estimate_selectivity(stats, 1000, [[("col", "~~", "5%")]], _COLUMN_TYPES) == 1
+    # OR with a clause we can't estimate
+    assert (
+        estimate_selectivity(stats, 1000, [[("col", "=", 5), ("other", "=", 5)]], _COLUMN_TYPES)
+        == 1
+    )
+
+
+def test_column_stats_columns():
+    schema = [
+        TableColumn(1, "key", "integer", True),
+        TableColumn(2, "value", "character varying", False),
+        TableColumn(3, "data", "jsonb", False),
+    ]
+    assert get_column_stats_columns(schema, ["data", "key", "unknown"]) == ["key", "data"]
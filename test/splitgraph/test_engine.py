@@ -1,3 +1,5 @@
+import threading
+import time
 from io import StringIO
 from test.splitgraph.conftest import SPLITGRAPH_ENGINE_CONTAINER
 from unittest import mock
@@ -7,6 +9,7 @@ import docker
 import psycopg2
 import pytest
 from packaging.version import Version
+from psycopg2.sql import SQL, Identifier
 
 from splitgraph.__version__ import __version__
 from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
@@ -20,7 +23,7 @@ from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository
 from splitgraph.engine import ResultShape
 from splitgraph.engine.config import _prepare_engine_config
-from splitgraph.engine.postgres.engine import PostgresEngine
+from splitgraph.engine.postgres.engine import PostgresEngine, _CopyPipe
 from splitgraph.engine.postgres.psycopg import (
     _API_VERSION,
     PsycopgEngine,
@@ -29,6 +32,8 @@ from splitgraph.engine.postgres.psycopg import (
 from splitgraph.exceptions import (
     APICompatibilityError,
     EngineInitializationError,
+    IncompleteObjectDownloadError,
+    IncompleteObjectUploadError,
     ObjectNotFoundError,
 )
 
@@ -431,3 +436,204 @@ def test_rename_object(pg_repo_local):
         pg_repo_local.engine.run_sql("SELECT * FROM splitgraph_meta." + tested_object)
 
     pg_repo_local.engine.run_sql("SELECT * FROM splitgraph_meta.renamed_object")
+
+
+def test_copy_pipe():
+    pipe = _CopyPipe(max_size=10)
+    chunks = [bytes([i]) * 7 for i in range(100)]
+
+    def _writer():
+        for c in chunks:
+            pipe.write(c)
+        pipe.close()
+
+    writer = threading.Thread(target=_writer)
+    writer.start()
+
+    result = b""
+    while True:
+        data = pipe.read(3)
+        if not data:
+            break
+        assert len(data) <= 3
+        result += data
+    writer.join()
+
+    assert result == b"".join(chunks)
+    assert pipe.total_size == 700
+    # The writer blocks until the buffer has been drained below its maximum size
+    assert pipe.peak_size <= 10 + 7
+
+
+def test_copy_pipe_errors():
+    # If the writer fails, the reader shouldn't see an EOF.
+    pipe = _CopyPipe()
+    pipe.write(b"some data")
+    pipe.close(error=ValueError("writer failed"))
+    with pytest.raises(IOError):
+        pipe.read()
+
+    # If the reader stops reading, the writer gets unblocked.
+    pipe = _CopyPipe(max_size=1)
+    pipe.write(b"some data")
+    pipe.close()
+    with pytest.raises(BrokenPipeError):
+        pipe.write(b"more data")
+
+
+def test_download_objects_streaming(local_engine_empty, pg_repo_remote):
+    objects = pg_repo_remote.objects.get_all_objects()
+    assert len(objects) > 1
+    missing_object = "o" + "0" * 62
+
+    with pytest.raises(IncompleteObjectDownloadError) as e:
+        local_engine_empty.download_objects(
+            objects + [missing_object], pg_repo_remote.object_engine, threads=2
+        )
+    assert sorted(e.value.successful_objects) == sorted(objects)
+
+    for object_id in objects:
+        assert local_engine_empty.run_sql(
+            SQL("SELECT * FROM {}.{}").format(
+                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+            )
+        ) == pg_repo_remote.object_engine.run_sql(
+            SQL("SELECT * FROM {}.{}").format(
+                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+            )
+        )
+
+
+def test_upload_objects_partial_failure():
+    engine = PostgresEngine(pool=mock.Mock(), name="test_engine")
+    with mock.patch(
+        "splitgraph.engine.postgres.engine._stream_objects", return_value=["o1", "o3"]
+    ) as stream_objects:
+        with pytest.raises(IncompleteObjectUploadError) as e:
+            engine.upload_objects(["o1", "o2", "o3"], mock.Mock(), threads=2)
+    assert stream_objects.call_count == 1
+    assert e.value.successful_objects == ["o1", "o3"]
+    # Objects uploaded straight into the remote engine don't get an external location.
+    assert e.value.successful_object_urls == [None, None]
+
+
+_APPLY_SCHEMA = "test_apply_fragments"
+
+
+def _make_fragment_chain(engine, patches, rows, changes):
+    # Make a base fragment and a chain of patches that update, delete and insert random rows.
+    engine.delete_schema(_APPLY_SCHEMA)
+    engine.create_schema(_APPLY_SCHEMA)
+    engine.run_sql(
+        SQL(
+            "CREATE TABLE {}.fragment_0 AS SELECT key, md5(key::text) AS value, "
+            "key % 100 AS number, true AS sg_ud_flag FROM generate_series(1, %s) key"
+        ).format(Identifier(_APPLY_SCHEMA)),
+        (rows,),
+    )
+    for i in range(1, patches + 1):
+        engine.run_sql(
+            SQL(
+                "CREATE TABLE {}.{} AS SELECT key, md5(key::text || %s) AS value, "
+                "(random() * 100)::integer AS number, random() > 0.2 AS sg_ud_flag "
+                "FROM (SELECT DISTINCT (random() * %s)::integer + 1 AS key "
+                "FROM generate_series(1, %s)) k"
+            ).format(Identifier(_APPLY_SCHEMA), Identifier("fragment_%d" % i)),
+            (str(i), int(rows * 1.1), changes),
+        )
+    return [(_APPLY_SCHEMA, "fragment_%d" % i) for i in range(patches + 1)]
+
+
+def _apply_chain(engine, objects, target, **kwargs):
+    engine.run_sql(
+        SQL("CREATE TABLE {}.{} (key integer PRIMARY KEY, value varchar, number integer)").format(
+            Identifier(_APPLY_SCHEMA), Identifier(target)
+        )
+    )
+    engine.apply_fragments(objects, _APPLY_SCHEMA, target, **kwargs)
+    return engine.run_sql(
+        SQL("SELECT * FROM {}.{} ORDER BY key").format(
+            Identifier(_APPLY_SCHEMA), Identifier(target)
+        )
+    )
+
+
+@pytest.mark.parametrize("use_quals", [False, True])
+def test_apply_fragments_bulk(local_engine_empty, use_quals):
+    objects = _make_fragment_chain(local_engine_empty, patches=10, rows=100, changes=30)
+    kwargs = {"extra_quals": SQL("number > %s"), "extra_qual_args": (50,)} if use_quals else {}
+
+    try:
+        expected = _apply_chain(
+            local_engine_empty, objects, "sequential", strategy="sequential", **kwargs
+        )
+        assert expected
+
+        assert (
+            _apply_chain(local_engine_empty, objects, "bulk", strategy="bulk", **kwargs) == expected
+        )
+
+        # Apply the chain in batches as well (that's what happens when we report progress)
+        assert (
+            _apply_chain(
+                local_engine_empty,
+                objects,
+                "bulk_batches",
+                strategy="bulk",
+                progress_every=3,
+                **kwargs
+            )
+            == expected
+        )
+
+        # Apply on top of existing rows
+        local_engine_empty.apply_fragments(
+            objects[5:], _APPLY_SCHEMA, "sequential", strategy="sequential", **kwargs
+        )
+        local_engine_empty.apply_fragments(
+            objects[5:], _APPLY_SCHEMA, "bulk", strategy="bulk", **kwargs
+        )
+        assert local_engine_empty.run_sql(
+            SQL("SELECT * FROM {}.bulk ORDER BY key").format(Identifier(_APPLY_SCHEMA))
+        ) == local_engine_empty.run_sql(
+            SQL("SELECT * FROM {}.sequential ORDER BY key").format(Identifier(_APPLY_SCHEMA))
+        )
+
+        with pytest.raises(ValueError):
+            local_engine_empty.apply_fragments(
+                objects, _APPLY_SCHEMA, "bulk", strategy="unknown", **kwargs
+            )
+    finally:
+        local_engine_empty.delete_schema(_APPLY_SCHEMA)
+        local_engine_empty.commit()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("patches", [10, 100, 1000])
+def test_apply_fragments_bulk_benchmark(local_engine_empty, patches):
+    objects = _make_fragment_chain(local_engine_empty, patches=patches, rows=100000, changes=1000)
+    local_engine_empty.commit()
+
+    try:
+        timings = {}
+        results = {}
+        for strategy in ["sequential", "bulk"]:
+            start = time.perf_counter()
+            results[strategy] = _apply_chain(
+                local_engine_empty, objects, strategy, strategy=strategy
+            )
+            timings[strategy] = time.perf_counter() - start
+
+        print(
+            "Applying %d patches: sequential %.3fs, bulk %.3fs (%.1fx)"
+            % (
+                patches,
+                timings["sequential"],
+                timings["bulk"],
+                timings["sequential"] / timings["bulk"],
+            )
+        )
+        assert results["sequential"] == results["bulk"]
+    finally:
+        local_engine_empty.delete_schema(_APPLY_SCHEMA)
+        local_engine_empty.commit()
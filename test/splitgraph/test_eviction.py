@@ -0,0 +1,236 @@
+import os
+from datetime import datetime as dt
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import pytest
+
+from splitgraph.core.eviction import (
+    EVICTION_POLICIES,
+    CacheEntry,
+    EvictionState,
+    EvictionWorker,
+    GhostEntry,
+    TraceEntry,
+    get_eviction_policy,
+    load_trace,
+    select_evicted_objects,
+    simulate,
+    trim_ghosts,
+)
+from splitgraph.exceptions import ObjectCacheError
+
+_NOW = dt(2020, 1, 1, 12, 0, 0)
+_MB = 1024 * 1024
+
+
+def _entry(object_id, size, seconds_ago, access_count=1, clock=0.0):
+    return CacheEntry(object_id, size, _NOW - timedelta(seconds=seconds_ago), access_count, clock)
+
+
+_ENTRIES = [
+    # Large, used a while ago, used once
+    _entry("o1", 10 * _MB, 600),
+    # Small, used recently, used a lot
+    _entry("o2", 1 * _MB, 10, access_count=10),
+    # Medium, used very recently, used once
+    _entry("o3", 5 * _MB, 1),
+    # Medium, used a while ago, used a lot
+    _entry("o4", 5 * _MB, 300, access_count=5),
+]
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        # Small objects are cheap to redownload; the large object was used long enough
+        # ago to be evicted before the medium-sized objects.
+        ("decay", ["o2", "o4", "o1", "o3"]),
+        ("lru", ["o1", "o4", "o2", "o3"]),
+        ("lfu", ["o1", "o3", "o4", "o2"]),
+        # Without the clock, large objects that were used once go first.
+        ("gdsf", ["o1", "o3", "o4", "o2"]),
+        # By default, the "used once" part of the cache has a target size of 0,
+        # so objects that were used once get evicted first.
+        ("arc", ["o1", "o3", "o4", "o2"]),
+    ],
+)
+def test_eviction_policy_order(policy, expected):
+    eviction_policy = get_eviction_policy(policy, decay_constant=0.002, floor=_MB)
+    assert [e.object_id for e in eviction_policy.order(_ENTRIES, _NOW, EvictionState())] == expected
+
+
+def test_eviction_policy_unknown():
+    with pytest.raises(ObjectCacheError) as e:
+        get_eviction_policy("mru", decay_constant=0.002, floor=_MB)
+    assert "Unknown eviction policy mru" in str(e.value)
+
+
+def test_select_evicted_objects():
+    policy = get_eviction_policy("lru", decay_constant=0.002, floor=_MB)
+    evicted, freed_space = select_evicted_objects(policy, _ENTRIES, _NOW, EvictionState(), 12 * _MB)
+    assert [e.object_id for e in evicted] == ["o1", "o4"]
+    assert freed_space == 15 * _MB
+
+    evicted, freed_space = select_evicted_objects(policy, _ENTRIES, _NOW, EvictionState(), 0)
+    assert evicted == []
+    assert freed_space == 0
+
+
+def test_gdsf_clock():
+    policy = get_eviction_policy("gdsf", decay_constant=0.002, floor=_MB)
+    state = policy.on_evict([_ENTRIES[0], _ENTRIES[2]], _NOW, EvictionState())
+    # Priority of the evicted objects is their frequency multiplied by the fetch cost per byte
+    assert state.clock == pytest.approx(0.2)
+
+    # Objects that were used after the eviction get their priority inflated by the clock,
+    # so that objects that were used a lot a long time ago eventually get evicted.
+    new_entry = _entry("o5", 5 * _MB, 0, clock=state.clock)
+    assert [e.object_id for e in policy.order([new_entry, _ENTRIES[3]], _NOW, state)] == [
+        "o5",
+        "o4",
+    ]
+    new_entry = new_entry._replace(access_count=5)
+    assert [e.object_id for e in policy.order([new_entry, _ENTRIES[3]], _NOW, state)] == [
+        "o4",
+        "o5",
+    ]
+
+
+def test_gdsf_size():
+    policy = get_eviction_policy("gdsf", decay_constant=0.002, floor=_MB)
+
+    # A small object outranks a large object that's used as often, since it frees less space
+    # for the same cost of redownloading it.
+    small = _entry("small", _MB, 10, access_count=3)
+    large = _entry("large", 10 * _MB, 10, access_count=3)
+    assert policy.priority(small, _NOW) > policy.priority(large, _NOW)
+    assert [e.object_id for e in policy.order([small, large], _NOW, EvictionState())] == [
+        "large",
+        "small",
+    ]
+
+    # The large object needs to be used 10x as often to be kept over the small one.
+    large = large._replace(access_count=31)
+    assert [e.object_id for e in policy.order([small, large], _NOW, EvictionState())] == [
+        "small",
+        "large",
+    ]
+
+
+def test_arc_adaptation():
+    policy = get_eviction_policy("arc", decay_constant=0.002, floor=_MB)
+    state = EvictionState()
+
+    # An object that was evicted after being used once is requested again: grow
+    # the "used once" part of the cache.
+    state = policy.on_ghost_hit(GhostEntry("o5", 5 * _MB, 1), (5 * _MB, 10 * _MB), 20 * _MB, state)
+    assert state.arc_target == 10 * _MB
+
+    # Now objects that were used several times are evicted first, as long as
+    # the objects that were used once fit into the target.
+    assert [e.object_id for e in policy.order(_ENTRIES, _NOW, state)] == ["o1", "o4", "o2", "o3"]
+
+    # Target never exceeds the cache size
+    state = policy.on_ghost_hit(GhostEntry("o6", 15 * _MB, 1), (5 * _MB, 10 * _MB), 20 * _MB, state)
+    assert state.arc_target == 20 * _MB
+
+    # Object that was used multiple times is requested again: shrink the target.
+    state = policy.on_ghost_hit(GhostEntry("o7", 5 * _MB, 3), (20 * _MB, 5 * _MB), 20 * _MB, state)
+    assert state.arc_target == 0
+
+
+def test_trim_ghosts():
+    ghosts = [GhostEntry("o%d" % i, _MB, 1) for i in range(5)]
+    assert trim_ghosts(ghosts, 3 * _MB) == ghosts[2:]
+    assert trim_ghosts(ghosts, 10 * _MB) == ghosts
+    assert trim_ghosts(ghosts, 0) == []
+
+
+def _make_trace():
+    # A hot set of 4 objects that keep getting used, interleaved with scans through
+    # 4 objects that are only ever used once.
+    trace = []
+    time = _NOW
+    for i in range(20):
+        for object_id in ["hot_%d" % j for j in range(4)] + [
+            "scan_%d_%d" % (i, j) for j in range(4)
+        ]:
+            time += timedelta(seconds=1)
+            trace.append(TraceEntry(time, object_id, _MB))
+    return trace
+
+
+def test_simulate():
+    trace = _make_trace()
+    results = {
+        policy: simulate(trace, policy, cache_size=6 * _MB, floor=_MB)
+        for policy in EVICTION_POLICIES
+    }
+
+    for result in results.values():
+        assert result.requests == 160
+        assert result.bytes_downloaded == (result.requests - result.hits) * _MB
+
+    # LRU and the decay heuristic (all objects are the same size) keep evicting
+    # the hot set to make room for the scan.
+    assert results["lru"].hits == 0
+    assert results["decay"].hits == 0
+
+    # Frequency-aware policies keep the hot set in the cache.
+    for policy in ("lfu", "gdsf", "arc"):
+        assert results[policy].hits >= 60
+        assert results[policy].hit_rate > 0.35
+
+
+def test_simulate_large_objects():
+    trace = [TraceEntry(_NOW, "o1", 10 * _MB), TraceEntry(_NOW, "o1", 10 * _MB)]
+    result = simulate(trace, "lru", cache_size=5 * _MB)
+    assert result.hits == 0
+    assert result.bytes_downloaded == 20 * _MB
+
+
+def test_load_trace():
+    trace = _make_trace()
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "trace.csv")
+        with open(path, "w") as f:
+            for entry in trace:
+                f.write("%s,%s,%d\n" % (entry.timestamp.isoformat(), entry.object_id, entry.size))
+        assert load_trace(path) == trace
+
+
+def test_eviction_worker():
+    object_manager = mock.MagicMock()
+    object_manager.evict_to_watermark.side_effect = [0, 10 * _MB, Exception("Oops"), 5 * _MB]
+    object_manager.get_cache_occupancy.return_value = 75 * _MB
+
+    worker = EvictionWorker(object_manager, high_watermark=0.9, low_watermark=0.75, interval=0)
+    seen_checks = []
+    worker.run(max_checks=4, callback=lambda m: seen_checks.append(m.checks))
+
+    assert object_manager.evict_to_watermark.mock_calls == [mock.call(0.9, 0.75)] * 4
+    assert seen_checks == [1, 2, 2, 3]
+    object_manager.object_engine.rollback.assert_called_once_with()
+
+    metrics = worker.metrics.as_dict()
+    assert metrics["checks"] == 3
+    assert metrics["evictions"] == 2
+    assert metrics["errors"] == 1
+    assert metrics["bytes_freed"] == 15 * _MB
+    assert metrics["last_occupancy"] == 75 * _MB
+    assert metrics["max_eviction_time"] >= metrics["last_eviction_time"]
+
+
+def test_eviction_worker_stop():
+    object_manager = mock.MagicMock()
+    worker = EvictionWorker(object_manager, high_watermark=0.9, low_watermark=0.75, interval=0)
+    object_manager.evict_to_watermark.side_effect = lambda *args: worker.stop() or 0
+    worker.run()
+    assert worker.metrics.checks == 1
+
+
+def test_eviction_worker_invalid_watermarks():
+    with pytest.raises(ValueError):
+        EvictionWorker(mock.MagicMock(), high_watermark=0.5, low_watermark=0.75, interval=0)
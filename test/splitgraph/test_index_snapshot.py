@@ -0,0 +1,211 @@
+import base64
+from datetime import date
+from datetime import datetime as dt
+from decimal import Decimal
+
+import pytest
+
+from splitgraph.core.indexing import bloom as bloom_module
+from splitgraph.core.indexing.bloom import (
+    _bloom_probe,
+    _hash_value,
+    _prepare_bloom_quals,
+    build_bloom_index,
+)
+from splitgraph.core.indexing.snapshot import IndexSnapshot, UnsupportedQualError
+
+_COLUMN_TYPES = {
+    "key": "integer",
+    "value": "character varying(10)",
+    "price": "numeric(10,2)",
+    "created": "date",
+    "updated": "timestamp",
+    "data": "jsonb",
+}
+
+_OBJECT_IDS = ["o1", "o2", "o3", "o4"]
+
+_INDEXES = [
+    {
+        "range": {
+            "key": [1, 10],
+            "value": ["apple", "cherry"],
+            "price": [1.5, 10.25],
+            "created": ["2020-01-01", "2020-01-31"],
+            "updated": ["2020-01-01 00:00:00", "2020-01-31 12:00:00"],
+            "data": [{"a": 1}, {"a": 2}],
+        }
+    },
+    {
+        "range": {
+            "key": [11, 20],
+            "value": ["date", "fig"],
+            "price": [10.26, 20],
+            "created": ["2020-02-01", "2020-02-29"],
+            "updated": ["2020-02-01 00:00:00", "2020-02-29 12:00:00"],
+        }
+    },
+    # The whole column is NULL
+    {"range": {"key": [21, 30], "value": [None, None]}},
+    # No index at all
+    {},
+]
+
+
+@pytest.fixture
+def snapshot():
+    return IndexSnapshot(_OBJECT_IDS, _COLUMN_TYPES, _INDEXES)
+
+
+@pytest.mark.parametrize(
+    "quals,expected",
+    [
+        ([[("key", "=", 5)]], ["o1", "o4"]),
+        ([[("key", ">", 10)]], ["o2", "o3", "o4"]),
+        ([[("key", ">=", 10)]], ["o1", "o2", "o3", "o4"]),
+        ([[("key", "<", 11)]], ["o1", "o4"]),
+        ([[("key", "<=", 11)]], ["o1", "o2", "o4"]),
+        ([[("key", "=", 5), ("key", "=", 25)]], ["o1", "o3", "o4"]),
+        ([[("key", ">", 5)], [("key", "<", 15)]], ["o1", "o2", "o4"]),
+        # Integer columns get compared to numbers exactly
+        ([[("key", "=", 10.5)]], ["o4"]),
+        ([[("key", "=", "15")]], ["o2", "o4"]),
+        # Comparisons with NULL bounds are always false
+        ([[("value", "=", "banana")]], ["o1", "o4"]),
+        ([[("value", ">", "cherry")]], ["o2", "o4"]),
+        # Objects without index information for a column might match
+        ([[("price", "=", Decimal("10.26"))]], ["o2", "o3", "o4"]),
+        ([[("price", "<=", 1.5)]], ["o1", "o3", "o4"]),
+        ([[("created", "=", date(2020, 2, 2))]], ["o2", "o3", "o4"]),
+        ([[("created", "=", "2020-01-15")]], ["o1", "o3", "o4"]),
+        ([[("updated", ">", dt(2020, 1, 31, 12, 0, 0))]], ["o2", "o3", "o4"]),
+        ([[("updated", "<", "2020-02-01 00:00:00")]], ["o1", "o3", "o4"]),
+        # Operators we can't make a judgement about
+        ([[("value", "~~", "b%")]], _OBJECT_IDS),
+        ([[("key", "=", 5), ("value", "~~", "b%")]], _OBJECT_IDS),
+        ([], _OBJECT_IDS),
+    ],
+)
+def test_snapshot_range_filter(snapshot, quals, expected):
+    assert snapshot.filter_range_index(_OBJECT_IDS, quals) == expected
+
+
+def test_snapshot_range_filter_subset(snapshot):
+    assert snapshot.filter_range_index(["o4", "o2"], [[("key", ">", 10)]]) == ["o4", "o2"]
+    assert snapshot.filter_range_index(["o1"], [[("key", ">", 10)]]) == []
+
+
+@pytest.mark.parametrize(
+    "quals",
+    [
+        # Column of a type that the snapshot doesn't support
+        [[("data", "=", {"a": 1})]],
+        # Unknown column
+        [[("unknown", "=", 1)]],
+        # Values that can't be converted to the column's type
+        [[("key", "=", "abc")]],
+        [[("value", "=", 42)]],
+        [[("created", "=", "yesterday")]],
+        [[("price", "=", float("nan"))]],
+        [[("key", "=", None)]],
+        # One unsupported qual in the whole expression
+        [[("key", "=", 5)], [("data", "=", {"a": 1}), ("key", "=", 6)]],
+    ],
+)
+def test_snapshot_range_filter_unsupported(snapshot, quals):
+    with pytest.raises(UnsupportedQualError):
+        snapshot.filter_range_index(_OBJECT_IDS, quals)
+
+
+def _bloom_index(values, size):
+    return build_bloom_index([_hash_value(v) for v in values], None, "value", size=size)
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def use_numpy(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(bloom_module, "np", None)
+    elif bloom_module.np is None:
+        pytest.skip("NumPy not installed")
+    return request.param
+
+
+def _reference_match(qual, bloom_index):
+    # Check a single fragment's filter one bit at a time.
+    column, hash_1, hash_2 = qual
+    if column not in bloom_index:
+        return True
+    no_funcs, bloom_filter = bloom_index[column]
+    byte_offsets, masks = _bloom_probe(hash_1, hash_2, no_funcs, len(bloom_filter) * 8)
+    return all(bloom_filter[b] & m for b, m in zip(byte_offsets, masks))
+
+
+def _reference_bloom_filter(object_ids, indexes, quals):
+    bloom_quals = _prepare_bloom_quals(quals)
+    result = []
+    for object_id, index in zip(object_ids, indexes):
+        bloom_index = {
+            c: (k, base64.b64decode(f)) for c, (k, f) in (index.get("bloom") or {}).items()
+        }
+        if all(any(_reference_match(q, bloom_index) for q in or_quals) for or_quals in bloom_quals):
+            result.append(object_id)
+    return result
+
+
+def test_snapshot_bloom_filter(use_numpy):
+    letters = [chr(ord("a") + i) for i in range(26)]
+    indexes = [
+        {"bloom": {"value": _bloom_index(letters, size=16)}},
+        {"bloom": {"value": _bloom_index(["x", "y", "z"], size=4)}},
+        # Index on a different column only
+        {"bloom": {"other": _bloom_index(["a"], size=8)}},
+        {},
+        {"bloom": {"value": _bloom_index([str(i) for i in range(100)], size=64)}},
+    ]
+    object_ids = ["o%d" % i for i in range(len(indexes))]
+    snapshot = IndexSnapshot(object_ids, {"value": "text", "other": "text"}, indexes)
+
+    # Same fingerprint as the one produced from the engine
+    # (see test_bloom_indexing.py::test_bloom_index_structure)
+    assert indexes[0]["bloom"]["value"] == (4, "T79jcHurra5T6d8Hk+djZA==")
+
+    def _reference(quals):
+        return _reference_bloom_filter(object_ids, indexes, quals)
+
+    for value in letters + [str(i) for i in range(110)] + ["hello", "world"]:
+        quals = [[("value", "=", value)]]
+        assert snapshot.filter_bloom_index(object_ids, quals) == _reference(quals)
+
+    assert snapshot.filter_bloom_index(object_ids, [[("value", "=", "x")]])[:2] == ["o0", "o1"]
+    assert snapshot.filter_bloom_index(object_ids, [[("value", "=", "50")]]) == ["o2", "o3", "o4"]
+    assert snapshot.filter_bloom_index(
+        object_ids, [[("value", "=", "50"), ("value", "=", "x")]]
+    ) == _reference([[("value", "=", "50"), ("value", "=", "x")]])
+    assert snapshot.filter_bloom_index(object_ids, [[("value", ">", "50")]]) == object_ids
+    assert snapshot.filter_bloom_index(["o4"], [[("value", "=", "50")]]) == ["o4"]
+    assert snapshot.filter_bloom_index([], [[("value", "=", "50")]]) == []
+
+
+def test_snapshot_bloom_filter_in_list(use_numpy):
+    # IN-lists come in as ORs of equalities (see QueryingForeignDataWrapper._quals_to_cnf)
+    # and every value gets checked against all filters.
+    indexes = [
+        {"bloom": {"value": _bloom_index([str(j) for j in range(i * 10, i * 10 + 10)], size=16)}}
+        for i in range(20)
+    ] + [{"bloom": {"value": _bloom_index(["a", "b"], size=i)}} for i in range(1, 5)]
+    object_ids = ["o%d" % i for i in range(len(indexes))]
+    snapshot = IndexSnapshot(object_ids, {"value": "text"}, indexes)
+
+    quals = [[("value", "=", v) for v in ["5", "15", "a"]]]
+    expected = _reference_bloom_filter(object_ids, indexes, quals)
+    assert snapshot.filter_bloom_index(object_ids, quals) == expected
+    assert expected[:2] == ["o0", "o1"]
+    assert expected[-4:] == ["o20", "o21", "o22", "o23"]
+
+    quals = [[("value", "=", str(v)) for v in range(0, 200, 7)], [("value", "=", "42")]]
+    assert snapshot.filter_bloom_index(object_ids, quals) == _reference_bloom_filter(
+        object_ids, indexes, quals
+    )
+    assert snapshot.filter_bloom_index(object_ids[::-1], quals) == _reference_bloom_filter(
+        object_ids[::-1], indexes[::-1], quals
+    )
@@ -1,11 +1,18 @@
+import threading
 from datetime import datetime as dt
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
-from psycopg2.errors import CheckViolation
+from psycopg2.errors import CheckViolation, ReadOnlySqlTransaction
 
 from splitgraph.cloud.models import ExternalTableRequest
-from splitgraph.core.common import Tracer, adapt, coerce_val_to_json
+from splitgraph.core.common import (
+    Tracer,
+    adapt,
+    coerce_val_to_json,
+    run_in_separate_transaction,
+    update_engine_cache,
+)
 from splitgraph.core.engine import lookup_repository
 from splitgraph.core.metadata_manager import Object
 from splitgraph.core.output import parse_dt
@@ -56,6 +63,43 @@ Total: 30.000"""
     )
 
 
+def test_run_in_separate_transaction():
+    engine = MagicMock()
+
+    # The function runs in a different thread (so it gets a separate connection)
+    # that commits straight away.
+    assert run_in_separate_transaction(engine, threading.get_ident) != threading.get_ident()
+    engine.commit.assert_called_once_with()
+    engine.rollback.assert_not_called()
+
+    def _fail():
+        raise ValueError("error")
+
+    engine.reset_mock()
+    with pytest.raises(ValueError):
+        run_in_separate_transaction(engine, _fail)
+    engine.commit.assert_not_called()
+    engine.rollback.assert_called_once_with()
+
+
+def test_update_engine_cache():
+    engine = MagicMock()
+
+    def _fail():
+        raise ReadOnlySqlTransaction("read-only")
+
+    # Cache write errors are logged instead of failing the query
+    update_engine_cache(engine, _fail, "test")
+    engine.rollback.assert_called_once_with()
+
+    # Other errors are still raised
+    def _bug():
+        raise ValueError("error")
+
+    with pytest.raises(ValueError):
+        update_engine_cache(engine, _bug, "test")
+
+
 def test_metadata_constraints_image_hashes(local_engine_empty):
     R = Repository("some", "repo")
     with pytest.raises(CheckViolation):
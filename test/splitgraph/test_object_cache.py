@@ -12,7 +12,7 @@ from unittest import mock
 import pytest
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
-from splitgraph.core.indexing.range import _quals_to_clause
+from splitgraph.core.indexing.range import _quals_to_clause, filter_range_index
 from splitgraph.core.repository import clone
 from splitgraph.core.sql.queries import select
 from splitgraph.engine import ResultShape
@@ -227,6 +227,40 @@ def test_object_cache_eviction_fraction(local_engine_empty, pg_repo_remote, clea
         _assert_cache_occupancy(object_manager, 1)
 
 
+def test_object_cache_eviction_watermarks(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    vegetables_v3 = pg_repo_local.images["latest"].get_table("vegetables")
+
+    with object_manager.ensure_objects(fruits_v3):
+        pass
+    with object_manager.ensure_objects(vegetables_v3):
+        pass
+    _assert_cache_occupancy(object_manager, 4)
+
+    # The cache is almost full
+    occupancy = object_manager.get_cache_occupancy()
+    object_manager.cache_size = occupancy + 100
+
+    # Occupancy is below the high watermark: nothing happens.
+    assert object_manager.evict_to_watermark(high_watermark=1.0, low_watermark=0.6) == 0
+    _assert_cache_occupancy(object_manager, 4)
+
+    # Objects that are in use don't get evicted, even if the low watermark can't be reached.
+    with object_manager.ensure_objects(fruits_v3):
+        with object_manager.ensure_objects(vegetables_v3):
+            assert object_manager.evict_to_watermark(high_watermark=0.9, low_watermark=0.6) == 0
+        _assert_cache_occupancy(object_manager, 4)
+
+        # Vegetables can now be evicted: free the cache down to 60% of its size (2 objects).
+        freed = object_manager.evict_to_watermark(high_watermark=0.9, low_watermark=0.6)
+        assert object_manager.get_cache_occupancy() == occupancy - freed
+        _assert_cache_occupancy(object_manager, 2)
+        assert set(object_manager.get_downloaded_objects()) == set(fruits_v3.objects)
+
+
 def test_object_cache_locally_created_dont_get_evicted(
     local_engine_empty, pg_repo_remote, clean_minio
 ):
@@ -399,6 +433,58 @@ def test_object_cache_eviction_priority(local_engine_empty, pg_repo_remote, clea
         assert "Not enough space will be reclaimed" in str(e.value)
 
 
+def _get_access_count(object_manager, object_id):
+    return object_manager.object_engine.run_sql(
+        select("object_cache_status", "access_count", "object_id = %s"),
+        (object_id,),
+        return_shape=ResultShape.ONE_ONE,
+    )
+
+
+def test_object_cache_eviction_lfu_ghosts(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    object_manager.eviction_policy = "lfu"
+    object_manager.cache_size = SMALL_OBJECT_SIZE * 3 + 300
+
+    fruits_v2 = pg_repo_local.images[pg_repo_local.images["latest"].parent_id].get_table("fruits")
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    vegetables_v3 = pg_repo_local.images["latest"].get_table("vegetables")
+    fruit_snap = fruits_v2.objects[0]
+    fruit_diff = fruits_v3.objects[1]
+
+    with object_manager.ensure_objects(fruits_v3):
+        assert _get_access_count(object_manager, fruit_snap) == 1
+        assert _get_access_count(object_manager, fruit_diff) == 1
+
+    # Use the patch twice more: the base fragment is now used less frequently.
+    for _ in range(2):
+        with object_manager.ensure_objects(table=None, objects=[fruit_diff]):
+            pass
+    assert _get_access_count(object_manager, fruit_diff) == 3
+
+    # Fetch the vegetables: LFU evicts the least frequently used fruit fragment
+    # even though it was used at the same time as the patch.
+    with object_manager.ensure_objects(vegetables_v3):
+        current_objects = object_manager.get_downloaded_objects()
+        assert fruit_snap not in current_objects
+        assert fruit_diff in current_objects
+
+    # The evicted object is remembered in the ghost list
+    assert object_manager.object_engine.run_sql(
+        select("object_cache_ghosts", "object_id,access_count")
+    ) == [(fruit_snap, 1)]
+
+    # Downloading it again restores its access count and removes it from the ghost list.
+    with object_manager.ensure_objects(fruits_v2):
+        assert _get_access_count(object_manager, fruit_snap) == 2
+    assert fruit_snap not in [
+        o[0]
+        for o in object_manager.object_engine.run_sql(select("object_cache_ghosts", "object_id"))
+    ]
+
+
 def test_object_cache_deferred(local_engine_empty, pg_repo_remote, clean_minio):
     # Test object manager with deferred releases (we get given a callback to
     # release objects rather than it being done when we leave the context manager)
@@ -453,6 +539,57 @@ def test_object_cache_deferred(local_engine_empty, pg_repo_remote, clean_minio):
         pass
 
 
+def test_object_cache_prefetch(local_engine_empty, pg_repo_remote, clean_minio):
+    # Test streaming objects (downloading them in the background while they're being used)
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote, longer_chain=True)
+
+    object_manager = pg_repo_local.objects
+    fruits = pg_repo_local.images["latest"].get_table("fruits")
+    assert len(fruits.objects) == 3
+
+    objects, callback = object_manager.prefetch_objects(fruits, fruits.objects, lookahead=1)
+
+    # Nothing gets claimed or downloaded until we start consuming objects
+    assert len(object_manager.get_downloaded_objects()) == 0
+    assert next(objects) == fruits.objects[0]
+    assert _get_refcount(object_manager, fruits.objects[0]) == 1
+    assert fruits.objects[0] in object_manager.get_downloaded_objects()
+
+    # Consume the second object (the third one is now being downloaded in the background)
+    # and release the objects without exhausting the iterator.
+    assert next(objects) == fruits.objects[1]
+    callback()
+
+    downloaded = object_manager.get_downloaded_objects()
+    assert len(downloaded) in (2, 3)
+    for object_id in fruits.objects:
+        assert _get_refcount(object_manager, object_id) == (0 if object_id in downloaded else None)
+    _assert_cache_occupancy(object_manager, len(downloaded))
+
+    # Releasing twice does nothing
+    callback()
+    assert _get_refcount(object_manager, fruits.objects[0]) == 0
+
+    # Stream the rest of the objects
+    objects, callback = object_manager.prefetch_objects(fruits, fruits.objects, lookahead=2)
+    assert list(objects) == fruits.objects
+    for object_id in fruits.objects:
+        assert _get_refcount(object_manager, object_id) == 1
+    callback()
+    for object_id in fruits.objects:
+        assert _get_refcount(object_manager, object_id) == 0
+    assert len(object_manager.get_downloaded_objects()) == 3
+
+    # Layered querying downloading objects in the background gives the same results.
+    expected = fruits.query(columns=["fruit_id", "name"], quals=None)
+    object_manager.run_eviction(keep_objects=[], required_space=None)
+    assert len(object_manager.get_downloaded_objects()) == 0
+    object_manager.fragment_prefetch = 1
+    assert fruits.query(columns=["fruit_id", "name"], quals=None) == expected
+    for object_id in fruits.objects:
+        assert _get_refcount(object_manager, object_id) == 0
+
+
 def test_object_cache_make_external(pg_repo_local, clean_minio):
     # Test marking objects as external and uploading them to S3
     all_objects = sorted(pg_repo_local.objects.get_all_objects())
@@ -717,6 +854,44 @@ def test_object_manager_object_filtering_end_to_end(local_engine_empty):
             assert set(required_objects) == {obj_1, obj_3, obj_4}
 
 
+def test_object_manager_object_filtering_snapshot(local_engine_empty):
+    objects = _prepare_object_filtering_dataset()
+    obj_1, obj_2, obj_3, obj_4 = objects
+    om = OUTPUT.objects
+    table = OUTPUT.head.get_table("test")
+    quals = [[("col1", ">", 10), ("col4", "=", "2016-01-02 00:00:00")], [("col2", "=", 11)]]
+
+    assert om.filter_fragments(objects, table, quals) == [obj_4]
+
+    # Planning the same table again uses the in-memory index snapshot instead of
+    # querying the metadata engine.
+    with mock.patch.object(om, "get_object_meta", wraps=om.get_object_meta) as gom:
+        with mock.patch(
+            "splitgraph.core.fragment_manager.filter_range_index"
+        ) as engine_filter_range_index:
+            assert om.filter_fragments(objects, table, quals) == [obj_4]
+            assert om.filter_fragments(objects, table, [[("col3", "=", "aaaa")]]) == [obj_1]
+    assert gom.call_count == 0
+    assert engine_filter_range_index.call_count == 0
+
+    # Quals that the snapshot can't evaluate (here, a date that Postgres would cast to a
+    # timestamp) get sent to the engine.
+    with mock.patch(
+        "splitgraph.core.fragment_manager.filter_range_index", wraps=filter_range_index
+    ) as engine_filter_range_index:
+        assert om.filter_fragments(objects, table, [[("col4", "=", "2016-01-02")]]) == [
+            obj_1,
+            obj_4,
+        ]
+    assert engine_filter_range_index.call_count == 1
+
+    # Reindexing the table invalidates the snapshot.
+    table.reindex(extra_indexes={"bloom": {"col3": {"probability": 0.01}}})
+    with mock.patch.object(om, "get_object_meta", wraps=om.get_object_meta) as gom:
+        assert om.filter_fragments(objects, table, [[("col3", "=", "accc")]]) == []
+    assert gom.call_count == 1
+
+
 def test_sync_object_mounts(pg_repo_local, clean_minio):
     # Test the engine discovering objects that were dropped into
     # its local storage and automatically mounting them.
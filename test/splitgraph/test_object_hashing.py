@@ -1,4 +1,6 @@
 import operator
+import os
+import time
 from functools import reduce
 from hashlib import sha256
 from test.splitgraph.conftest import OUTPUT, PG_DATA, load_splitfile
@@ -6,6 +8,7 @@ from test.splitgraph.conftest import OUTPUT, PG_DATA, load_splitfile
 import pytest
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core import fragment_manager
 from splitgraph.core.fragment_manager import Digest
 from splitgraph.core.repository import Repository
 from splitgraph.splitfile.execution import execute_commands
@@ -57,6 +60,55 @@ def test_digest_negation():
     assert (Digest.from_hex(HASH_SUM) + neg_dig).hex() == sub_sum.hex()
 
 
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_digest_batch_sum(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(fragment_manager, "np", None)
+    elif fragment_manager.np is None:
+        pytest.skip("NumPy not installed")
+
+    assert Digest.from_memoryviews([]) == Digest.empty()
+    assert Digest.from_memoryviews(TEST_ROW_HASHES_BYTES).hex() == HASH_SUM
+    assert Digest.from_memoryviews(iter(TEST_ROW_HASHES_BYTES)).hex() == HASH_SUM
+    assert Digest.from_memoryviews(map(memoryview, TEST_ROW_HASHES_BYTES)).hex() == HASH_SUM
+
+    # Check wraparound and batching on a larger set of random hashes
+    monkeypatch.setattr(fragment_manager, "DIGEST_BATCH_SIZE", 7)
+    hashes = [os.urandom(32) for _ in range(100)] + [b"\xff" * 32] * 10
+    assert Digest.from_memoryviews(hashes) == _sum_digests(map(Digest.from_memoryview, hashes))
+
+    with pytest.raises(ValueError):
+        Digest.from_memoryviews([b"\x00" * 31])
+
+
+@pytest.mark.benchmark
+def test_digest_batch_sum_benchmark():
+    hashes = [os.urandom(32) for _ in range(1000000)]
+
+    start = time.perf_counter()
+    expected = _sum_digests(map(Digest.from_memoryview, hashes))
+    reduce_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = Digest.from_memoryviews(hashes)
+    batch_time = time.perf_counter() - start
+
+    print(
+        "Summing %d digests: reduce %.3fs, batched %.3fs (%.1fx)"
+        % (len(hashes), reduce_time, batch_time, reduce_time / batch_time)
+    )
+    assert actual == expected
+
+
+def test_digest_from_sums():
+    shorts = [Digest.from_memoryview(h).shorts for h in TEST_ROW_HASHES_BYTES]
+    sums = [sum(s[i] for s in shorts) for i in range(16)]
+    assert Digest.from_sums(sums).hex() == HASH_SUM
+
+    # Sums over no rows are NULL
+    assert Digest.from_sums([None] * 16) == Digest.empty()
+
+
 def test_base_fragment_hashing(pg_repo_local):
     fruits = pg_repo_local.head.get_table("fruits")
 
@@ -88,6 +140,24 @@ def test_base_fragment_hashing(pg_repo_local):
     )
 
 
+def test_content_hash_engine_sum(pg_repo_local):
+    # Check the hash summed up by the engine matches the sum of row hashes calculated locally.
+    pg_repo_local.run_sql(
+        "INSERT INTO fruits SELECT i + 10, 'fruit_' || i FROM generate_series(1, 1000) i"
+    )
+    row_digests = pg_repo_local.run_sql(
+        "SELECT digest((fruit_id,name)::text, 'sha256'::text) FROM fruits o"
+    )
+    expected = _sum_digests(Digest.from_memoryview(d) for d, in row_digests)
+
+    om = pg_repo_local.objects
+    assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == (expected, 1002)
+
+    # Empty tables have an empty hash
+    pg_repo_local.run_sql("DELETE FROM fruits")
+    assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == (Digest.empty(), 0)
+
+
 def test_base_fragment_reused(pg_repo_local):
     fruits = pg_repo_local.head.get_table("fruits")
 
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+import requests
+
+from splitgraph.core import server
+from splitgraph.exceptions import ObjectIntegrityError
+
+OBJECT_ID = "o" + "a" * 62
+
+
+class _FakeS3Handler(BaseHTTPRequestHandler):
+    """Minimal S3 stand-in: serves files with ranged GETs and MD5 ETags, accepts PUTs
+    and can drop the connection halfway through a response."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        s3 = self.server
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        s3.files[self.path] = data
+        s3.requests.append(("PUT", self.path, None))
+        self.send_response(200)
+        self.send_header("ETag", '"%s"' % hashlib.md5(data).hexdigest())
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        s3 = self.server
+        data = s3.files[self.path]
+        range_header = self.headers.get("Range")
+        s3.requests.append(("GET", self.path, range_header))
+
+        start = 0
+        if range_header:
+            start = int(re.match(r"bytes=(\d+)-", range_header).group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"%s"' % s3.etags.get(self.path, hashlib.md5(data).hexdigest()))
+        self.end_headers()
+
+        if s3.failures:
+            # Send part of the response and drop the connection.
+            s3.failures -= 1
+            self.wfile.write(body[: s3.fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture()
+def fake_s3():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeS3Handler)
+    httpd.files = {}
+    httpd.etags = {}
+    httpd.requests = []
+    httpd.failures = 0
+    httpd.fail_after = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture()
+def object_path(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(server, "SG_ENGINE_OBJECT_PATH", tmpdir)
+        monkeypatch.setattr(server, "RETRY_BACKOFF", 0)
+        monkeypatch.setattr(server, "_CHUNK_SIZE", 1000)
+        yield Path(tmpdir)
+
+
+def _urls(s3):
+    host = "http://127.0.0.1:%d" % s3.server_address[1]
+    return [host + "/" + OBJECT_ID + suffix for suffix in ("", ".footer", ".schema")]
+
+
+def _add_object(s3, size=100000):
+    contents = [os.urandom(size), b"footer", b"[]"]
+    for suffix, data in zip(("", ".footer", ".schema"), contents):
+        s3.files["/" + OBJECT_ID + suffix] = data
+    return contents
+
+
+def _read_object(path):
+    return [(path / (OBJECT_ID + suffix)).read_bytes() for suffix in ("", ".footer", ".schema")]
+
+
+def test_download_object(fake_s3, object_path):
+    contents = _add_object(fake_s3)
+    server.download_object(OBJECT_ID, _urls(fake_s3))
+    assert _read_object(object_path) == contents
+    assert server.list_objects() == [OBJECT_ID]
+    assert [r[2] for r in fake_s3.requests] == [None, None, None]
+
+
+def test_download_object_resume_after_failure(fake_s3, object_path):
+    contents = _add_object(fake_s3)
+    fake_s3.failures = 2
+    fake_s3.fail_after = 30000
+
+    server.download_object(OBJECT_ID, _urls(fake_s3))
+    assert _read_object(object_path) == contents
+
+    # The download got resumed twice from where the connection was dropped
+    # (re-requesting the last byte that we already had).
+    assert [r[2] for r in fake_s3.requests] == [
+        None,
+        "bytes=29999-",
+        "bytes=59998-",
+        None,
+        None,
+    ]
+
+
+def test_download_object_resume_next_attempt(fake_s3, object_path, monkeypatch):
+    contents = _add_object(fake_s3)
+    monkeypatch.setattr(server, "TRANSFER_RETRIES", 0)
+    fake_s3.failures = 1
+    fake_s3.fail_after = 30000
+
+    with pytest.raises(requests.RequestException):
+        server.download_object(OBJECT_ID, _urls(fake_s3))
+
+    # The object doesn't exist yet, but the partially downloaded file was kept.
+    assert server.list_objects() == []
+    assert not server.object_exists(OBJECT_ID)
+    assert (object_path / (OBJECT_ID + server.PARTIAL_SUFFIX)).stat().st_size == 30000
+
+    # The next attempt (e.g. after getting new presigned URLs) picks up where we left off.
+    server.download_object(OBJECT_ID, _urls(fake_s3))
+    assert _read_object(object_path) == contents
+    assert fake_s3.requests[1][2] == "bytes=29999-"
+    assert server.list_objects() == [OBJECT_ID]
+
+    # Deleting the object also deletes any partial files
+    (object_path / (OBJECT_ID + server.PARTIAL_SUFFIX)).write_bytes(b"test")
+    server.delete_object_files(OBJECT_ID)
+    assert os.listdir(object_path) == []
+
+
+def test_list_partial_objects(fake_s3, object_path, monkeypatch):
+    _add_object(fake_s3)
+    monkeypatch.setattr(server, "TRANSFER_RETRIES", 0)
+    fake_s3.failures = 1
+    fake_s3.fail_after = 30000
+
+    with pytest.raises(requests.RequestException):
+        server.download_object(OBJECT_ID, _urls(fake_s3))
+    other_object = "o" + "b" * 62
+    (object_path / (other_object + ".footer" + server.PARTIAL_SUFFIX)).write_bytes(b"test")
+
+    assert server.list_objects() == []
+    assert server.list_partial_objects() == [OBJECT_ID, other_object]
+
+    # Deleting an object cleans up its partial files
+    server.delete_object_files(other_object)
+    assert server.list_partial_objects() == [OBJECT_ID]
+
+
+def test_download_object_checksum_mismatch(fake_s3, object_path):
+    _add_object(fake_s3)
+    fake_s3.etags["/" + OBJECT_ID] = "0" * 32
+
+    with pytest.raises(ObjectIntegrityError):
+        server.download_object(OBJECT_ID, _urls(fake_s3))
+
+    # Corrupted downloads aren't kept around and the object never gets moved into place.
+    assert not server.object_exists(OBJECT_ID)
+    assert not (object_path / (OBJECT_ID + server.PARTIAL_SUFFIX)).exists()
+    # Downloads with mismatched checksums get retried
+    assert len([r for r in fake_s3.requests if r[1] == "/" + OBJECT_ID]) == (
+        server.TRANSFER_RETRIES + 1
+    )
+
+
+def test_download_object_partial_file_too_long(fake_s3, object_path):
+    contents = _add_object(fake_s3, size=1000)
+    (object_path / (OBJECT_ID + server.PARTIAL_SUFFIX)).write_bytes(b"0" * 2000)
+
+    server.download_object(OBJECT_ID, _urls(fake_s3))
+    assert _read_object(object_path) == contents
+
+
+def test_upload_object(fake_s3, object_path):
+    contents = [os.urandom(100000), b"footer", b"[]"]
+    for suffix, data in zip(("", ".footer", ".schema"), contents):
+        (object_path / (OBJECT_ID + suffix)).write_bytes(data)
+
+    server.upload_object(OBJECT_ID, _urls(fake_s3))
+    assert [fake_s3.files["/" + OBJECT_ID + s] for s in ("", ".footer", ".schema")] == contents